@@ -0,0 +1,95 @@
+"""
+JSON encoding of OCPP-J frames.
+
+Frames are decoded and encoded with orjson when it is installed (pip install
+orjson) and with the standard library otherwise; OCPP_JSON_BACKEND forces one
+of them. unpack() also accepts frames that were already decoded, so a frame
+is parsed at most once between the websocket and the handlers.
+"""
+import decimal
+import json
+import os
+from typing import Any, Union
+
+from ocpp.exceptions import FormatViolationError, PropertyConstraintViolationError, ProtocolError
+from ocpp.messages import Call, CallError, CallResult
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+OCPP_JSON_BACKEND = os.getenv("OCPP_JSON_BACKEND", "auto").lower()
+
+if OCPP_JSON_BACKEND == "orjson" and orjson is None:
+    raise RuntimeError("OCPP_JSON_BACKEND=orjson requires the orjson package (pip install orjson)")
+USE_ORJSON = orjson is not None and OCPP_JSON_BACKEND in ("auto", "orjson")
+
+Message = Union[Call, CallResult, CallError]
+
+
+def _default(value: Any):
+    """Encode the values json cannot, the same way as the ocpp library does"""
+    if isinstance(value, decimal.Decimal):
+        return float("%.1f" % value)
+    if hasattr(value, "to_json"):
+        return value.to_json()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class _Encoder(json.JSONEncoder):
+    def default(self, value: Any):
+        return _default(value)
+
+
+if USE_ORJSON:
+    loads = orjson.loads
+
+    def dumps(value: Any) -> str:
+        return orjson.dumps(value, default=_default).decode()
+else:
+    loads = json.loads
+
+    def dumps(value: Any) -> str:
+        return json.dumps(value, separators=(",", ":"), cls=_Encoder)
+
+
+def unpack(frame: Union[str, bytes, list]) -> Message:
+    """Build the Call, CallResult or CallError for a raw or already decoded frame"""
+    if isinstance(frame, (str, bytes)):
+        try:
+            frame = loads(frame)
+        except (ValueError, UnicodeDecodeError):
+            raise FormatViolationError(
+                details={"cause": "Message is not valid JSON", "ocpp_message": frame}
+            )
+
+    if not isinstance(frame, list):
+        raise ProtocolError(details={
+            "cause": f"OCPP message hasn't the correct format. It should be a list, but got '{type(frame)}' instead"
+        })
+    if not frame:
+        raise ProtocolError(details={"cause": "Message does not contain MessageTypeId"})
+
+    for cls in (Call, CallResult, CallError):
+        if frame[0] == cls.message_type_id:
+            try:
+                return cls(*frame[1:])
+            except TypeError:
+                raise ProtocolError(details={"cause": "Message is missing elements."})
+
+    raise PropertyConstraintViolationError(details={"cause": f"MessageTypeId '{frame[0]}' isn't valid"})
+
+
+def pack(message: Message) -> str:
+    """Serialize a Call, CallResult or CallError into its frame"""
+    if isinstance(message, Call):
+        frame = [message.message_type_id, message.unique_id, message.action, message.payload]
+    elif isinstance(message, CallResult):
+        frame = [message.message_type_id, message.unique_id, message.payload]
+    else:
+        frame = [
+            message.message_type_id, message.unique_id, message.error_code,
+            message.error_description, message.error_details
+        ]
+    return dumps(frame)
@@ -0,0 +1,275 @@
+"""
+Protocol trace of the OCPP frames exchanged with charge points.
+
+Only the message type, unique id and action are read from each frame, with an
+anchored regex over its first bytes instead of a JSON parse. Records are put
+on a bounded queue as-is and formatted and written by a QueueListener thread,
+so the event loop never formats or writes trace output; when the queue is
+full records are dropped and counted.
+
+Which frames are traced is decided per unique id, so a call and its result
+are sampled together. The rate comes from a per-charger override, then a
+per-action override, then the global rate. Full payloads are only captured
+when enabled globally or for a charger or action. All settings can be changed
+at runtime through protocol_trace.update().
+"""
+import json
+import logging
+import os
+import queue
+import re
+import sys
+import time
+import zlib
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional, Set
+
+logger = logging.getLogger("ocpp.adapter")
+trace_logger = logging.getLogger("ocpp.trace")
+
+
+def parse_rates(value: str) -> Dict[str, float]:
+    """Parse "Heartbeat=0.01,MeterValues=0.1" into a rate per name"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, rate = item.partition("=")
+        rates[name.strip()] = float(rate)
+    return rates
+
+
+PROTOCOL_TRACE_ENABLED = os.getenv("PROTOCOL_TRACE_ENABLED", "true").lower() == "true"
+PROTOCOL_TRACE_SAMPLE_RATE = float(os.getenv("PROTOCOL_TRACE_SAMPLE_RATE", "1.0"))
+PROTOCOL_TRACE_ACTION_RATES = parse_rates(os.getenv("PROTOCOL_TRACE_ACTION_RATES", ""))
+PROTOCOL_TRACE_PAYLOADS = os.getenv("PROTOCOL_TRACE_PAYLOADS", "false").lower() == "true"
+PROTOCOL_TRACE_FORMAT = os.getenv("PROTOCOL_TRACE_FORMAT", "text").lower()
+PROTOCOL_TRACE_QUEUE_SIZE = int(os.getenv("PROTOCOL_TRACE_QUEUE_SIZE", "10000"))
+
+MESSAGE_TYPES = {2: "CALL", 3: "CALLRESULT", 4: "CALLERROR"}
+
+# [<type>, "<unique id>"(, "<action or error code>")
+HEADER_PATTERN = re.compile(r'\s*\[\s*([234])\s*,\s*"((?:[^"\\]|\\.){0,64})"\s*(?:,\s*"([A-Za-z0-9_.]{1,64})")?')
+
+# Unanswered calls remembered per connection for latency and action lookups
+MAX_PENDING_PER_CONNECTION = 100
+
+
+def scan_header(message: str):
+    """Return (message type, unique id, action or error code) of a frame, or None if it is malformed"""
+    match = HEADER_PATTERN.match(message)
+    if match is None:
+        return None
+    message_type = int(match.group(1))
+    return message_type, match.group(2), match.group(3) if message_type != 3 else None
+
+
+class TraceFormatter(logging.Formatter):
+    """Render trace records as text lines or JSON objects"""
+
+    def __init__(self, output_format: str = PROTOCOL_TRACE_FORMAT):
+        super().__init__()
+        self.output_format = output_format
+
+    def format(self, record: logging.LogRecord) -> str:
+        trace = getattr(record, "trace", None)
+        if trace is None:
+            return super().format(record)
+
+        if self.output_format == "json":
+            return json.dumps({"time": record.created, **trace}, default=str)
+
+        arrow = "⬅️ " if trace["direction"] == "in" else "➡️ "
+        parts = [
+            f"{self.formatTime(record)} - {arrow} {trace['type']}",
+            f"Charger: {trace['charger']}",
+            f"ID: {trace['id']}",
+        ]
+        if trace.get("action"):
+            parts.append(f"Action: {trace['action']}")
+        if trace.get("error_code"):
+            parts.append(f"Error: {trace['error_code']}")
+        if trace.get("latency_ms") is not None:
+            parts.append(f"Latency: {trace['latency_ms']:.2f}ms")
+        parts.append(f"Size: {trace['size']}B")
+        if "payload" in trace:
+            parts.append(f"Payload: {trace['payload']}")
+        return " | ".join(parts)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that leaves formatting to the listener and drops records when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Trace records carry only plain values, formatting happens in the listener thread
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class DrainingQueueListener(QueueListener):
+    def enqueue_sentinel(self):
+        # Wait for room instead of failing when stop() is called with a full queue
+        self.queue.put(self._sentinel)
+
+
+class ConnectionTrace:
+    """Traces the frames of one charge point connection"""
+
+    def __init__(self, tracer: "ProtocolTrace", charge_point_id: str):
+        self.tracer = tracer
+        self.charge_point_id = charge_point_id
+        # unique id -> (action, monotonic time) of traced calls awaiting their result
+        self._received_calls: Dict[str, tuple] = {}
+        self._sent_calls: Dict[str, tuple] = {}
+
+    def received(self, message: str):
+        if self.tracer.enabled:
+            self._trace("in", message, self._received_calls, self._sent_calls)
+
+    def sent(self, message: str):
+        if self.tracer.enabled:
+            self._trace("out", message, self._sent_calls, self._received_calls)
+
+    def _trace(self, direction: str, message: str, own_calls: Dict[str, tuple], peer_calls: Dict[str, tuple]):
+        header = scan_header(message)
+        if header is None:
+            trace_logger.warning(
+                "Unparseable frame", extra={"trace": {
+                    "direction": direction, "charger": self.charge_point_id, "type": "INVALID",
+                    "id": None, "size": len(message), "payload": message[:512]
+                }}
+            )
+            return
+
+        message_type, unique_id, name = header
+        latency_ms = None
+        if message_type == 2:
+            action = name
+            if not self.tracer.sampled(self.charge_point_id, action, unique_id):
+                return
+            if len(own_calls) >= MAX_PENDING_PER_CONNECTION:
+                own_calls.pop(next(iter(own_calls)))
+            own_calls[unique_id] = (action, time.monotonic())
+        else:
+            # Results are traced when their call was
+            pending = peer_calls.pop(unique_id, None)
+            if pending is None:
+                return
+            action = pending[0]
+            latency_ms = (time.monotonic() - pending[1]) * 1000
+
+        trace = {
+            "direction": direction,
+            "charger": self.charge_point_id,
+            "type": MESSAGE_TYPES[message_type],
+            "id": unique_id,
+            "action": action,
+            "latency_ms": latency_ms,
+            "size": len(message),
+        }
+        if message_type == 4:
+            trace["error_code"] = name
+        if self.tracer.captures_payload(self.charge_point_id, action):
+            trace["payload"] = message
+        trace_logger.info("OCPP frame", extra={"trace": trace})
+
+
+class ProtocolTrace:
+    def __init__(
+        self,
+        enabled: bool = PROTOCOL_TRACE_ENABLED,
+        sample_rate: float = PROTOCOL_TRACE_SAMPLE_RATE,
+        action_rates: Optional[Dict[str, float]] = None,
+        capture_payloads: bool = PROTOCOL_TRACE_PAYLOADS
+    ):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.action_rates: Dict[str, float] = dict(PROTOCOL_TRACE_ACTION_RATES if action_rates is None else action_rates)
+        self.charger_rates: Dict[str, float] = {}
+        self.capture_payloads = capture_payloads
+        self.payload_chargers: Set[str] = set()
+        self.payload_actions: Set[str] = set()
+
+        self._handler: Optional[DroppingQueueHandler] = None
+        self._listener: Optional[DrainingQueueListener] = None
+
+    def connection(self, charge_point_id: str) -> ConnectionTrace:
+        return ConnectionTrace(self, charge_point_id)
+
+    def sampled(self, charge_point_id: str, action: Optional[str], unique_id: str) -> bool:
+        rate = self.charger_rates.get(charge_point_id)
+        if rate is None:
+            rate = self.action_rates.get(action, self.sample_rate)
+        if rate >= 1:
+            return True
+        if rate <= 0:
+            return False
+        return zlib.crc32(unique_id.encode()) < rate * 0x100000000
+
+    def captures_payload(self, charge_point_id: str, action: Optional[str]) -> bool:
+        return self.capture_payloads or charge_point_id in self.payload_chargers or action in self.payload_actions
+
+    def settings(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "action_rates": self.action_rates,
+            "charger_rates": self.charger_rates,
+            "capture_payloads": self.capture_payloads,
+            "payload_chargers": sorted(self.payload_chargers),
+            "payload_actions": sorted(self.payload_actions),
+            "dropped": self._handler.dropped if self._handler else 0,
+        }
+
+    def update(self, **settings) -> Dict[str, Any]:
+        """Change trace settings at runtime; nothing is applied if any key or value is invalid"""
+        values = {}
+        for key, value in settings.items():
+            if key in ("enabled", "capture_payloads"):
+                values[key] = bool(value)
+            elif key == "sample_rate":
+                values[key] = float(value)
+            elif key in ("action_rates", "charger_rates"):
+                values[key] = {name: float(rate) for name, rate in value.items()}
+            elif key in ("payload_chargers", "payload_actions"):
+                values[key] = set(value)
+            else:
+                raise ValueError(f"Unknown protocol trace setting: {key}")
+        for key, value in values.items():
+            setattr(self, key, value)
+        logger.info(f"Protocol trace settings updated: {settings}")
+        return self.settings()
+
+    def start(self, queue_size: int = PROTOCOL_TRACE_QUEUE_SIZE, output_format: str = PROTOCOL_TRACE_FORMAT):
+        """Route trace records through a queue to a stdout writer thread"""
+        if self._listener is not None:
+            return
+        output = logging.StreamHandler(sys.stdout)
+        output.setFormatter(TraceFormatter(output_format))
+        log_queue = queue.Queue(maxsize=queue_size)
+        self._handler = DroppingQueueHandler(log_queue)
+        self._listener = DrainingQueueListener(log_queue, output, respect_handler_level=False)
+
+        trace_logger.addHandler(self._handler)
+        trace_logger.setLevel(logging.INFO)
+        trace_logger.propagate = False
+        self._listener.start()
+
+    def stop(self):
+        """Flush queued records and stop the writer thread"""
+        if self._listener is None:
+            return
+        self._listener.stop()
+        trace_logger.removeHandler(self._handler)
+        trace_logger.propagate = True
+        self._listener = None
+
+
+protocol_trace = ProtocolTrace()
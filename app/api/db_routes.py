@@ -1,5 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
 from datetime import datetime
 import logging
@@ -10,16 +10,23 @@ from ..database.schemas import (
     SiteCreate, SiteUpdate, SiteResponse,
     ChargerCreate, ChargerUpdate, ChargerResponse,
     ConnectorCreate, ConnectorUpdate, ConnectorResponse,
+    DriversGroupCreate, DriversGroupUpdate, DriversGroupResponse,
     DriverCreate, DriverUpdate, DriverResponse,
     RFIDCardCreate, RFIDCardUpdate, RFIDCardResponse,
     ChargeSessionCreate, ChargeSessionUpdate, ChargeSessionResponse,
-    EventsDataCreate, EventsDataResponse
+    EventsDataCreate, EventsDataResponse,
+    MeterSampleResponse
 )
 from ..database.repositories.repositories import (
     CompanyRepository, SiteRepository, ChargerRepository,
-    ConnectorRepository, DriverRepository, RFIDCardRepository,
-    ChargeSessionRepository
+    ConnectorRepository, DriversGroupRepository, DriverRepository, RFIDCardRepository,
+    ChargeSessionRepository, MeterSampleRepository, RowInUse
 )
+from ..services.auth_cache import authorization_cache
+from ..services.charger_directory import charger_directory
+from ..services.local_list import local_list
+from ..services.meter_values import MEASURAND_CODES
+from ..services.ocpp_service import OCPPService
 
 router = APIRouter(prefix="/db", tags=["database"])
 logger = logging.getLogger("ocpp.db_routes")
@@ -29,38 +36,40 @@ logger = logging.getLogger("ocpp.db_routes")
 async def get_companies(
     skip: int = 0, 
     limit: int = 100,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    companies = CompanyRepository.get_companies(db, skip=skip, limit=limit)
+    companies = await CompanyRepository.get_companies(db, skip=skip, limit=limit)
     return companies
 
 @router.get("/companies/{company_id}", response_model=CompanyResponse)
-async def get_company(company_id: str, db: Session = Depends(get_db)):
-    company = CompanyRepository.get_company(db, company_id)
+async def get_company(company_id: str, db: AsyncSession = Depends(get_db)):
+    company = await CompanyRepository.get_company(db, company_id)
     if not company:
         raise HTTPException(status_code=404, detail="Company not found")
     return company
 
 @router.post("/companies/", response_model=CompanyResponse)
-async def create_company(company: CompanyCreate, db: Session = Depends(get_db)):
-    existing_company = CompanyRepository.get_company(db, company.CompanyId)
+async def create_company(company: CompanyCreate, db: AsyncSession = Depends(get_db)):
+    existing_company = await CompanyRepository.get_company(db, company.CompanyId)
     if existing_company:
         raise HTTPException(status_code=400, detail="Company ID already registered")
-    return CompanyRepository.create_company(db, company.dict())
+    return await CompanyRepository.create_company(db, company.dict())
 
 @router.put("/companies/{company_id}", response_model=CompanyResponse)
-async def update_company(company_id: str, company: CompanyUpdate, db: Session = Depends(get_db)):
-    db_company = CompanyRepository.get_company(db, company_id)
+async def update_company(company_id: str, company: CompanyUpdate, db: AsyncSession = Depends(get_db)):
+    db_company = await CompanyRepository.update_company(db, company_id, company.dict(exclude_unset=True))
     if not db_company:
         raise HTTPException(status_code=404, detail="Company not found")
-    return CompanyRepository.update_company(db, company_id, company.dict(exclude_unset=True))
+    return db_company
 
 @router.delete("/companies/{company_id}")
-async def delete_company(company_id: str, db: Session = Depends(get_db)):
-    db_company = CompanyRepository.get_company(db, company_id)
-    if not db_company:
+async def delete_company(company_id: str, db: AsyncSession = Depends(get_db)):
+    try:
+        result = await CompanyRepository.delete_company(db, company_id)
+    except RowInUse as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not result:
         raise HTTPException(status_code=404, detail="Company not found")
-    result = CompanyRepository.delete_company(db, company_id)
     return {"success": result}
 
 # Site endpoints
@@ -69,53 +78,55 @@ async def get_sites(
     company_id: Optional[str] = None,
     skip: int = 0, 
     limit: int = 100, 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    sites = SiteRepository.get_sites(db, company_id=company_id, skip=skip, limit=limit)
+    sites = await SiteRepository.get_sites(db, company_id=company_id, skip=skip, limit=limit)
     return sites
 
 @router.get("/companies/{company_id}/sites/", response_model=List[SiteResponse])
-async def get_company_sites(company_id: str, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    sites = SiteRepository.get_sites(db, company_id=company_id, skip=skip, limit=limit)
+async def get_company_sites(company_id: str, skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_db)):
+    sites = await SiteRepository.get_sites(db, company_id=company_id, skip=skip, limit=limit)
     return sites
 
 @router.get("/companies/{company_id}/sites/{site_id}", response_model=SiteResponse)
-async def get_site(company_id: str, site_id: str, db: Session = Depends(get_db)):
-    site = SiteRepository.get_site(db, company_id, site_id)
+async def get_site(company_id: str, site_id: str, db: AsyncSession = Depends(get_db)):
+    site = await SiteRepository.get_site(db, company_id, site_id)
     if not site:
         raise HTTPException(status_code=404, detail="Site not found")
     return site
 
 @router.post("/sites/", response_model=SiteResponse)
-async def create_site(site: SiteCreate, db: Session = Depends(get_db)):
-    company = CompanyRepository.get_company(db, site.SiteCompanyID)
+async def create_site(site: SiteCreate, db: AsyncSession = Depends(get_db)):
+    company = await CompanyRepository.get_company(db, site.SiteCompanyID)
     if not company:
         raise HTTPException(status_code=404, detail="Company not found")
     
-    existing_site = SiteRepository.get_site(db, site.SiteCompanyID, site.SiteId)
+    existing_site = await SiteRepository.get_site(db, site.SiteCompanyID, site.SiteId)
     if existing_site:
         raise HTTPException(status_code=400, detail="Site ID already registered for this company")
     
-    return SiteRepository.create_site(db, site.dict())
+    return await SiteRepository.create_site(db, site.dict())
 
 @router.put("/companies/{company_id}/sites/{site_id}", response_model=SiteResponse)
 async def update_site(
     company_id: str, 
     site_id: str, 
     site: SiteUpdate, 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    db_site = SiteRepository.get_site(db, company_id, site_id)
+    db_site = await SiteRepository.update_site(db, company_id, site_id, site.dict(exclude_unset=True))
     if not db_site:
         raise HTTPException(status_code=404, detail="Site not found")
-    return SiteRepository.update_site(db, company_id, site_id, site.dict(exclude_unset=True))
+    return db_site
 
 @router.delete("/companies/{company_id}/sites/{site_id}")
-async def delete_site(company_id: str, site_id: str, db: Session = Depends(get_db)):
-    db_site = SiteRepository.get_site(db, company_id, site_id)
-    if not db_site:
+async def delete_site(company_id: str, site_id: str, db: AsyncSession = Depends(get_db)):
+    try:
+        result = await SiteRepository.delete_site(db, company_id, site_id)
+    except RowInUse as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not result:
         raise HTTPException(status_code=404, detail="Site not found")
-    result = SiteRepository.delete_site(db, company_id, site_id)
     return {"success": result}
 
 # Charger endpoints
@@ -125,9 +136,9 @@ async def get_chargers(
     site_id: Optional[str] = None,
     skip: int = 0, 
     limit: int = 100, 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    chargers = ChargerRepository.get_chargers(
+    chargers = await ChargerRepository.get_chargers(
         db, company_id=company_id, site_id=site_id, skip=skip, limit=limit
     )
     return chargers
@@ -141,9 +152,9 @@ async def get_site_chargers(
     site_id: str, 
     skip: int = 0, 
     limit: int = 100, 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    chargers = ChargerRepository.get_chargers(
+    chargers = await ChargerRepository.get_chargers(
         db, company_id=company_id, site_id=site_id, skip=skip, limit=limit
     )
     return chargers
@@ -156,26 +167,34 @@ async def get_charger(
     company_id: str, 
     site_id: str, 
     charger_id: str, 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    charger = ChargerRepository.get_charger(db, company_id, site_id, charger_id)
+    charger = await ChargerRepository.get_charger(db, company_id, site_id, charger_id)
     if not charger:
         raise HTTPException(status_code=404, detail="Charger not found")
     return charger
 
 @router.post("/chargers/", response_model=ChargerResponse)
-async def create_charger(charger: ChargerCreate, db: Session = Depends(get_db)):
-    site = SiteRepository.get_site(db, charger.ChargerCompanyId, charger.ChargerSiteId)
+async def create_charger(charger: ChargerCreate, db: AsyncSession = Depends(get_db)):
+    site = await SiteRepository.get_site(db, charger.ChargerCompanyId, charger.ChargerSiteId)
     if not site:
         raise HTTPException(status_code=404, detail="Site not found")
     
-    existing_charger = ChargerRepository.get_charger(
+    existing_charger = await ChargerRepository.get_charger(
         db, charger.ChargerCompanyId, charger.ChargerSiteId, charger.ChargerId
     )
     if existing_charger:
         raise HTTPException(status_code=400, detail="Charger ID already registered for this site")
+    # The OCPP identity alone has to resolve the charger
+    other = charger_directory.get(charger.ChargerId)
+    if other is not None:
+        raise HTTPException(
+            status_code=400, detail=f"Charger ID already registered for site {other.company_id}/{other.site_id}"
+        )
     
-    return ChargerRepository.create_charger(db, charger.dict())
+    db_charger = await ChargerRepository.create_charger(db, charger.dict())
+    charger_directory.update(db_charger)
+    return db_charger
 
 @router.put(
     "/companies/{company_id}/sites/{site_id}/chargers/{charger_id}", 
@@ -186,26 +205,30 @@ async def update_charger(
     site_id: str, 
     charger_id: str, 
     charger: ChargerUpdate, 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    db_charger = ChargerRepository.get_charger(db, company_id, site_id, charger_id)
-    if not db_charger:
-        raise HTTPException(status_code=404, detail="Charger not found")
-    return ChargerRepository.update_charger(
+    db_charger = await ChargerRepository.update_charger(
         db, company_id, site_id, charger_id, charger.dict(exclude_unset=True)
     )
+    if not db_charger:
+        raise HTTPException(status_code=404, detail="Charger not found")
+    charger_directory.update(db_charger)
+    return db_charger
 
 @router.delete("/companies/{company_id}/sites/{site_id}/chargers/{charger_id}")
 async def delete_charger(
     company_id: str, 
     site_id: str, 
     charger_id: str, 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    db_charger = ChargerRepository.get_charger(db, company_id, site_id, charger_id)
-    if not db_charger:
+    try:
+        result = await ChargerRepository.delete_charger(db, company_id, site_id, charger_id)
+    except RowInUse as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not result:
         raise HTTPException(status_code=404, detail="Charger not found")
-    result = ChargerRepository.delete_charger(db, company_id, site_id, charger_id)
+    charger_directory.remove(company_id, site_id, charger_id)
     return {"success": result}
 
 # Update status for charger
@@ -219,15 +242,14 @@ async def update_charger_status(
     charger_id: str, 
     status: str = Query(..., description="New status of the charger"),
     is_online: Optional[bool] = Query(None, description="Online status of the charger"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    db_charger = ChargerRepository.get_charger(db, company_id, site_id, charger_id)
-    if not db_charger:
-        raise HTTPException(status_code=404, detail="Charger not found")
-    
-    return ChargerRepository.update_charger_status(
+    db_charger = await ChargerRepository.update_charger_status(
         db, company_id, site_id, charger_id, status, is_online
     )
+    if not db_charger:
+        raise HTTPException(status_code=404, detail="Charger not found")
+    return db_charger
 
 # Connector endpoints
 @router.get(
@@ -240,9 +262,9 @@ async def get_charger_connectors(
     charger_id: str, 
     skip: int = 0, 
     limit: int = 100, 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    connectors = ConnectorRepository.get_connectors(
+    connectors = await ConnectorRepository.get_connectors(
         db, company_id=company_id, site_id=site_id, charger_id=charger_id, skip=skip, limit=limit
     )
     return connectors
@@ -256,29 +278,29 @@ async def get_connector(
     site_id: str, 
     charger_id: str, 
     connector_id: str, 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    connector = ConnectorRepository.get_connector(db, company_id, site_id, charger_id, connector_id)
+    connector = await ConnectorRepository.get_connector(db, company_id, site_id, charger_id, connector_id)
     if not connector:
         raise HTTPException(status_code=404, detail="Connector not found")
     return connector
 
 @router.post("/connectors/", response_model=ConnectorResponse)
-async def create_connector(connector: ConnectorCreate, db: Session = Depends(get_db)):
-    charger = ChargerRepository.get_charger(
+async def create_connector(connector: ConnectorCreate, db: AsyncSession = Depends(get_db)):
+    charger = await ChargerRepository.get_charger(
         db, connector.ConnectorCompanyId, connector.ConnectorSiteId, connector.ConnectorChargerId
     )
     if not charger:
         raise HTTPException(status_code=404, detail="Charger not found")
     
-    existing_connector = ConnectorRepository.get_connector(
+    existing_connector = await ConnectorRepository.get_connector(
         db, connector.ConnectorCompanyId, connector.ConnectorSiteId, 
         connector.ConnectorChargerId, connector.ConnectorId
     )
     if existing_connector:
         raise HTTPException(status_code=400, detail="Connector ID already registered for this charger")
     
-    return ConnectorRepository.create_connector(db, connector.dict())
+    return await ConnectorRepository.create_connector(db, connector.dict())
 
 @router.get("/charge-sessions/", response_model=List[ChargeSessionResponse])
 async def get_charge_sessions(
@@ -290,9 +312,9 @@ async def get_charge_sessions(
     end_date: Optional[datetime] = None,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    sessions = ChargeSessionRepository.get_sessions(
+    sessions = await ChargeSessionRepository.get_sessions(
         db, company_id=company_id, site_id=site_id, charger_id=charger_id,
         driver_id=driver_id, start_date=start_date, end_date=end_date,
         skip=skip, limit=limit
@@ -300,35 +322,34 @@ async def get_charge_sessions(
     return sessions
 
 @router.get("/charge-sessions/{session_id}", response_model=ChargeSessionResponse)
-async def get_charge_session(session_id: int, db: Session = Depends(get_db)):
-    session = ChargeSessionRepository.get_session(db, session_id)
+async def get_charge_session(session_id: int, db: AsyncSession = Depends(get_db)):
+    session = await ChargeSessionRepository.get_session(db, session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Charge session not found")
     return session
 
 @router.post("/charge-sessions/", response_model=ChargeSessionResponse)
-async def create_charge_session(session: ChargeSessionCreate, db: Session = Depends(get_db)):
+async def create_charge_session(session: ChargeSessionCreate, db: AsyncSession = Depends(get_db)):
     # Validate company, site, charger, connector
-    charger = ChargerRepository.get_charger(
+    charger = await ChargerRepository.get_charger(
         db, session.ChargerSessionCompanyId, session.ChargerSessionSiteId, session.ChargerSessionChargerId
     )
     if not charger:
         raise HTTPException(status_code=404, detail="Charger not found")
     
     # Create the charge session
-    return ChargeSessionRepository.create_session(db, session.dict())
+    return await ChargeSessionRepository.create_session(db, session.dict())
 
 @router.put("/charge-sessions/{session_id}", response_model=ChargeSessionResponse)
 async def update_charge_session(
     session_id: int, 
     session: ChargeSessionUpdate, 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    db_session = ChargeSessionRepository.get_session(db, session_id)
+    db_session = await ChargeSessionRepository.update_session(db, session_id, session.dict(exclude_unset=True))
     if not db_session:
         raise HTTPException(status_code=404, detail="Charge session not found")
-    
-    return ChargeSessionRepository.update_session(db, session_id, session.dict(exclude_unset=True))
+    return db_session
 
 @router.put("/charge-sessions/{session_id}/end", response_model=ChargeSessionResponse)
 async def end_charge_session(
@@ -337,19 +358,83 @@ async def end_charge_session(
     energy_kwh: int,
     reason: str = "Completed",
     cost: Optional[float] = None,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    db_session = ChargeSessionRepository.get_session(db, session_id)
+    db_session = await ChargeSessionRepository.get_session(db, session_id)
     if not db_session:
         raise HTTPException(status_code=404, detail="Charge session not found")
     
     if db_session.ChargerSessionEnd:
         raise HTTPException(status_code=400, detail="Charge session already ended")
     
-    return ChargeSessionRepository.end_session(
+    return await ChargeSessionRepository.end_session(
         db, session_id, end_time, energy_kwh, reason, cost
     )
 
+@router.get("/charge-sessions/{session_id}/meter-samples", response_model=List[MeterSampleResponse])
+async def get_charge_session_meter_samples(
+    session_id: int,
+    measurand: Optional[str] = Query(None, description="OCPP measurand, e.g. Energy.Active.Import.Register"),
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None,
+    skip: int = 0,
+    limit: int = 1000,
+    db: AsyncSession = Depends(get_db)
+):
+    measurand_code = None
+    if measurand:
+        measurand_code = MEASURAND_CODES.get(measurand)
+        if measurand_code is None:
+            raise HTTPException(status_code=400, detail="Unknown measurand")
+    
+    return await MeterSampleRepository.get_samples(
+        db, session_id, measurand=measurand_code, start_time=start_time,
+        end_time=end_time, skip=skip, limit=limit
+    )
+
+# Drivers group endpoints
+@router.get("/drivers-groups/", response_model=List[DriversGroupResponse])
+async def get_drivers_groups(skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_db)):
+    return await DriversGroupRepository.get_drivers_groups(db, skip=skip, limit=limit)
+
+@router.get("/drivers-groups/{group_id}", response_model=DriversGroupResponse)
+async def get_drivers_group(group_id: str, db: AsyncSession = Depends(get_db)):
+    group = await DriversGroupRepository.get_drivers_group(db, group_id)
+    if not group:
+        raise HTTPException(status_code=404, detail="Drivers group not found")
+    return group
+
+@router.post("/drivers-groups/", response_model=DriversGroupResponse)
+async def create_drivers_group(group: DriversGroupCreate, db: AsyncSession = Depends(get_db)):
+    existing_group = await DriversGroupRepository.get_drivers_group(db, group.DriversGroupId)
+    if existing_group:
+        raise HTTPException(status_code=400, detail="Drivers group ID already registered")
+    return await DriversGroupRepository.create_drivers_group(db, group.dict())
+
+@router.put("/drivers-groups/{group_id}", response_model=DriversGroupResponse)
+async def update_drivers_group(group_id: str, group: DriversGroupUpdate, db: AsyncSession = Depends(get_db)):
+    updated_group = await DriversGroupRepository.update_drivers_group(
+        db, group_id, group.dict(exclude_unset=True)
+    )
+    if not updated_group:
+        raise HTTPException(status_code=404, detail="Drivers group not found")
+    # Enabling or disabling a group changes the status of all its drivers' tags
+    authorization_cache.invalidate_group(group_id)
+    for company_id in await DriversGroupRepository.get_company_ids(db, group_id):
+        local_list.request_publish(company_id)
+    return updated_group
+
+@router.delete("/drivers-groups/{group_id}")
+async def delete_drivers_group(group_id: str, db: AsyncSession = Depends(get_db)):
+    try:
+        result = await DriversGroupRepository.delete_drivers_group(db, group_id)
+    except RowInUse as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not result:
+        raise HTTPException(status_code=404, detail="Drivers group not found")
+    authorization_cache.invalidate_group(group_id)
+    return {"success": result}
+
 # Driver endpoints
 @router.get("/drivers/", response_model=List[DriverResponse])
 async def get_drivers(
@@ -357,9 +442,9 @@ async def get_drivers(
     group_id: Optional[str] = None,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    drivers = DriverRepository.get_drivers(
+    drivers = await DriverRepository.get_drivers(
         db, company_id=company_id, group_id=group_id, skip=skip, limit=limit
     )
     return drivers
@@ -370,54 +455,58 @@ async def get_company_drivers(
     group_id: Optional[str] = None,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    drivers = DriverRepository.get_drivers(
+    drivers = await DriverRepository.get_drivers(
         db, company_id=company_id, group_id=group_id, skip=skip, limit=limit
     )
     return drivers
 
 @router.get("/companies/{company_id}/drivers/{driver_id}", response_model=DriverResponse)
-async def get_driver(company_id: str, driver_id: str, db: Session = Depends(get_db)):
-    driver = DriverRepository.get_driver(db, company_id, driver_id)
+async def get_driver(company_id: str, driver_id: str, db: AsyncSession = Depends(get_db)):
+    driver = await DriverRepository.get_driver(db, company_id, driver_id)
     if not driver:
         raise HTTPException(status_code=404, detail="Driver not found")
     return driver
 
 @router.post("/drivers/", response_model=DriverResponse)
-async def create_driver(driver: DriverCreate, db: Session = Depends(get_db)):
-    company = CompanyRepository.get_company(db, driver.DriverCompanyId)
+async def create_driver(driver: DriverCreate, db: AsyncSession = Depends(get_db)):
+    company = await CompanyRepository.get_company(db, driver.DriverCompanyId)
     if not company:
         raise HTTPException(status_code=404, detail="Company not found")
     
-    existing_driver = DriverRepository.get_driver(db, driver.DriverCompanyId, driver.DriverId)
+    existing_driver = await DriverRepository.get_driver(db, driver.DriverCompanyId, driver.DriverId)
     if existing_driver:
         raise HTTPException(status_code=400, detail="Driver ID already registered for this company")
     
-    return DriverRepository.create_driver(db, driver.dict())
+    return await DriverRepository.create_driver(db, driver.dict())
 
 @router.put("/companies/{company_id}/drivers/{driver_id}", response_model=DriverResponse)
 async def update_driver(
     company_id: str,
     driver_id: str,
     driver: DriverUpdate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    db_driver = DriverRepository.get_driver(db, company_id, driver_id)
-    if not db_driver:
-        raise HTTPException(status_code=404, detail="Driver not found")
-    
-    return DriverRepository.update_driver(
+    updated_driver = await DriverRepository.update_driver(
         db, company_id, driver_id, driver.dict(exclude_unset=True)
     )
+    if not updated_driver:
+        raise HTTPException(status_code=404, detail="Driver not found")
+    authorization_cache.invalidate_driver(company_id, driver_id)
+    local_list.request_publish(company_id)
+    return updated_driver
 
 @router.delete("/companies/{company_id}/drivers/{driver_id}")
-async def delete_driver(company_id: str, driver_id: str, db: Session = Depends(get_db)):
-    db_driver = DriverRepository.get_driver(db, company_id, driver_id)
-    if not db_driver:
+async def delete_driver(company_id: str, driver_id: str, db: AsyncSession = Depends(get_db)):
+    try:
+        result = await DriverRepository.delete_driver(db, company_id, driver_id)
+    except RowInUse as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not result:
         raise HTTPException(status_code=404, detail="Driver not found")
-    
-    result = DriverRepository.delete_driver(db, company_id, driver_id)
+    authorization_cache.invalidate_driver(company_id, driver_id)
+    local_list.request_publish(company_id)
     return {"success": result}
 
 # RFID Card endpoints
@@ -427,9 +516,9 @@ async def get_rfid_cards(
     driver_id: Optional[str] = None,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    cards = RFIDCardRepository.get_rfid_cards(
+    cards = await RFIDCardRepository.get_rfid_cards(
         db, company_id=company_id, driver_id=driver_id, skip=skip, limit=limit
     )
     return cards
@@ -443,9 +532,9 @@ async def get_driver_rfid_cards(
     driver_id: str,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    cards = RFIDCardRepository.get_rfid_cards(
+    cards = await RFIDCardRepository.get_rfid_cards(
         db, company_id=company_id, driver_id=driver_id, skip=skip, limit=limit
     )
     return cards
@@ -458,33 +547,37 @@ async def get_rfid_card(
     company_id: str, 
     driver_id: str, 
     card_id: str, 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    card = RFIDCardRepository.get_rfid_card(db, company_id, driver_id, card_id)
+    card = await RFIDCardRepository.get_rfid_card(db, company_id, driver_id, card_id)
     if not card:
         raise HTTPException(status_code=404, detail="RFID card not found")
     return card
 
 @router.get("/rfid-cards/by-id/{card_id}", response_model=RFIDCardResponse)
-async def get_rfid_card_by_id(card_id: str, db: Session = Depends(get_db)):
-    card = RFIDCardRepository.get_rfid_card_by_id(db, card_id)
+async def get_rfid_card_by_id(card_id: str, db: AsyncSession = Depends(get_db)):
+    card = await RFIDCardRepository.get_rfid_card_by_id(db, card_id)
     if not card:
         raise HTTPException(status_code=404, detail="RFID card not found")
     return card
 
 @router.post("/rfid-cards/", response_model=RFIDCardResponse)
-async def create_rfid_card(card: RFIDCardCreate, db: Session = Depends(get_db)):
-    driver = DriverRepository.get_driver(db, card.RFIDCardCompanyId, card.RFIDCardDriverId)
+async def create_rfid_card(card: RFIDCardCreate, db: AsyncSession = Depends(get_db)):
+    driver = await DriverRepository.get_driver(db, card.RFIDCardCompanyId, card.RFIDCardDriverId)
     if not driver:
         raise HTTPException(status_code=404, detail="Driver not found")
     
-    existing_card = RFIDCardRepository.get_rfid_card(
+    existing_card = await RFIDCardRepository.get_rfid_card(
         db, card.RFIDCardCompanyId, card.RFIDCardDriverId, card.RFIDCardId
     )
     if existing_card:
         raise HTTPException(status_code=400, detail="RFID card ID already registered for this driver")
     
-    return RFIDCardRepository.create_rfid_card(db, card.dict())
+    created_card = await RFIDCardRepository.create_rfid_card(db, card.dict())
+    # Drops a cached Invalid answer for a tag that was just registered
+    authorization_cache.invalidate(card.RFIDCardId)
+    local_list.request_publish(card.RFIDCardCompanyId)
+    return created_card
 
 @router.put(
     "/companies/{company_id}/drivers/{driver_id}/rfid-cards/{card_id}",
@@ -495,32 +588,45 @@ async def update_rfid_card(
     driver_id: str,
     card_id: str,
     card: RFIDCardUpdate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    db_card = RFIDCardRepository.get_rfid_card(db, company_id, driver_id, card_id)
-    if not db_card:
-        raise HTTPException(status_code=404, detail="RFID card not found")
-    
-    return RFIDCardRepository.update_rfid_card(
+    updated_card = await RFIDCardRepository.update_rfid_card(
         db, company_id, driver_id, card_id, card.dict(exclude_unset=True)
     )
+    if not updated_card:
+        raise HTTPException(status_code=404, detail="RFID card not found")
+    authorization_cache.invalidate(card_id)
+    local_list.request_publish(company_id)
+    return updated_card
 
 @router.delete("/companies/{company_id}/drivers/{driver_id}/rfid-cards/{card_id}")
 async def delete_rfid_card(
     company_id: str,
     driver_id: str,
     card_id: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    db_card = RFIDCardRepository.get_rfid_card(db, company_id, driver_id, card_id)
-    if not db_card:
+    try:
+        result = await RFIDCardRepository.delete_rfid_card(db, company_id, driver_id, card_id)
+    except RowInUse as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not result:
         raise HTTPException(status_code=404, detail="RFID card not found")
-    
-    result = RFIDCardRepository.delete_rfid_card(db, company_id, driver_id, card_id)
+    authorization_cache.invalidate(card_id)
+    local_list.request_publish(company_id)
     return {"success": result}
 
 # OCPP-DB integration endpoints
 
+def ocpp_tenant(charger_id: str, company_id: Optional[str], site_id: Optional[str]):
+    """Company and site of an OCPP identity, from the charger directory unless both are given"""
+    if company_id and site_id:
+        return company_id, site_id
+    entry = charger_directory.get(charger_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Charger not found")
+    return entry.company_id, entry.site_id
+
 @router.post("/ocpp/charger/register")
 async def register_charger_from_ocpp(
     charger_id: str,
@@ -528,90 +634,34 @@ async def register_charger_from_ocpp(
     model: str,
     serial_number: str = None,
     firmware_version: str = None,
-    company_id: str = "DEF01",  # Default company ID
-    site_id: str = "MAIN",      # Default site ID
-    db: Session = Depends(get_db)
+    company_id: Optional[str] = None,
+    site_id: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
 ):
     """Register or update a charger from OCPP boot notification"""
-    
-    logger.info(f"Registering/updating charger from OCPP: {charger_id}")
-    
-    # Check if charger exists
-    charger = ChargerRepository.get_charger(db, company_id, site_id, charger_id)
-    
-    if charger:
-        # Update existing charger
-        update_data = {
-            "ChargerBrand": vendor,
-            "ChargerModel": model,
-            "ChargerSerial": serial_number,
-            "ChargerFirmwareVersion": firmware_version,
-            "ChargerIsOnline": True,
-            "ChargerLastConn": datetime.now(),
-            "ChargerStatusNow": "Available"
-        }
-        
-        logger.info(f"Updating existing charger: {charger_id}")
-        return ChargerRepository.update_charger(db, company_id, site_id, charger_id, update_data)
-    else:
-        # Create new charger
-        new_charger = {
-            "ChargerCompanyId": company_id,
-            "ChargerSiteId": site_id,
-            "ChargerId": charger_id,
-            "ChargerName": f"{vendor} {model} - {charger_id}",
-            "ChargerBrand": vendor,
-            "ChargerModel": model,
-            "ChargerSerial": serial_number,
-            "ChargerFirmwareVersion": firmware_version,
-            "ChargerIsOnline": True,
-            "ChargerLastConn": datetime.now(),
-            "ChargerEnabled": True,
-            "ChargerStatusNow": "Available",
-            "Charger_Type": "OCPP",
-            "Charger_Availability": "Operative"
-        }
-        
-        logger.info(f"Creating new charger: {charger_id}")
-        return ChargerRepository.create_charger(db, new_charger)
+    if not (company_id and site_id):
+        # A new charger joins the default tenant, like one booting with ALLOW_UNKNOWN_CHARGERS
+        company_id, site_id = charger_directory.tenant(charger_id)
+    charger = await OCPPService.register_charger(
+        db, charger_id, vendor, model, serial_number, firmware_version, company_id, site_id
+    )
+    charger_directory.update(charger)
+    return charger
 
 @router.post("/ocpp/connector/status")
 async def update_connector_status_from_ocpp(
     charger_id: str,
     connector_id: str,
     status: str,
-    company_id: str = "DEF01",  # Default company ID
-    site_id: str = "MAIN",      # Default site ID
-    db: Session = Depends(get_db)
+    company_id: Optional[str] = None,
+    site_id: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
 ):
     """Update connector status from OCPP status notification"""
-    
-    logger.info(f"Updating connector status from OCPP: {charger_id}/{connector_id} to {status}")
-    
-    # Check if connector exists
-    connector = ConnectorRepository.get_connector(db, company_id, site_id, charger_id, connector_id)
-    
-    if connector:
-        # Update existing connector
-        logger.info(f"Updating existing connector status: {charger_id}/{connector_id}")
-        return ConnectorRepository.update_connector_status(
-            db, company_id, site_id, charger_id, connector_id, status
-        )
-    else:
-        # Create new connector
-        new_connector = {
-            "ConnectorCompanyId": company_id,
-            "ConnectorSiteId": site_id,
-            "ConnectorChargerId": charger_id,
-            "ConnectorId": connector_id,
-            "ConnectorName": f"Connector {connector_id}",
-            "ConnectorType": "Unknown",  # Can be updated later with proper type
-            "ConnectorEnabled": True,
-            "ConnectorStatus": status
-        }
-        
-        logger.info(f"Creating new connector: {charger_id}/{connector_id}")
-        return ConnectorRepository.create_connector(db, new_connector)
+    company_id, site_id = ocpp_tenant(charger_id, company_id, site_id)
+    return await OCPPService.update_connector_status(
+        db, charger_id, connector_id, status, company_id, site_id
+    )
 
 @router.post("/ocpp/session/start")
 async def start_charging_session_from_ocpp(
@@ -619,97 +669,35 @@ async def start_charging_session_from_ocpp(
     connector_id: str,
     id_tag: str = None,
     transaction_id: int = None,
-    company_id: str = "DEF01",  # Default company ID
-    site_id: str = "MAIN",      # Default site ID
-    db: Session = Depends(get_db)
+    company_id: Optional[str] = None,
+    site_id: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
 ):
     """Start a charging session from OCPP StartTransaction"""
-    
-    logger.info(f"Starting charging session from OCPP: {charger_id}/{connector_id}")
-    
-    # Find driver by RFID tag if provided
-    driver_id = None
-    if id_tag:
-        driver = DriverRepository.get_driver_by_rfid(db, id_tag)
-        if driver:
-            driver_id = driver.DriverId
-    
-    # Create new session
-    new_session = {
-        "ChargerSessionCompanyId": company_id,
-        "ChargerSessionSiteId": site_id,
-        "ChargerSessionChargerId": charger_id,
-        "ChargerSessionConnectorId": connector_id,
-        "ChargerSessionDriverId": driver_id,
-        "ChargerSessionRFIDCard": id_tag,
-        "ChargerSessionStart": datetime.now(),
-        "ChargerSessionStatus": "In Progress",
-        "ChargerSessionEnergyKWH": 0
-    }
-    
-    # Create the session
-    session = ChargeSessionRepository.create_session(db, new_session)
-    
-    # Update connector status
-    ConnectorRepository.update_connector_status(
-        db, company_id, site_id, charger_id, connector_id, "Charging"
+    company_id, site_id = ocpp_tenant(charger_id, company_id, site_id)
+    return await OCPPService.start_session(
+        db, charger_id, connector_id, id_tag, transaction_id, company_id, site_id
     )
-    
-    return {
-        "session_id": session.ChargeSessionId,
-        "transaction_id": transaction_id or session.ChargeSessionId
-    }
 
 @router.post("/ocpp/session/end")
 async def end_charging_session_from_ocpp(
     charger_id: str,
-    connector_id: str,
     transaction_id: int,
+    connector_id: Optional[str] = None,
     meter_value: int = 0,
     reason: str = "Remote",
-    company_id: str = "DEF01",  # Default company ID
-    site_id: str = "MAIN",      # Default site ID
-    db: Session = Depends(get_db)
+    company_id: Optional[str] = None,
+    site_id: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
 ):
     """End a charging session from OCPP StopTransaction"""
-    
-    logger.info(f"Ending charging session from OCPP: {charger_id}/{connector_id}, transaction: {transaction_id}")
-    
-    # Find active session
-    # Note: In a real implementation, you might need to query by transaction_id if that's what the OCPP client returns
-    sessions = ChargeSessionRepository.get_sessions(
-        db, company_id=company_id, site_id=site_id, 
-        charger_id=charger_id
+    company_id, site_id = ocpp_tenant(charger_id, company_id, site_id)
+    result = await OCPPService.end_session(
+        db, charger_id, connector_id, transaction_id, meter_value, reason, company_id, site_id
     )
-    
-    active_session = None
-    for session in sessions:
-        if (session.ChargerSessionChargerId == charger_id and 
-            session.ChargerSessionConnectorId == connector_id and 
-            not session.ChargerSessionEnd):
-            active_session = session
-            break
-    
-    if not active_session:
-        logger.warning(f"No active session found for {charger_id}/{connector_id}")
+    if result is None:
         raise HTTPException(status_code=404, detail="No active session found")
-    
-    # End the session
-    end_time = datetime.now()
-    ended_session = ChargeSessionRepository.end_session(
-        db, active_session.ChargeSessionId, end_time, meter_value, reason
-    )
-    
-    # Update connector status
-    ConnectorRepository.update_connector_status(
-        db, company_id, site_id, charger_id, connector_id, "Available"
-    )
-    
-    return {
-        "session_id": ended_session.ChargeSessionId,
-        "energy_kwh": ended_session.ChargerSessionEnergyKWH,
-        "duration_seconds": ended_session.ChargerSessionDuration
-    }
+    return result
 
 @router.post("/ocpp/meter-values")
 async def record_meter_values_from_ocpp(
@@ -717,80 +705,30 @@ async def record_meter_values_from_ocpp(
     connector_id: str,
     transaction_id: int,
     meter_value: int,
-    company_id: str = "DEF01",  # Default company ID
-    site_id: str = "MAIN",      # Default site ID
-    db: Session = Depends(get_db)
+    company_id: Optional[str] = None,
+    site_id: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
 ):
     """Record meter values from OCPP MeterValues"""
-    
-    logger.info(f"Recording meter values from OCPP: {charger_id}/{connector_id}, value: {meter_value}")
-    
-    # Find session by transaction_id or active session
-    session = ChargeSessionRepository.get_session(db, transaction_id)
-    
-    if not session:
-        logger.warning(f"No session found for transaction {transaction_id}")
+    company_id, site_id = ocpp_tenant(charger_id, company_id, site_id)
+    result = await OCPPService.record_meter_values(
+        db, charger_id, connector_id, transaction_id, meter_value,
+        company_id=company_id, site_id=site_id
+    )
+    if result is None:
         raise HTTPException(status_code=404, detail="No session found")
-    
-    # Update energy value
-    session_data = {
-        "ChargerSessionEnergyKWH": meter_value
-    }
-    
-    updated_session = ChargeSessionRepository.update_session(db, session.ChargeSessionId, session_data)
-    
-    # Record event data
-    event_data = {
-        "EventsDataSessionId": session.ChargeSessionId,
-        "EventsDataCompanyId": company_id,
-        "EventsDataSiteId": site_id,
-        "EventsDataChargerId": charger_id,
-        "EventsDataConnectorId": connector_id,
-        "EventsDataDateTime": datetime.now(),
-        "EventsDataType": "Meter",
-        "EventsDataTriggerReason": "MeterValues",
-        "EventsDataOrigin": "OCPP",
-        "EventsDataMeterValue": str(meter_value)
-    }
-    
-    # In a real implementation, you would have a repository method for this
-    # For now, we'll just return the event data
-    
-    return {
-        "session_id": updated_session.ChargeSessionId,
-        "meter_value": updated_session.ChargerSessionEnergyKWH,
-        "event_data": event_data
-    }
+    return result
 
 @router.post("/ocpp/charger/heartbeat")
 async def record_heartbeat_from_ocpp(
     charger_id: str,
-    company_id: str = "DEF01",  # Default company ID
-    site_id: str = "MAIN",      # Default site ID
-    db: Session = Depends(get_db)
+    company_id: Optional[str] = None,
+    site_id: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
 ):
     """Record heartbeat from OCPP Heartbeat"""
-    
-    logger.info(f"Recording heartbeat from OCPP: {charger_id}")
-    
-    # Update charger's last heartbeat
-    charger = ChargerRepository.get_charger(db, company_id, site_id, charger_id)
-    
-    if not charger:
-        logger.warning(f"Charger not found: {charger_id}")
+    company_id, site_id = ocpp_tenant(charger_id, company_id, site_id)
+    result = await OCPPService.record_heartbeat(db, charger_id, company_id, site_id)
+    if result is None:
         raise HTTPException(status_code=404, detail="Charger not found")
-    
-    charger_data = {
-        "ChargerLastHeartbeat": datetime.now(),
-        "ChargerIsOnline": True
-    }
-    
-    updated_charger = ChargerRepository.update_charger(
-        db, company_id, site_id, charger_id, charger_data
-    )
-    
-    return {
-        "charger_id": updated_charger.ChargerId,
-        "last_heartbeat": updated_charger.ChargerLastHeartbeat,
-        "is_online": updated_charger.ChargerIsOnline
-    }
\ No newline at end of file
+    return result
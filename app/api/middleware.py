@@ -0,0 +1,33 @@
+from app.services.watchdog import watchdog
+
+
+class WatchdogMiddleware:
+    """Times HTTP requests against the watchdog's route threshold until the response starts
+
+    Written as plain ASGI so streaming responses are neither buffered nor timed
+    for their whole duration.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        operation = watchdog.track("route", f"{scope['method']} {scope['path']}")
+
+        async def send_and_finish(message):
+            if message["type"] == "http.response.start":
+                # Name the route by its template so ids don't create one metric series each
+                route = scope.get("route")
+                if route is not None and operation.name is not None:
+                    operation.name = f"{scope['method']} {route.path}"
+                operation.finish()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_finish)
+        finally:
+            operation.finish()
@@ -1,36 +1,57 @@
-from fastapi import APIRouter, HTTPException
-from app.ws.connection_manager import manager
+from fastapi import APIRouter, Body, Header, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from app.adapters.protocol_trace import protocol_trace
+from app.database.schemas import BulkCommandRequest, CommandJobCreate
+from app.services import bulk_commands
+from app.services.charger_directory import charger_directory
+from app.services.command_jobs import command_jobs
+from app.services.heartbeats import heartbeat_scheduler
+from app.adapters.ocpp_json import dumps
+from app.ws.command_bus import command_bus, ChargePointNotConnected
+from app.services.local_list import local_list
+from app.services.metrics import metrics
+from app.services.schema_validation import schema_validation
+from app.services.task_supervisor import task_supervisor
+from app.services.watchdog import watchdog
+from functools import partial
+from typing import Any, Dict, Optional
 import logging
+import time
 import uuid
 router = APIRouter()
 logger = logging.getLogger("ocpp.routes")
 
+async def send_command(charge_point_id: str, method: str, **kwargs):
+    """Run a CS->CP command on whichever worker holds the charge point's websocket"""
+    try:
+        return await command_bus.call(charge_point_id, method, **kwargs)
+    except ChargePointNotConnected:
+        logger.warning(f"⚠️  Charge point '{charge_point_id}' not connected.")
+        raise HTTPException(status_code=404, detail=f"Charge point '{charge_point_id}' not connected.")
+
 @router.get("/")
 async def root():
     return {"status": "running", "message": "OCPP Server is running"}
 
 @router.get("/charge_points")
 async def get_charge_points():
-    charge_points = manager.get_charge_points()
+    charge_points = await command_bus.list_charge_points()
     return {"count": len(charge_points), "charge_points": list(charge_points.keys())}
 
 @router.post("/charge_points/{charge_point_id}/reset")
 async def reset_charge_point(charge_point_id: str, type: str = "Soft"):
     logger.info(f"🔧 Reset command triggered for {charge_point_id} with type '{type}'")
     
-    charge_point = manager.get_charge_points().get(charge_point_id)
-    if not charge_point:
-        logger.warning(f"⚠️  Charge point '{charge_point_id}' not connected.")
-        raise HTTPException(status_code=404, detail=f"Charge point '{charge_point_id}' not connected.")
-
     try:
         message_id = str(uuid.uuid4())
         ocpp_message = [2, message_id, "Reset", {"type": type}]
         
         logger.info(f"📤 OCPP Message to be sent: {ocpp_message}")
-        await charge_point.reset_req(type=type)
+        await send_command(charge_point_id, "reset_req", type=type)
 
         return ocpp_message
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"❌ Reset command failed for {charge_point_id}: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Reset command failed: {str(e)}")
@@ -42,14 +63,9 @@ async def change_configuration(charge_point_id: str, key: str, value: str):
     """
     logger.info(f"🛠 Change Configuration command triggered for {charge_point_id} with key '{key}' and value '{value}'")
     
-    charge_point = manager.get_charge_points().get(charge_point_id)
-    if not charge_point:
-        logger.warning(f"⚠️  Charge point '{charge_point_id}' not connected.")
-        raise HTTPException(status_code=404, detail=f"Charge point '{charge_point_id}' not connected.")
-
     try:
         # Send the change configuration request to the charge point
-        response = await charge_point.change_configuration_req(key, value)
+        response = await send_command(charge_point_id, "change_configuration_req", key=key, value=value)
         
         # Log the response from the charge point
         logger.info(f"📤 OCPP Response from {charge_point_id}: {response.status}")
@@ -63,6 +79,8 @@ async def change_configuration(charge_point_id: str, key: str, value: str):
             "result": response.status
         }
     
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"❌ Change Configuration command failed for {charge_point_id}: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Change Configuration command failed: {str(e)}")
@@ -70,71 +88,207 @@ async def change_configuration(charge_point_id: str, key: str, value: str):
 @router.post("/charge_points/{charge_point_id}/unlock")
 async def unlock_connector(charge_point_id: str, connector_id: int):
     logger.info(f"🔓 Unlocking connector {connector_id} on {charge_point_id}")
-    cp = manager.get_charge_points().get(charge_point_id)
-    if not cp:
-        raise HTTPException(status_code=404, detail="Charge point not connected.")
-    response = await cp.unlock_connector_req(connector_id)
+    response = await send_command(charge_point_id, "unlock_connector_req", connector_id=connector_id)
     return {"command": "UnlockConnector", "connector_id": connector_id, "result": response.status}
 
 @router.get("/charge_points/{charge_point_id}/configuration")
 async def get_configuration(charge_point_id: str, key: str = None):
     logger.info(f"📥 Getting configuration for {charge_point_id}, key: {key}")
-    cp = manager.get_charge_points().get(charge_point_id)
-    if not cp:
-        raise HTTPException(status_code=404, detail="Charge point not connected.")
-    response = await cp.get_configuration_req(key)
+    response = await send_command(charge_point_id, "get_configuration_req", key=key)
     return response.__dict__
 
 @router.post("/charge_points/{charge_point_id}/availability")
 async def change_availability(charge_point_id: str, connector_id: int, type: str):
     logger.info(f"🔄 Changing availability on {charge_point_id} for connector {connector_id} to {type}")
-    cp = manager.get_charge_points().get(charge_point_id)
-    if not cp:
-        raise HTTPException(status_code=404, detail="Charge point not connected.")
-    response = await cp.change_availability_req(connector_id, type)
+    response = await send_command(charge_point_id, "change_availability_req", connector_id=connector_id, type=type)
     return {"command": "ChangeAvailability", "result": response.status}
 
 @router.post("/charge_points/{charge_point_id}/remote_start")
 async def remote_start_transaction(charge_point_id: str, id_tag: str, connector_id: int = None):
     logger.info(f"⚡ Starting remote transaction on {charge_point_id} with id_tag {id_tag}")
-    cp = manager.get_charge_points().get(charge_point_id)
-    if not cp:
-        raise HTTPException(status_code=404, detail="Charge point not connected.")
-    response = await cp.remote_start_transaction_req(id_tag, connector_id)
+    response = await send_command(
+        charge_point_id, "remote_start_transaction_req", id_tag=id_tag, connector_id=connector_id
+    )
     return {"command": "RemoteStartTransaction", "result": response.status}
 
 @router.post("/charge_points/{charge_point_id}/remote_stop")
 async def remote_stop_transaction(charge_point_id: str, transaction_id: int):
     logger.info(f"🛑 Stopping remote transaction {transaction_id} on {charge_point_id}")
-    cp = manager.get_charge_points().get(charge_point_id)
-    if not cp:
-        raise HTTPException(status_code=404, detail="Charge point not connected.")
-    response = await cp.remote_stop_transaction_req(transaction_id)
+    response = await send_command(charge_point_id, "remote_stop_transaction_req", transaction_id=transaction_id)
     return {"command": "RemoteStopTransaction", "transaction_id": transaction_id, "result": response.status}
 
 @router.post("/charge_points/{charge_point_id}/charging_profile")
 async def set_charging_profile(charge_point_id: str, connector_id: int, cs_charging_profiles: dict):
     logger.info(f"⚙️ Setting charging profile on {charge_point_id} for connector {connector_id}")
-    cp = manager.get_charge_points().get(charge_point_id)
-    if not cp:
-        raise HTTPException(status_code=404, detail="Charge point not connected.")
-    response = await cp.set_charging_profile_req(connector_id, cs_charging_profiles)
+    response = await send_command(
+        charge_point_id, "set_charging_profile_req",
+        connector_id=connector_id, cs_charging_profiles=cs_charging_profiles
+    )
     return {"command": "SetChargingProfile", "result": response.status}
 
 @router.post("/charge_points/{charge_point_id}/reserve_now")
 async def reserve_now(charge_point_id: str, connector_id: int, expiry_date: str, id_tag: str, reservation_id: int, parent_id_tag: str = None):
     logger.info(f"📅 Reserving connector {connector_id} on {charge_point_id}")
-    cp = manager.get_charge_points().get(charge_point_id)
-    if not cp:
-        raise HTTPException(status_code=404, detail="Charge point not connected.")
-    response = await cp.reserve_now_req(connector_id, expiry_date, id_tag, reservation_id, parent_id_tag)
+    response = await send_command(
+        charge_point_id, "reserve_now_req", connector_id=connector_id, expiry_date=expiry_date,
+        id_tag=id_tag, reservation_id=reservation_id, parent_id_tag=parent_id_tag
+    )
     return {"command": "ReserveNow", "result": response.status}
 
 @router.post("/charge_points/{charge_point_id}/cancel_reservation")
 async def cancel_reservation(charge_point_id: str, reservation_id: int):
     logger.info(f"❌ Cancelling reservation {reservation_id} on {charge_point_id}")
-    cp = manager.get_charge_points().get(charge_point_id)
-    if not cp:
-        raise HTTPException(status_code=404, detail="Charge point not connected.")
-    response = await cp.cancel_reservation_req(reservation_id)
+    response = await send_command(charge_point_id, "cancel_reservation_req", reservation_id=reservation_id)
     return {"command": "CancelReservation", "result": response.status}
+
+@router.post("/charge_points/{charge_point_id}/local_list")
+async def send_local_list(charge_point_id: str, full: bool = False):
+    logger.info(f"📋 Sending local authorization list to {charge_point_id} (full: {full})")
+    company_id, site_id = charger_directory.tenant(charge_point_id)
+    # Sent on request, so bring the list up to date with the cards first
+    await local_list.publish(company_id)
+    result = await local_list.sync_charger(
+        charge_point_id, partial(send_command, charge_point_id, "send_local_list_req"), company_id, site_id, full=full,
+        get_configuration=partial(send_command, charge_point_id, "get_configuration_req")
+    )
+    return {"command": "SendLocalList", **result}
+
+@router.get("/charge_points/{charge_point_id}/local_list_version")
+async def get_local_list_version(charge_point_id: str):
+    logger.info(f"📋 Getting local list version of {charge_point_id}")
+    response = await send_command(charge_point_id, "get_local_list_version_req")
+    return {"command": "GetLocalListVersion", "list_version": response.list_version}
+
+@router.post("/bulk/{command}")
+async def bulk_command(
+    command: str,
+    request: BulkCommandRequest,
+    format: Optional[str] = None,
+    accept: Optional[str] = Header(None)
+):
+    """
+    Send one command (reset, change_configuration, ...) to many chargers and stream
+    a result per charger as NDJSON, or as server-sent events with format=sse
+    (or Accept: text/event-stream), followed by a summary.
+    """
+    if format is None:
+        format = "sse" if accept and "text/event-stream" in accept else "ndjson"
+    if format not in ("ndjson", "sse"):
+        raise HTTPException(status_code=400, detail="format must be ndjson or sse")
+
+    connected = await command_bus.list_charge_points()
+    try:
+        bulk_commands.command_method(command, request.params)
+        targets = await bulk_commands.resolve_targets(
+            connected, request.company_id, request.site_id, request.charge_point_ids, request.all_connected
+        )
+    except bulk_commands.InvalidCommand as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    logger.info(f"📡 Bulk {command} triggered for {len(targets)} chargers")
+
+    def encode(event: str, data: Dict[str, Any]) -> str:
+        if format == "sse":
+            return f"event: {event}\ndata: {dumps(data)}\n\n"
+        return dumps(data if event == "result" else {event: data}) + "\n"
+
+    async def stream():
+        started = time.perf_counter()
+        counts: Dict[str, int] = {}
+        async for result in bulk_commands.fan_out(
+            command, targets, request.params, connected, request.concurrency, request.timeout
+        ):
+            counts[result["status"]] = counts.get(result["status"], 0) + 1
+            yield encode("result", result)
+        yield encode("summary", {
+            "command": command,
+            "targets": len(targets),
+            **counts,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)
+        })
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(stream(), media_type=media_type)
+
+@router.post("/jobs", status_code=202)
+async def submit_command_job(request: CommandJobCreate):
+    """Queue a command for a charge point and return the job at once; it is sent when the charger is connected"""
+    try:
+        return await command_jobs.submit(
+            request.charge_point_id, request.command, request.params, request.ttl_seconds
+        )
+    except bulk_commands.InvalidCommand as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/jobs")
+async def list_command_jobs(
+    charge_point_id: Optional[str] = None, status: Optional[str] = None, skip: int = 0, limit: int = 100
+):
+    return await command_jobs.list_jobs(charge_point_id, status, skip, limit)
+
+@router.get("/jobs/{job_id}")
+async def get_command_job(job_id: str):
+    job = await command_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.get("/jobs/{job_id}/events")
+async def stream_command_job(job_id: str):
+    """Server-sent events with the job on every status change, until it is finished"""
+    if await command_jobs.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def stream():
+        async for job in command_jobs.stream(job_id):
+            yield f"event: {job['status']}\ndata: {dumps(job)}\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+@router.delete("/jobs/{job_id}")
+async def cancel_command_job(job_id: str):
+    if not await command_jobs.cancel(job_id):
+        if await command_jobs.get(job_id) is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        raise HTTPException(status_code=409, detail="Only queued jobs can be cancelled")
+    return {"success": True}
+
+@router.get("/protocol_trace")
+async def get_protocol_trace():
+    return protocol_trace.settings()
+
+@router.patch("/protocol_trace")
+async def update_protocol_trace(settings: Dict[str, Any] = Body(...)):
+    """Change the trace settings of this worker, e.g. {"charger_rates": {"CP1": 1.0}, "payload_chargers": ["CP1"]}"""
+    try:
+        return protocol_trace.update(**settings)
+    except (ValueError, TypeError, AttributeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/schema_validation")
+async def get_schema_validation_stats():
+    return schema_validation.stats()
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus text exposition of this worker's metrics"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@router.get("/admin/watchdog")
+async def get_watchdog_report():
+    """Event loop stalls and slow handlers/routes recorded by this worker, most recent first"""
+    return watchdog.report()
+
+@router.delete("/admin/watchdog")
+async def clear_watchdog_events():
+    watchdog.clear()
+    return {"success": True}
+
+@router.get("/admin/tasks")
+async def get_background_tasks():
+    """Background tasks running on this worker, per charger"""
+    return task_supervisor.report()
+
+@router.get("/admin/heartbeats")
+async def get_heartbeat_schedule():
+    """Heartbeat interval stretch and the chargers it is applied to on this worker"""
+    return heartbeat_scheduler.report()
@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, DateTime, Float, Text, ForeignKeyConstraint
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, SmallInteger, BigInteger, String, DateTime, Float, Text, ForeignKeyConstraint, Index, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from ..database import Base
@@ -107,6 +107,10 @@ class Charger(Base):
     ChargerPhoto = Column(Text)
     ChargerFirmwareVersion = Column(String(10))
     ChargerPaymentId = Column(String(5))
+    # Local authorization list version last acknowledged by the charger
+    ChargerLocalListVersion = Column(Integer, default=0)
+    # OCPP schema validation: full, sampled or off; NULL uses SCHEMA_VALIDATION_MODE
+    ChargerSchemaValidation = Column(String(10))
     ChargerCreated = Column(DateTime, default=datetime.now)
     Charger_Updated = Column(DateTime, default=datetime.now, onupdate=datetime.now)
     
@@ -267,6 +271,7 @@ class ChargeSession(Base):
     ChargerSessionSiteId = Column(String(5))
     ChargerSessionChargerId = Column(String(10))
     ChargerSessionConnectorId = Column(String(10))
+    ChargerSessionTransactionId = Column(Integer, unique=True, index=True)
     ChargerSessionDriverId = Column(String(10))
     ChargerSessionRFIDCard = Column(String(20))
     ChargerSessionStart = Column(DateTime)
@@ -274,7 +279,7 @@ class ChargeSession(Base):
     ChargerSessionDuration = Column(Integer)  # Store duration in seconds
     ChargerSessionReason = Column(String(20))
     ChargerSessionStatus = Column(String(255))
-    ChargerSessionEnergyKWH = Column(Integer)
+    ChargerSessionEnergyKWH = Column(Integer)  # Meter register in Wh despite the name, as OCPP meterStop
     ChargerSessionPricingPlanId = Column(String(5), ForeignKey("Tariffs.TariffsId"))
     ChargerSessionCost = Column(Float)
     ChargerSessionDiscountId = Column(String(5), ForeignKey("Discounts.DiscountId"))
@@ -305,6 +310,13 @@ class ChargeSession(Base):
         ], [
             "RFIDCards.RFIDCardCompanyId", "RFIDCards.RFIDCardDriverId", "RFIDCards.RFIDCardId"
         ]),
+        # Partial index covering only sessions that are still running
+        Index(
+            "ix_ChargeSessions_Open",
+            "ChargerSessionCompanyId", "ChargerSessionSiteId", "ChargerSessionChargerId", "ChargerSessionConnectorId",
+            postgresql_where=text('"ChargerSessionEnd" IS NULL'),
+            sqlite_where=text('"ChargerSessionEnd" IS NULL')
+        ),
     )
     
     # Relationships
@@ -339,6 +351,83 @@ class EventsData(Base):
     charge_session = relationship("ChargeSession", back_populates="events_data")
 
 
+class MeterSample(Base):
+    """Append-only store for every sampled value received in OCPP MeterValues.
+
+    Measurand and phase are stored as the small integer codes defined in
+    app.services.meter_values; values are normalised to the base unit (Wh, W, ...).
+    """
+    __tablename__ = "MeterSamples"
+    
+    MeterSampleId = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    MeterSampleSessionId = Column(Integer, ForeignKey("ChargeSessions.ChargeSessionId"), nullable=False)
+    MeterSampleMeasurand = Column(SmallInteger, nullable=False)
+    MeterSamplePhase = Column(SmallInteger)
+    MeterSampleTimestamp = Column(DateTime, nullable=False)
+    MeterSampleValue = Column(Float, nullable=False)
+    
+    __table_args__ = (
+        Index("ix_MeterSamples_Session_Timestamp", "MeterSampleSessionId", "MeterSampleTimestamp"),
+    )
+
+
+class IdBlock(Base):
+    """High-water mark of the id blocks handed out by a hi/lo allocator"""
+    __tablename__ = "IdBlocks"
+    
+    IdBlockName = Column(String(30), primary_key=True)
+    IdBlockNextHi = Column(BigInteger, nullable=False, default=0)
+    IdBlockUpdated = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+
+class LocalListEntry(Base):
+    """Published local authorization list of a company, one row per id tag.
+
+    LocalListEntryVersion is the list version the entry last changed in; a
+    NULL status marks a tag removed from the list in that version.
+    """
+    __tablename__ = "LocalListEntries"
+    
+    LocalListEntryCompanyId = Column(String(5), ForeignKey("Companies.CompanyId"), primary_key=True)
+    LocalListEntryIdTag = Column(String(20), primary_key=True)
+    LocalListEntryStatus = Column(String(20))
+    LocalListEntryExpiryDate = Column(DateTime)
+    LocalListEntryParentIdTag = Column(String(20))
+    LocalListEntryVersion = Column(Integer, nullable=False)
+    LocalListEntryUpdated = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    
+    __table_args__ = (
+        Index("ix_LocalListEntries_Company_Version", "LocalListEntryCompanyId", "LocalListEntryVersion"),
+    )
+
+
+class CommandJob(Base):
+    """A CS->CP command submitted through the API, delivered when its charger is connected.
+
+    Status goes queued -> running -> succeeded/failed, or queued -> expired/cancelled.
+    Params and result hold the command's arguments and call_result as JSON.
+    """
+    __tablename__ = "CommandJobs"
+    
+    CommandJobId = Column(String(36), primary_key=True)
+    CommandJobChargerId = Column(String(10), nullable=False)
+    CommandJobCommand = Column(String(40), nullable=False)
+    CommandJobParams = Column(Text)
+    CommandJobStatus = Column(String(10), nullable=False, default="queued")
+    CommandJobResult = Column(Text)
+    CommandJobError = Column(Text)
+    CommandJobAttempts = Column(Integer, nullable=False, default=0)
+    CommandJobCreated = Column(DateTime, nullable=False, default=datetime.now)
+    CommandJobExpiresAt = Column(DateTime, nullable=False)
+    CommandJobStarted = Column(DateTime)
+    CommandJobCompleted = Column(DateTime)
+    
+    __table_args__ = (
+        Index("ix_CommandJobs_Charger_Status", "CommandJobChargerId", "CommandJobStatus", "CommandJobCreated"),
+        Index("ix_CommandJobs_Status_ExpiresAt", "CommandJobStatus", "CommandJobExpiresAt"),
+    )
+
+
 class PaymentMethod(Base):
     __tablename__ = "PaymentMethods"
     
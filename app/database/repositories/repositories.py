@@ -1,197 +1,460 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import select, update, insert, delete, bindparam, func, literal, tuple_
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from ..models.models import (
     Company, SitesGroup, Site, Charger, Connector, 
     Driver, DriversGroup, Discount, Tariff, RFIDCard,
-    ChargeSession, EventsData, PaymentMethod, PaymentTransaction
+    ChargeSession, EventsData, MeterSample, IdBlock, LocalListEntry, PaymentMethod, PaymentTransaction,
+    CommandJob
 )
 from typing import List, Optional, Dict, Any
 from datetime import datetime
 
+
+def _dialect(db: AsyncSession):
+    return db.get_bind().dialect
+
+
+async def _update_returning(db: AsyncSession, model, criteria, values: Dict[str, Any]):
+    """UPDATE the row matching criteria and return it, None when there is none; commits.
+
+    A single UPDATE ... RETURNING on backends that have it (SQLite 3.35+,
+    PostgreSQL), UPDATE then SELECT on the others (MySQL).
+    """
+    if values:
+        stmt = update(model).where(*criteria).values(**values)
+        if _dialect(db).update_returning:
+            result = await db.execute(stmt.returning(model), execution_options={"populate_existing": True})
+            row = result.scalars().first()
+            await db.commit()
+            return row
+        result = await db.execute(stmt)
+        if not result.rowcount:
+            await db.commit()
+            return None
+    result = await db.execute(select(model).where(*criteria), execution_options={"populate_existing": True})
+    row = result.scalars().first()
+    await db.commit()
+    return row
+
+
+class RowInUse(Exception):
+    """A row could not be deleted because other rows still reference it"""
+
+
+async def _delete(db: AsyncSession, model, criteria, children=(), owned=()) -> bool:
+    """DELETE the row matching criteria and return whether there was one; commits.
+
+    children are (model, criteria) of the rows referencing it: the delete
+    raises RowInUse while any exists, rather than relying on foreign keys,
+    which SQLite does not enforce here. owned are (model, criteria) of rows
+    deleted along with it.
+    """
+    for child, child_criteria in children:
+        if (await db.execute(select(literal(1)).select_from(child).where(*child_criteria).limit(1))).first():
+            await db.rollback()
+            raise RowInUse(f"{model.__tablename__} row is still referenced by {child.__tablename__}")
+    try:
+        for owned_model, owned_criteria in owned:
+            await db.execute(delete(owned_model).where(*owned_criteria))
+        result = await db.execute(delete(model).where(*criteria))
+        await db.commit()
+    except IntegrityError as e:
+        # Referenced by a row inserted meanwhile, on backends enforcing foreign keys
+        await db.rollback()
+        raise RowInUse(f"{model.__tablename__} row is still referenced") from e
+    return result.rowcount > 0
+
+
+def _upsert(db: AsyncSession, target, update_columns):
+    """INSERT into a model or table that overwrites update_columns of an existing row with the same
+    primary key, or None when the backend has no upsert statement"""
+    table = getattr(target, "__table__", target)
+    name = _dialect(db).name
+    if name in ("sqlite", "postgresql"):
+        stmt = (sqlite if name == "sqlite" else postgresql).insert(target)
+        return stmt.on_conflict_do_update(
+            index_elements=[column.name for column in table.primary_key],
+            set_={column: stmt.excluded[column] for column in update_columns}
+        )
+    if name == "mysql":
+        stmt = mysql.insert(target)
+        return stmt.on_duplicate_key_update({column: stmt.inserted[column] for column in update_columns})
+    return None
+
+
 # Company Repository
 class CompanyRepository:
     @staticmethod
-    def get_companies(db: Session, skip: int = 0, limit: int = 100):
-        return db.query(Company).offset(skip).limit(limit).all()
+    async def get_companies(db: AsyncSession, skip: int = 0, limit: int = 100):
+        result = await db.execute(select(Company).offset(skip).limit(limit))
+        return result.scalars().all()
     
     @staticmethod
-    def get_company(db: Session, company_id: str):
-        return db.query(Company).filter(Company.CompanyId == company_id).first()
+    async def get_company(db: AsyncSession, company_id: str):
+        result = await db.execute(select(Company).filter(Company.CompanyId == company_id))
+        return result.scalars().first()
     
     @staticmethod
-    def create_company(db: Session, company_data: Dict[str, Any]):
+    async def create_company(db: AsyncSession, company_data: Dict[str, Any]):
         company = Company(**company_data)
         db.add(company)
-        db.commit()
-        db.refresh(company)
+        await db.commit()
+        await db.refresh(company)
         return company
     
     @staticmethod
-    def update_company(db: Session, company_id: str, company_data: Dict[str, Any]):
-        company = db.query(Company).filter(Company.CompanyId == company_id).first()
-        if company:
-            for key, value in company_data.items():
-                setattr(company, key, value)
-            company.CompanyUpdated = datetime.now()
-            db.commit()
-            db.refresh(company)
-        return company
+    async def update_company(db: AsyncSession, company_id: str, company_data: Dict[str, Any]):
+        return await _update_returning(
+            db, Company, [Company.CompanyId == company_id],
+            {**company_data, "CompanyUpdated": datetime.now()}
+        )
     
     @staticmethod
-    def delete_company(db: Session, company_id: str):
-        company = db.query(Company).filter(Company.CompanyId == company_id).first()
-        if company:
-            db.delete(company)
-            db.commit()
-            return True
-        return False
+    async def delete_company(db: AsyncSession, company_id: str):
+        return await _delete(
+            db, Company, [Company.CompanyId == company_id],
+            children=[
+                (Site, [Site.SiteCompanyID == company_id]),
+                (Charger, [Charger.ChargerCompanyId == company_id]),
+                (Driver, [Driver.DriverCompanyId == company_id])
+            ],
+            # Derived from its cards, including the tombstones of removed ones
+            owned=[
+                (LocalListEntry, [LocalListEntry.LocalListEntryCompanyId == company_id]),
+                (IdBlock, [IdBlock.IdBlockName == f"LocalList:{company_id}"])
+            ]
+        )
 
 # Site Repository
 class SiteRepository:
     @staticmethod
-    def get_sites(db: Session, company_id: Optional[str] = None, skip: int = 0, limit: int = 100):
-        query = db.query(Site)
+    async def get_sites(db: AsyncSession, company_id: Optional[str] = None, skip: int = 0, limit: int = 100):
+        query = select(Site)
         if company_id:
             query = query.filter(Site.SiteCompanyID == company_id)
-        return query.offset(skip).limit(limit).all()
+        result = await db.execute(query.offset(skip).limit(limit))
+        return result.scalars().all()
     
     @staticmethod
-    def get_site(db: Session, company_id: str, site_id: str):
-        return db.query(Site).filter(
+    async def get_site(db: AsyncSession, company_id: str, site_id: str):
+        result = await db.execute(select(Site).filter(
             Site.SiteCompanyID == company_id,
             Site.SiteId == site_id
-        ).first()
+        ))
+        return result.scalars().first()
     
     @staticmethod
-    def create_site(db: Session, site_data: Dict[str, Any]):
+    async def create_site(db: AsyncSession, site_data: Dict[str, Any]):
         site = Site(**site_data)
         db.add(site)
-        db.commit()
-        db.refresh(site)
+        await db.commit()
+        await db.refresh(site)
         return site
     
     @staticmethod
-    def update_site(db: Session, company_id: str, site_id: str, site_data: Dict[str, Any]):
-        site = db.query(Site).filter(
-            Site.SiteCompanyID == company_id,
-            Site.SiteId == site_id
-        ).first()
-        if site:
-            for key, value in site_data.items():
-                setattr(site, key, value)
-            site.SiteUpdated = datetime.now()
-            db.commit()
-            db.refresh(site)
-        return site
+    async def update_site(db: AsyncSession, company_id: str, site_id: str, site_data: Dict[str, Any]):
+        return await _update_returning(
+            db, Site, [Site.SiteCompanyID == company_id, Site.SiteId == site_id],
+            {**site_data, "SiteUpdated": datetime.now()}
+        )
     
     @staticmethod
-    def delete_site(db: Session, company_id: str, site_id: str):
-        site = db.query(Site).filter(
-            Site.SiteCompanyID == company_id,
-            Site.SiteId == site_id
-        ).first()
-        if site:
-            db.delete(site)
-            db.commit()
-            return True
-        return False
+    async def delete_site(db: AsyncSession, company_id: str, site_id: str):
+        return await _delete(
+            db, Site, [Site.SiteCompanyID == company_id, Site.SiteId == site_id],
+            children=[(Charger, [Charger.ChargerCompanyId == company_id, Charger.ChargerSiteId == site_id])]
+        )
 
 # Charger Repository
 class ChargerRepository:
+    # Columns a BootNotification of a known charger overwrites
+    BOOT_COLUMNS = (
+        "ChargerBrand", "ChargerModel", "ChargerSerial", "ChargerFirmwareVersion",
+        "ChargerIsOnline", "ChargerLastConn", "ChargerStatusNow", "Charger_Updated"
+    )
+
     @staticmethod
-    def get_chargers(
-        db: Session, 
+    async def get_chargers(
+        db: AsyncSession, 
         company_id: Optional[str] = None, 
         site_id: Optional[str] = None,
         skip: int = 0, 
         limit: int = 100
     ):
-        query = db.query(Charger)
+        query = select(Charger)
         if company_id:
             query = query.filter(Charger.ChargerCompanyId == company_id)
         if site_id:
             query = query.filter(Charger.ChargerSiteId == site_id)
-        return query.offset(skip).limit(limit).all()
+        result = await db.execute(query.offset(skip).limit(limit))
+        return result.scalars().all()
     
     @staticmethod
-    def get_charger(db: Session, company_id: str, site_id: str, charger_id: str):
-        return db.query(Charger).filter(
+    async def get_charger_ids(db: AsyncSession, company_id: str, site_id: Optional[str] = None) -> List[str]:
+        """Ids of every charger of a company, or of one of its sites"""
+        query = select(Charger.ChargerId).filter(Charger.ChargerCompanyId == company_id)
+        if site_id:
+            query = query.filter(Charger.ChargerSiteId == site_id)
+        result = await db.execute(query.order_by(Charger.ChargerId))
+        return list(result.scalars().all())
+
+    @staticmethod
+    def _key(company_id: str, site_id: str, charger_id: str):
+        return [
             Charger.ChargerCompanyId == company_id,
             Charger.ChargerSiteId == site_id,
             Charger.ChargerId == charger_id
-        ).first()
+        ]
+
+    @staticmethod
+    async def get_charger(db: AsyncSession, company_id: str, site_id: str, charger_id: str):
+        result = await db.execute(select(Charger).filter(
+            *ChargerRepository._key(company_id, site_id, charger_id)
+        ))
+        return result.scalars().first()
     
     @staticmethod
-    def create_charger(db: Session, charger_data: Dict[str, Any]):
+    async def create_charger(db: AsyncSession, charger_data: Dict[str, Any]):
         charger = Charger(**charger_data)
         db.add(charger)
-        db.commit()
-        db.refresh(charger)
+        await db.commit()
+        await db.refresh(charger)
         return charger
     
     @staticmethod
-    def update_charger(db: Session, company_id: str, site_id: str, charger_id: str, charger_data: Dict[str, Any]):
-        charger = db.query(Charger).filter(
-            Charger.ChargerCompanyId == company_id,
-            Charger.ChargerSiteId == site_id,
-            Charger.ChargerId == charger_id
-        ).first()
-        if charger:
-            for key, value in charger_data.items():
-                setattr(charger, key, value)
-            charger.Charger_Updated = datetime.now()
-            db.commit()
-            db.refresh(charger)
-        return charger
+    async def update_charger(db: AsyncSession, company_id: str, site_id: str, charger_id: str, charger_data: Dict[str, Any]):
+        return await _update_returning(
+            db, Charger, ChargerRepository._key(company_id, site_id, charger_id),
+            {**charger_data, "Charger_Updated": datetime.now()}
+        )
     
     @staticmethod
-    def delete_charger(db: Session, company_id: str, site_id: str, charger_id: str):
-        charger = db.query(Charger).filter(
-            Charger.ChargerCompanyId == company_id,
-            Charger.ChargerSiteId == site_id,
-            Charger.ChargerId == charger_id
-        ).first()
-        if charger:
-            db.delete(charger)
-            db.commit()
-            return True
-        return False
+    async def delete_charger(db: AsyncSession, company_id: str, site_id: str, charger_id: str):
+        return await _delete(
+            db, Charger, ChargerRepository._key(company_id, site_id, charger_id),
+            children=[
+                (Connector, [
+                    Connector.ConnectorCompanyId == company_id,
+                    Connector.ConnectorSiteId == site_id,
+                    Connector.ConnectorChargerId == charger_id
+                ]),
+                (ChargeSession, [
+                    ChargeSession.ChargerSessionCompanyId == company_id,
+                    ChargeSession.ChargerSessionSiteId == site_id,
+                    ChargeSession.ChargerSessionChargerId == charger_id
+                ])
+            ]
+        )
     
     @staticmethod
-    def update_charger_status(
-        db: Session, 
+    async def update_charger_status(
+        db: AsyncSession, 
         company_id: str, 
         site_id: str, 
         charger_id: str,
         status: str,
         is_online: bool = None
     ):
-        charger = db.query(Charger).filter(
-            Charger.ChargerCompanyId == company_id,
-            Charger.ChargerSiteId == site_id,
-            Charger.ChargerId == charger_id
-        ).first()
+        now = datetime.now()
+        values = {"ChargerStatusNow": status}
+        if is_online is not None:
+            values["ChargerIsOnline"] = is_online
+            if is_online:
+                values["ChargerLastConn"] = now
+            else:
+                values["ChargerLastDisconn"] = now
         
-        if charger:
-            charger.ChargerStatusNow = status
-            if is_online is not None:
-                charger.ChargerIsOnline = is_online
-                if is_online:
-                    charger.ChargerLastConn = datetime.now()
-                else:
-                    charger.ChargerLastDisconn = datetime.now()
-            
-            charger.ChargerLastHeartbeat = datetime.now()
-            charger.Charger_Updated = datetime.now()
-            db.commit()
-            db.refresh(charger)
-        
-        return charger
+        values["ChargerLastHeartbeat"] = now
+        values["Charger_Updated"] = now
+        return await _update_returning(
+            db, Charger, ChargerRepository._key(company_id, site_id, charger_id), values
+        )
+
+    @staticmethod
+    async def bulk_update_heartbeats(db: AsyncSession, heartbeats: List[Dict[str, Any]]):
+        """Apply many heartbeats in one executemany UPDATE; the caller owns the transaction.
+
+        Each entry holds company_id, site_id, charger_id and heartbeat (a datetime).
+        """
+        if not heartbeats:
+            return
+        table = Charger.__table__
+        stmt = (
+            update(table)
+            .where(
+                table.c.ChargerCompanyId == bindparam("b_company_id"),
+                table.c.ChargerSiteId == bindparam("b_site_id"),
+                table.c.ChargerId == bindparam("b_charger_id")
+            )
+            .values(
+                ChargerLastHeartbeat=bindparam("b_heartbeat"),
+                ChargerIsOnline=True,
+                Charger_Updated=bindparam("b_heartbeat")
+            )
+        )
+        await db.execute(stmt, [
+            {
+                "b_company_id": hb["company_id"],
+                "b_site_id": hb["site_id"],
+                "b_charger_id": hb["charger_id"],
+                "b_heartbeat": hb["heartbeat"]
+            }
+            for hb in heartbeats
+        ])
+
+    @staticmethod
+    async def get_directory_rows(db: AsyncSession):
+        """Identity, tenant and connection attributes of every charger, for the charger directory"""
+        result = await db.execute(
+            select(
+                Charger.ChargerCompanyId, Charger.ChargerSiteId, Charger.ChargerId, Charger.ChargerEnabled,
+                Charger.Charger_Access_Type, Charger.ChargerSchemaValidation
+            ).order_by(Charger.ChargerCompanyId, Charger.ChargerSiteId, Charger.ChargerId)
+        )
+        return result.all()
+
+    @staticmethod
+    async def bulk_set_offline(db: AsyncSession, keys: List[tuple], disconnected: datetime) -> int:
+        """Mark many chargers offline in one UPDATE and return how many matched; the caller owns the transaction.
+
+        keys are (company_id, site_id, charger_id) tuples.
+        """
+        if not keys:
+            return 0
+        result = await db.execute(
+            update(Charger)
+            .where(tuple_(Charger.ChargerCompanyId, Charger.ChargerSiteId, Charger.ChargerId).in_(keys))
+            .values(
+                ChargerIsOnline=False,
+                ChargerStatusNow="Unavailable",
+                ChargerLastDisconn=disconnected,
+                Charger_Updated=disconnected
+            )
+            .execution_options(synchronize_session=False)
+        )
+        return result.rowcount
+
+    @staticmethod
+    def _boot_row(boot: Dict[str, Any]) -> Dict[str, Any]:
+        """Chargers row of a new charger registered by a BootNotification"""
+        return {
+            "ChargerCompanyId": boot["company_id"],
+            "ChargerSiteId": boot["site_id"],
+            "ChargerId": boot["charger_id"],
+            "ChargerName": f"{boot['vendor']} {boot['model']} - {boot['charger_id']}",
+            "ChargerBrand": boot["vendor"],
+            "ChargerModel": boot["model"],
+            "ChargerSerial": boot["serial"],
+            "ChargerFirmwareVersion": boot["firmware"],
+            "ChargerIsOnline": True,
+            "ChargerLastConn": boot["booted"],
+            "ChargerEnabled": True,
+            "ChargerStatusNow": "Available",
+            "Charger_Type": "OCPP",
+            "Charger_Availability": "Operative",
+            "Charger_Updated": boot["booted"]
+        }
+
+    @staticmethod
+    async def register_charger(db: AsyncSession, boot: Dict[str, Any]):
+        """Create or update the charger of an accepted BootNotification and return it; commits.
+
+        boot holds the same keys as the entries of bulk_register. A single
+        INSERT ... ON CONFLICT DO UPDATE ... RETURNING where the backend has it.
+        """
+        key = ChargerRepository._key(boot["company_id"], boot["site_id"], boot["charger_id"])
+        stmt = _upsert(db, Charger, ChargerRepository.BOOT_COLUMNS)
+        if stmt is None:
+            charger = await _update_returning(db, Charger, key, {
+                column: value for column, value in ChargerRepository._boot_row(boot).items()
+                if column in ChargerRepository.BOOT_COLUMNS
+            })
+            if charger is None:
+                charger = await ChargerRepository.create_charger(db, ChargerRepository._boot_row(boot))
+            return charger
+
+        stmt = stmt.values(**ChargerRepository._boot_row(boot))
+        if _dialect(db).insert_returning:
+            result = await db.execute(stmt.returning(Charger), execution_options={"populate_existing": True})
+            charger = result.scalars().first()
+            await db.commit()
+            return charger
+        await db.execute(stmt)
+        await db.commit()
+        result = await db.execute(select(Charger).filter(*key), execution_options={"populate_existing": True})
+        return result.scalars().first()
+
+    @staticmethod
+    async def bulk_register(db: AsyncSession, boots: List[Dict[str, Any]]):
+        """Create or update the chargers of many accepted BootNotifications; the caller owns the transaction.
+
+        Each entry holds company_id, site_id, charger_id, vendor, model, serial,
+        firmware and booted (a datetime). Like register_charger, new chargers
+        are created and known ones get their hardware details refreshed and
+        are marked online: with one executemany upsert where the backend has
+        one, else with one SELECT plus executemany INSERT/UPDATE.
+        """
+        if not boots:
+            return
+        table = Charger.__table__
+        stmt = _upsert(db, table, ChargerRepository.BOOT_COLUMNS)
+        if stmt is not None:
+            await db.execute(stmt, [ChargerRepository._boot_row(boot) for boot in boots])
+            return
+
+        keys = [(boot["company_id"], boot["site_id"], boot["charger_id"]) for boot in boots]
+        result = await db.execute(
+            select(Charger.ChargerCompanyId, Charger.ChargerSiteId, Charger.ChargerId).where(
+                tuple_(Charger.ChargerCompanyId, Charger.ChargerSiteId, Charger.ChargerId).in_(keys)
+            )
+        )
+        existing = set(tuple(row) for row in result.all())
+
+        to_update = [boot for key, boot in zip(keys, boots) if key in existing]
+        to_insert = [boot for key, boot in zip(keys, boots) if key not in existing]
+
+        if to_update:
+            stmt = (
+                update(table)
+                .where(
+                    table.c.ChargerCompanyId == bindparam("b_company_id"),
+                    table.c.ChargerSiteId == bindparam("b_site_id"),
+                    table.c.ChargerId == bindparam("b_charger_id")
+                )
+                .values(
+                    ChargerBrand=bindparam("b_vendor"),
+                    ChargerModel=bindparam("b_model"),
+                    ChargerSerial=bindparam("b_serial"),
+                    ChargerFirmwareVersion=bindparam("b_firmware"),
+                    ChargerIsOnline=True,
+                    ChargerLastConn=bindparam("b_booted"),
+                    ChargerStatusNow="Available",
+                    Charger_Updated=bindparam("b_booted")
+                )
+            )
+            await db.execute(stmt, [
+                {
+                    "b_company_id": boot["company_id"],
+                    "b_site_id": boot["site_id"],
+                    "b_charger_id": boot["charger_id"],
+                    "b_vendor": boot["vendor"],
+                    "b_model": boot["model"],
+                    "b_serial": boot["serial"],
+                    "b_firmware": boot["firmware"],
+                    "b_booted": boot["booted"]
+                }
+                for boot in to_update
+            ])
+        if to_insert:
+            await db.execute(insert(table), [ChargerRepository._boot_row(boot) for boot in to_insert])
 
 # ChargeSession Repository
 class ChargeSessionRepository:
     @staticmethod
-    def get_sessions(
-        db: Session,
+    async def get_sessions(
+        db: AsyncSession,
         company_id: Optional[str] = None,
         site_id: Optional[str] = None,
         charger_id: Optional[str] = None,
@@ -201,7 +464,7 @@ class ChargeSessionRepository:
         skip: int = 0,
         limit: int = 100
     ):
-        query = db.query(ChargeSession)
+        query = select(ChargeSession)
         
         if company_id:
             query = query.filter(ChargeSession.ChargerSessionCompanyId == company_id)
@@ -216,40 +479,70 @@ class ChargeSessionRepository:
         if end_date:
             query = query.filter(ChargeSession.ChargerSessionStart <= end_date)
             
-        return query.order_by(ChargeSession.ChargerSessionStart.desc()).offset(skip).limit(limit).all()
+        result = await db.execute(
+            query.order_by(ChargeSession.ChargerSessionStart.desc()).offset(skip).limit(limit)
+        )
+        return result.scalars().all()
+    
+    @staticmethod
+    async def get_session(db: AsyncSession, session_id: int):
+        result = await db.execute(select(ChargeSession).filter(ChargeSession.ChargeSessionId == session_id))
+        return result.scalars().first()
+    
+    @staticmethod
+    async def get_session_by_transaction_id(db: AsyncSession, transaction_id: int):
+        result = await db.execute(
+            select(ChargeSession).filter(ChargeSession.ChargerSessionTransactionId == transaction_id)
+        )
+        return result.scalars().first()
+    
+    @staticmethod
+    async def get_open_session(
+        db: AsyncSession, company_id: str, site_id: str, charger_id: str, connector_id: str
+    ):
+        """Return the running session on a connector, served by ix_ChargeSessions_Open"""
+        result = await db.execute(select(ChargeSession).filter(
+            ChargeSession.ChargerSessionCompanyId == company_id,
+            ChargeSession.ChargerSessionSiteId == site_id,
+            ChargeSession.ChargerSessionChargerId == charger_id,
+            ChargeSession.ChargerSessionConnectorId == connector_id,
+            ChargeSession.ChargerSessionEnd.is_(None)
+        ).order_by(ChargeSession.ChargerSessionStart.desc()))
+        return result.scalars().first()
     
     @staticmethod
-    def get_session(db: Session, session_id: int):
-        return db.query(ChargeSession).filter(ChargeSession.ChargeSessionId == session_id).first()
+    async def get_open_sessions_with_transaction_id(db: AsyncSession):
+        result = await db.execute(select(ChargeSession).filter(
+            ChargeSession.ChargerSessionEnd.is_(None),
+            ChargeSession.ChargerSessionTransactionId.is_not(None)
+        ))
+        return result.scalars().all()
     
     @staticmethod
-    def create_session(db: Session, session_data: Dict[str, Any]):
+    async def create_session(db: AsyncSession, session_data: Dict[str, Any]):
         session = ChargeSession(**session_data)
         db.add(session)
-        db.commit()
-        db.refresh(session)
+        await db.commit()
+        await db.refresh(session)
         return session
     
     @staticmethod
-    def update_session(db: Session, session_id: int, session_data: Dict[str, Any]):
-        session = db.query(ChargeSession).filter(ChargeSession.ChargeSessionId == session_id).first()
-        if session:
-            for key, value in session_data.items():
-                setattr(session, key, value)
-            db.commit()
-            db.refresh(session)
-        return session
+    async def update_session(db: AsyncSession, session_id: int, session_data: Dict[str, Any]):
+        return await _update_returning(
+            db, ChargeSession, [ChargeSession.ChargeSessionId == session_id], session_data
+        )
     
     @staticmethod
-    def end_session(
-        db: Session, 
+    async def end_session(
+        db: AsyncSession, 
         session_id: int, 
         end_time: datetime,
         energy_kwh: int,
         reason: str = "Completed",
         cost: Optional[float] = None
     ):
-        session = db.query(ChargeSession).filter(ChargeSession.ChargeSessionId == session_id).first()
+        # Usually already loaded by the caller's check, then no query is issued
+        session = await db.get(ChargeSession, session_id)
         if session and not session.ChargerSessionEnd:
             session.ChargerSessionEnd = end_time
             session.ChargerSessionEnergyKWH = energy_kwh
@@ -264,245 +557,629 @@ class ChargeSessionRepository:
                 session.ChargerSessionDuration = delta.total_seconds()
             
             session.ChargerSessionStatus = "Completed"
-            db.commit()
-            db.refresh(session)
+            await db.commit()
+            await db.refresh(session)
         
         return session
 
+# MeterSample Repository
+class MeterSampleRepository:
+    @staticmethod
+    async def get_samples(
+        db: AsyncSession,
+        session_id: int,
+        measurand: Optional[int] = None,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None,
+        skip: int = 0,
+        limit: int = 1000
+    ):
+        query = select(MeterSample).filter(MeterSample.MeterSampleSessionId == session_id)
+        if measurand is not None:
+            query = query.filter(MeterSample.MeterSampleMeasurand == measurand)
+        if start_time:
+            query = query.filter(MeterSample.MeterSampleTimestamp >= start_time)
+        if end_time:
+            query = query.filter(MeterSample.MeterSampleTimestamp <= end_time)
+        result = await db.execute(
+            query.order_by(MeterSample.MeterSampleTimestamp).offset(skip).limit(limit)
+        )
+        return result.scalars().all()
+    
+    @staticmethod
+    async def bulk_insert(db: AsyncSession, samples: List[Dict[str, Any]]):
+        """Append many samples with one executemany INSERT; the caller owns the transaction"""
+        if not samples:
+            return
+        await db.execute(insert(MeterSample.__table__), samples)
+
+# IdBlock Repository
+class IdBlockRepository:
+    @staticmethod
+    async def reserve_block(db: AsyncSession, name: str) -> int:
+        """Atomically claim the next hi value for an allocator and return it.
+
+        The UPDATE takes the row lock before the value is read back, so concurrent
+        workers never receive the same hi. Commits on its own.
+        """
+        for _ in range(2):
+            result = await db.execute(
+                update(IdBlock)
+                .where(IdBlock.IdBlockName == name)
+                .values(IdBlockNextHi=IdBlock.IdBlockNextHi + 1, IdBlockUpdated=datetime.now())
+            )
+            if result.rowcount:
+                next_hi = (await db.execute(
+                    select(IdBlock.IdBlockNextHi).where(IdBlock.IdBlockName == name)
+                )).scalar_one()
+                await db.commit()
+                return next_hi - 1
+            
+            # First use of this allocator; a concurrent worker may create the row first
+            try:
+                db.add(IdBlock(IdBlockName=name, IdBlockNextHi=1))
+                await db.commit()
+                return 0
+            except IntegrityError:
+                await db.rollback()
+        raise RuntimeError(f"Could not reserve an id block for {name}")
+
 # Driver Repository
+class DriversGroupRepository:
+    @staticmethod
+    async def get_drivers_groups(db: AsyncSession, skip: int = 0, limit: int = 100):
+        result = await db.execute(select(DriversGroup).offset(skip).limit(limit))
+        return result.scalars().all()
+
+    @staticmethod
+    async def get_drivers_group(db: AsyncSession, group_id: str):
+        result = await db.execute(select(DriversGroup).filter(DriversGroup.DriversGroupId == group_id))
+        return result.scalars().first()
+
+    @staticmethod
+    async def create_drivers_group(db: AsyncSession, group_data: Dict[str, Any]):
+        group = DriversGroup(**group_data)
+        db.add(group)
+        await db.commit()
+        await db.refresh(group)
+        return group
+
+    @staticmethod
+    async def update_drivers_group(db: AsyncSession, group_id: str, group_data: Dict[str, Any]):
+        return await _update_returning(
+            db, DriversGroup, [DriversGroup.DriversGroupId == group_id],
+            {**group_data, "DriversGroupUpdated": datetime.now()}
+        )
+
+    @staticmethod
+    async def delete_drivers_group(db: AsyncSession, group_id: str):
+        return await _delete(
+            db, DriversGroup, [DriversGroup.DriversGroupId == group_id],
+            children=[(Driver, [Driver.DriverGroupId == group_id])]
+        )
+
+    @staticmethod
+    async def get_company_ids(db: AsyncSession, group_id: str) -> List[str]:
+        """Companies with drivers in a group, whose local lists carry its status"""
+        result = await db.execute(
+            select(Driver.DriverCompanyId).filter(Driver.DriverGroupId == group_id).distinct()
+        )
+        return list(result.scalars().all())
+
+
 class DriverRepository:
     @staticmethod
-    def get_drivers(
-        db: Session, 
+    async def get_drivers(
+        db: AsyncSession, 
         company_id: Optional[str] = None,
         group_id: Optional[str] = None,
         skip: int = 0, 
         limit: int = 100
     ):
-        query = db.query(Driver)
+        query = select(Driver)
         if company_id:
             query = query.filter(Driver.DriverCompanyId == company_id)
         if group_id:
             query = query.filter(Driver.DriverGroupId == group_id)
-        return query.offset(skip).limit(limit).all()
+        result = await db.execute(query.offset(skip).limit(limit))
+        return result.scalars().all()
     
     @staticmethod
-    def get_driver(db: Session, company_id: str, driver_id: str):
-        return db.query(Driver).filter(
+    async def get_driver(db: AsyncSession, company_id: str, driver_id: str):
+        result = await db.execute(select(Driver).filter(
             Driver.DriverCompanyId == company_id,
             Driver.DriverId == driver_id
-        ).first()
+        ))
+        return result.scalars().first()
     
     @staticmethod
-    def create_driver(db: Session, driver_data: Dict[str, Any]):
+    async def create_driver(db: AsyncSession, driver_data: Dict[str, Any]):
         driver = Driver(**driver_data)
         db.add(driver)
-        db.commit()
-        db.refresh(driver)
+        await db.commit()
+        await db.refresh(driver)
         return driver
     
     # Continuing the DriverRepository class
     @staticmethod
-    def update_driver(db: Session, company_id: str, driver_id: str, driver_data: Dict[str, Any]):
-        driver = db.query(Driver).filter(
-            Driver.DriverCompanyId == company_id,
-            Driver.DriverId == driver_id
-        ).first()
-        if driver:
-            for key, value in driver_data.items():
-                setattr(driver, key, value)
-            driver.DriverUpdated = datetime.now()
-            db.commit()
-            db.refresh(driver)
-        return driver
+    async def update_driver(db: AsyncSession, company_id: str, driver_id: str, driver_data: Dict[str, Any]):
+        return await _update_returning(
+            db, Driver, [Driver.DriverCompanyId == company_id, Driver.DriverId == driver_id],
+            {**driver_data, "DriverUpdated": datetime.now()}
+        )
     
     @staticmethod
-    def delete_driver(db: Session, company_id: str, driver_id: str):
-        driver = db.query(Driver).filter(
-            Driver.DriverCompanyId == company_id,
-            Driver.DriverId == driver_id
-        ).first()
-        if driver:
-            db.delete(driver)
-            db.commit()
-            return True
-        return False
+    async def delete_driver(db: AsyncSession, company_id: str, driver_id: str):
+        return await _delete(
+            db, Driver, [Driver.DriverCompanyId == company_id, Driver.DriverId == driver_id],
+            children=[
+                (RFIDCard, [RFIDCard.RFIDCardCompanyId == company_id, RFIDCard.RFIDCardDriverId == driver_id]),
+                (ChargeSession, [
+                    ChargeSession.ChargerSessionCompanyId == company_id,
+                    ChargeSession.ChargerSessionDriverId == driver_id
+                ])
+            ]
+        )
     
     @staticmethod
-    def get_driver_by_rfid(db: Session, rfid_card_id: str):
-        rfid_card = db.query(RFIDCard).filter(
+    async def get_driver_by_rfid(db: AsyncSession, rfid_card_id: str):
+        result = await db.execute(select(RFIDCard).filter(
             RFIDCard.RFIDCardId == rfid_card_id,
             RFIDCard.RFIDCardEnabled == True
-        ).first()
+        ))
+        rfid_card = result.scalars().first()
         
         if rfid_card:
-            return db.query(Driver).filter(
+            result = await db.execute(select(Driver).filter(
                 Driver.DriverCompanyId == rfid_card.RFIDCardCompanyId,
                 Driver.DriverId == rfid_card.RFIDCardDriverId,
                 Driver.DriverEnabled == True
-            ).first()
+            ))
+            return result.scalars().first()
         
         return None
 
 # RFIDCard Repository
 class RFIDCardRepository:
     @staticmethod
-    def get_rfid_cards(
-        db: Session, 
+    async def get_rfid_cards(
+        db: AsyncSession, 
         company_id: Optional[str] = None,
         driver_id: Optional[str] = None,
         skip: int = 0, 
         limit: int = 100
     ):
-        query = db.query(RFIDCard)
+        query = select(RFIDCard)
         if company_id:
             query = query.filter(RFIDCard.RFIDCardCompanyId == company_id)
         if driver_id:
             query = query.filter(RFIDCard.RFIDCardDriverId == driver_id)
-        return query.offset(skip).limit(limit).all()
+        result = await db.execute(query.offset(skip).limit(limit))
+        return result.scalars().all()
     
     @staticmethod
-    def get_rfid_card(db: Session, company_id: str, driver_id: str, card_id: str):
-        return db.query(RFIDCard).filter(
+    def _key(company_id: str, driver_id: str, card_id: str):
+        return [
             RFIDCard.RFIDCardCompanyId == company_id,
             RFIDCard.RFIDCardDriverId == driver_id,
             RFIDCard.RFIDCardId == card_id
-        ).first()
+        ]
+
+    @staticmethod
+    async def get_rfid_card(db: AsyncSession, company_id: str, driver_id: str, card_id: str):
+        result = await db.execute(select(RFIDCard).filter(
+            *RFIDCardRepository._key(company_id, driver_id, card_id)
+        ))
+        return result.scalars().first()
     
     @staticmethod
-    def get_rfid_card_by_id(db: Session, card_id: str):
-        return db.query(RFIDCard).filter(
+    async def get_rfid_card_by_id(db: AsyncSession, card_id: str):
+        result = await db.execute(select(RFIDCard).filter(
             RFIDCard.RFIDCardId == card_id
-        ).first()
+        ))
+        return result.scalars().first()
+    
+    @staticmethod
+    async def get_card_authorizations(
+        db: AsyncSession,
+        card_id: Optional[str] = None,
+        limit: Optional[int] = None,
+        company_id: Optional[str] = None
+    ):
+        """Return (RFIDCard, Driver, DriversGroup) rows used to authorize id tags.
+
+        Driver and DriversGroup are None when the card or driver references none.
+        """
+        query = select(RFIDCard, Driver, DriversGroup).outerjoin(
+            Driver,
+            (Driver.DriverCompanyId == RFIDCard.RFIDCardCompanyId) &
+            (Driver.DriverId == RFIDCard.RFIDCardDriverId)
+        ).outerjoin(
+            DriversGroup, DriversGroup.DriversGroupId == Driver.DriverGroupId
+        )
+        if card_id is not None:
+            query = query.filter(RFIDCard.RFIDCardId == card_id)
+        if company_id is not None:
+            query = query.filter(RFIDCard.RFIDCardCompanyId == company_id)
+        if limit is not None:
+            query = query.limit(limit)
+        result = await db.execute(query)
+        return result.all()
     
     @staticmethod
-    def create_rfid_card(db: Session, card_data: Dict[str, Any]):
+    async def create_rfid_card(db: AsyncSession, card_data: Dict[str, Any]):
         rfid_card = RFIDCard(**card_data)
         db.add(rfid_card)
-        db.commit()
-        db.refresh(rfid_card)
+        await db.commit()
+        await db.refresh(rfid_card)
         return rfid_card
     
     @staticmethod
-    def update_rfid_card(db: Session, company_id: str, driver_id: str, card_id: str, card_data: Dict[str, Any]):
-        rfid_card = db.query(RFIDCard).filter(
-            RFIDCard.RFIDCardCompanyId == company_id,
-            RFIDCard.RFIDCardDriverId == driver_id,
-            RFIDCard.RFIDCardId == card_id
-        ).first()
-        if rfid_card:
-            for key, value in card_data.items():
-                setattr(rfid_card, key, value)
-            rfid_card.RFIDCardUpdated = datetime.now()
-            db.commit()
-            db.refresh(rfid_card)
-        return rfid_card
+    async def update_rfid_card(db: AsyncSession, company_id: str, driver_id: str, card_id: str, card_data: Dict[str, Any]):
+        return await _update_returning(
+            db, RFIDCard, RFIDCardRepository._key(company_id, driver_id, card_id),
+            {**card_data, "RFIDCardUpdated": datetime.now()}
+        )
     
     @staticmethod
-    def delete_rfid_card(db: Session, company_id: str, driver_id: str, card_id: str):
-        rfid_card = db.query(RFIDCard).filter(
-            RFIDCard.RFIDCardCompanyId == company_id,
-            RFIDCard.RFIDCardDriverId == driver_id,
-            RFIDCard.RFIDCardId == card_id
-        ).first()
-        if rfid_card:
-            db.delete(rfid_card)
-            db.commit()
-            return True
-        return False
+    async def delete_rfid_card(db: AsyncSession, company_id: str, driver_id: str, card_id: str):
+        return await _delete(
+            db, RFIDCard, RFIDCardRepository._key(company_id, driver_id, card_id),
+            children=[(ChargeSession, [
+                ChargeSession.ChargerSessionCompanyId == company_id,
+                ChargeSession.ChargerSessionDriverId == driver_id,
+                ChargeSession.ChargerSessionRFIDCard == card_id
+            ])]
+        )
 
 # Connector Repository
 class ConnectorRepository:
     @staticmethod
-    def get_connectors(
-        db: Session, 
+    async def get_connectors(
+        db: AsyncSession, 
         company_id: Optional[str] = None,
         site_id: Optional[str] = None,
         charger_id: Optional[str] = None,
         skip: int = 0, 
         limit: int = 100
     ):
-        query = db.query(Connector)
+        query = select(Connector)
         if company_id:
             query = query.filter(Connector.ConnectorCompanyId == company_id)
         if site_id:
             query = query.filter(Connector.ConnectorSiteId == site_id)
         if charger_id:
             query = query.filter(Connector.ConnectorChargerId == charger_id)
-        return query.offset(skip).limit(limit).all()
+        result = await db.execute(query.offset(skip).limit(limit))
+        return result.scalars().all()
     
     @staticmethod
-    def get_connector(db: Session, company_id: str, site_id: str, charger_id: str, connector_id: str):
-        return db.query(Connector).filter(
+    def _key(company_id: str, site_id: str, charger_id: str, connector_id: str):
+        return [
             Connector.ConnectorCompanyId == company_id,
             Connector.ConnectorSiteId == site_id,
             Connector.ConnectorChargerId == charger_id,
             Connector.ConnectorId == connector_id
-        ).first()
+        ]
+
+    @staticmethod
+    async def get_connector(db: AsyncSession, company_id: str, site_id: str, charger_id: str, connector_id: str):
+        result = await db.execute(select(Connector).filter(
+            *ConnectorRepository._key(company_id, site_id, charger_id, connector_id)
+        ))
+        return result.scalars().first()
     
     @staticmethod
-    def create_connector(db: Session, connector_data: Dict[str, Any]):
+    async def create_connector(db: AsyncSession, connector_data: Dict[str, Any]):
         connector = Connector(**connector_data)
         db.add(connector)
-        db.commit()
-        db.refresh(connector)
+        await db.commit()
+        await db.refresh(connector)
         return connector
     
     @staticmethod
-    def update_connector(
-        db: Session, 
+    async def update_connector(
+        db: AsyncSession, 
         company_id: str, 
         site_id: str, 
         charger_id: str, 
         connector_id: str, 
         connector_data: Dict[str, Any]
     ):
-        connector = db.query(Connector).filter(
-            Connector.ConnectorCompanyId == company_id,
-            Connector.ConnectorSiteId == site_id,
-            Connector.ConnectorChargerId == charger_id,
-            Connector.ConnectorId == connector_id
-        ).first()
-        if connector:
-            for key, value in connector_data.items():
-                setattr(connector, key, value)
-            connector.ConnectorUpdated = datetime.now()
-            db.commit()
-            db.refresh(connector)
-        return connector
+        return await _update_returning(
+            db, Connector, ConnectorRepository._key(company_id, site_id, charger_id, connector_id),
+            {**connector_data, "ConnectorUpdated": datetime.now()}
+        )
     
     @staticmethod
-    def update_connector_status(
-        db: Session, 
+    async def update_connector_status(
+        db: AsyncSession, 
         company_id: str, 
         site_id: str, 
         charger_id: str, 
         connector_id: str, 
         status: str
     ):
-        connector = db.query(Connector).filter(
-            Connector.ConnectorCompanyId == company_id,
-            Connector.ConnectorSiteId == site_id,
-            Connector.ConnectorChargerId == charger_id,
-            Connector.ConnectorId == connector_id
-        ).first()
-        if connector:
-            connector.ConnectorStatus = status
-            connector.ConnectorUpdated = datetime.now()
-            db.commit()
-            db.refresh(connector)
-        return connector
+        return await _update_returning(
+            db, Connector, ConnectorRepository._key(company_id, site_id, charger_id, connector_id),
+            {"ConnectorStatus": status, "ConnectorUpdated": datetime.now()}
+        )
     
     @staticmethod
-    def delete_connector(db: Session, company_id: str, site_id: str, charger_id: str, connector_id: str):
-        connector = db.query(Connector).filter(
-            Connector.ConnectorCompanyId == company_id,
-            Connector.ConnectorSiteId == site_id,
-            Connector.ConnectorChargerId == charger_id,
-            Connector.ConnectorId == connector_id
-        ).first()
-        if connector:
-            db.delete(connector)
-            db.commit()
-            return True
-        return False
\ No newline at end of file
+    def _status_row(status: Dict[str, Any]) -> Dict[str, Any]:
+        """Connectors row of a connector first seen in a StatusNotification"""
+        return {
+            "ConnectorCompanyId": status["company_id"],
+            "ConnectorSiteId": status["site_id"],
+            "ConnectorChargerId": status["charger_id"],
+            "ConnectorId": status["connector_id"],
+            "ConnectorName": f"Connector {status['connector_id']}",
+            "ConnectorType": "Unknown",
+            "ConnectorEnabled": True,
+            "ConnectorStatus": status["status"],
+            "ConnectorCreated": status["updated"],
+            "ConnectorUpdated": status["updated"]
+        }
+
+    @staticmethod
+    async def bulk_upsert_statuses(db: AsyncSession, statuses: List[Dict[str, Any]]):
+        """Write many connector statuses with one executemany upsert, or with one SELECT plus
+        executemany INSERT/UPDATE on backends without upserts.
+
+        Each entry holds company_id, site_id, charger_id, connector_id, status and
+        updated (a datetime). Missing connectors are created, as the OCPP status
+        path does for single updates. The caller owns the transaction.
+        """
+        if not statuses:
+            return
+        table = Connector.__table__
+        stmt = _upsert(db, table, ("ConnectorStatus", "ConnectorUpdated"))
+        if stmt is not None:
+            await db.execute(stmt, [ConnectorRepository._status_row(st) for st in statuses])
+            return
+
+        keys = [
+            (st["company_id"], st["site_id"], st["charger_id"], st["connector_id"])
+            for st in statuses
+        ]
+        result = await db.execute(
+            select(
+                Connector.ConnectorCompanyId, Connector.ConnectorSiteId,
+                Connector.ConnectorChargerId, Connector.ConnectorId
+            ).where(
+                tuple_(
+                    Connector.ConnectorCompanyId, Connector.ConnectorSiteId,
+                    Connector.ConnectorChargerId, Connector.ConnectorId
+                ).in_(keys)
+            )
+        )
+        existing = set(tuple(row) for row in result.all())
+
+        to_update = [st for key, st in zip(keys, statuses) if key in existing]
+        to_insert = [st for key, st in zip(keys, statuses) if key not in existing]
+
+        if to_update:
+            stmt = (
+                update(table)
+                .where(
+                    table.c.ConnectorCompanyId == bindparam("b_company_id"),
+                    table.c.ConnectorSiteId == bindparam("b_site_id"),
+                    table.c.ConnectorChargerId == bindparam("b_charger_id"),
+                    table.c.ConnectorId == bindparam("b_connector_id")
+                )
+                .values(
+                    ConnectorStatus=bindparam("b_status"),
+                    ConnectorUpdated=bindparam("b_updated")
+                )
+            )
+            await db.execute(stmt, [
+                {
+                    "b_company_id": st["company_id"],
+                    "b_site_id": st["site_id"],
+                    "b_charger_id": st["charger_id"],
+                    "b_connector_id": st["connector_id"],
+                    "b_status": st["status"],
+                    "b_updated": st["updated"]
+                }
+                for st in to_update
+            ])
+        if to_insert:
+            await db.execute(insert(table), [ConnectorRepository._status_row(st) for st in to_insert])
+
+    @staticmethod
+    async def delete_connector(db: AsyncSession, company_id: str, site_id: str, charger_id: str, connector_id: str):
+        return await _delete(
+            db, Connector, ConnectorRepository._key(company_id, site_id, charger_id, connector_id),
+            children=[(ChargeSession, [
+                ChargeSession.ChargerSessionCompanyId == company_id,
+                ChargeSession.ChargerSessionSiteId == site_id,
+                ChargeSession.ChargerSessionChargerId == charger_id,
+                ChargeSession.ChargerSessionConnectorId == connector_id
+            ])]
+        )
+
+# LocalListEntry Repository
+class LocalListRepository:
+    @staticmethod
+    async def get_version(db: AsyncSession, company_id: str) -> int:
+        """Version of the company's published list, 0 when nothing was published"""
+        result = await db.execute(select(func.max(LocalListEntry.LocalListEntryVersion)).filter(
+            LocalListEntry.LocalListEntryCompanyId == company_id
+        ))
+        return result.scalar() or 0
+
+    @staticmethod
+    async def get_company_ids(db: AsyncSession) -> List[str]:
+        """Companies with RFID cards or a published list"""
+        result = await db.execute(
+            select(RFIDCard.RFIDCardCompanyId).union(select(LocalListEntry.LocalListEntryCompanyId))
+        )
+        return sorted(result.scalars().all())
+
+    @staticmethod
+    async def next_version(db: AsyncSession, company_id: str) -> int:
+        """Claim the next list version of a company, without committing.
+
+        The version counter is a row in IdBlocks. Its UPDATE keeps the row
+        locked until the caller's transaction ends, so publishes of a company
+        are serialized across workers. The caller commits to use the version
+        or rolls back to leave the counter unchanged.
+        """
+        name = f"LocalList:{company_id}"
+        for _ in range(2):
+            result = await db.execute(
+                update(IdBlock)
+                .where(IdBlock.IdBlockName == name)
+                .values(IdBlockNextHi=IdBlock.IdBlockNextHi + 1, IdBlockUpdated=datetime.now())
+            )
+            if result.rowcount:
+                return (await db.execute(
+                    select(IdBlock.IdBlockNextHi).where(IdBlock.IdBlockName == name)
+                )).scalar_one()
+
+            # First publish through the counter, continue from the versions already published
+            try:
+                async with db.begin_nested():
+                    version = await LocalListRepository.get_version(db, company_id) + 1
+                    db.add(IdBlock(IdBlockName=name, IdBlockNextHi=version))
+                return version
+            except IntegrityError:
+                # Created by a concurrent worker meanwhile, take it through the UPDATE
+                pass
+        raise RuntimeError(f"Could not claim a local list version for {company_id}")
+
+    @staticmethod
+    async def get_entries(db: AsyncSession, company_id: str, since_version: int = 0):
+        """Return the entries of a company's list that changed after since_version"""
+        result = await db.execute(select(LocalListEntry).filter(
+            LocalListEntry.LocalListEntryCompanyId == company_id,
+            LocalListEntry.LocalListEntryVersion > since_version
+        ).order_by(LocalListEntry.LocalListEntryIdTag))
+        return result.scalars().all()
+    
+    @staticmethod
+    async def apply_changes(
+        db: AsyncSession, company_id: str, version: int, changes: Dict[str, Dict[str, Any]]
+    ):
+        """Write changed entries, keyed by id tag, as part of list version"""
+        result = await db.execute(select(LocalListEntry).filter(
+            LocalListEntry.LocalListEntryCompanyId == company_id,
+            LocalListEntry.LocalListEntryIdTag.in_(list(changes))
+        ))
+        existing = {entry.LocalListEntryIdTag: entry for entry in result.scalars()}
+        
+        for id_tag, values in changes.items():
+            entry = existing.get(id_tag)
+            if entry is None:
+                entry = LocalListEntry(LocalListEntryCompanyId=company_id, LocalListEntryIdTag=id_tag)
+                db.add(entry)
+            for key, value in values.items():
+                setattr(entry, key, value)
+            entry.LocalListEntryVersion = version
+        await db.commit()
+
+# CommandJob Repository
+class CommandJobRepository:
+    @staticmethod
+    async def get_jobs(
+        db: AsyncSession,
+        charger_id: Optional[str] = None,
+        status: Optional[str] = None,
+        skip: int = 0,
+        limit: int = 100
+    ):
+        query = select(CommandJob)
+        if charger_id:
+            query = query.filter(CommandJob.CommandJobChargerId == charger_id)
+        if status:
+            query = query.filter(CommandJob.CommandJobStatus == status)
+        result = await db.execute(query.order_by(CommandJob.CommandJobCreated.desc()).offset(skip).limit(limit))
+        return result.scalars().all()
+
+    @staticmethod
+    async def get_job(db: AsyncSession, job_id: str):
+        result = await db.execute(select(CommandJob).filter(CommandJob.CommandJobId == job_id))
+        return result.scalars().first()
+
+    @staticmethod
+    async def create_job(db: AsyncSession, job_data: Dict[str, Any]):
+        job = CommandJob(**job_data)
+        db.add(job)
+        await db.commit()
+        await db.refresh(job)
+        return job
+
+    @staticmethod
+    async def get_next_queued(db: AsyncSession, charger_id: str, now: datetime):
+        """Oldest queued job of a charger that has not expired"""
+        result = await db.execute(select(CommandJob).filter(
+            CommandJob.CommandJobChargerId == charger_id,
+            CommandJob.CommandJobStatus == "queued",
+            CommandJob.CommandJobExpiresAt > now
+        ).order_by(CommandJob.CommandJobCreated).limit(1))
+        return result.scalars().first()
+
+    @staticmethod
+    async def get_queued_charger_ids(db: AsyncSession, now: datetime) -> List[str]:
+        """Chargers with queued jobs that have not expired"""
+        result = await db.execute(select(CommandJob.CommandJobChargerId).filter(
+            CommandJob.CommandJobStatus == "queued",
+            CommandJob.CommandJobExpiresAt > now
+        ).distinct())
+        return list(result.scalars().all())
+
+    @staticmethod
+    async def claim_job(db: AsyncSession, job_id: str, now: datetime) -> bool:
+        """Move a queued job to running; False when another worker claimed it first. Commits on its own."""
+        result = await db.execute(
+            update(CommandJob)
+            .where(CommandJob.CommandJobId == job_id, CommandJob.CommandJobStatus == "queued")
+            .values(
+                CommandJobStatus="running",
+                CommandJobAttempts=CommandJob.CommandJobAttempts + 1,
+                CommandJobStarted=now
+            )
+            # Leave loaded jobs as they were read, callers count the attempt themselves
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        return bool(result.rowcount)
+
+    @staticmethod
+    async def set_job_status(
+        db: AsyncSession,
+        job_id: str,
+        status: str,
+        from_status: str,
+        values: Optional[Dict[str, Any]] = None
+    ) -> bool:
+        """Change a job's status if it is still from_status. Commits on its own."""
+        result = await db.execute(
+            update(CommandJob)
+            .where(CommandJob.CommandJobId == job_id, CommandJob.CommandJobStatus == from_status)
+            .values(CommandJobStatus=status, **(values or {}))
+        )
+        await db.commit()
+        return bool(result.rowcount)
+
+    @staticmethod
+    async def expire_jobs(db: AsyncSession, now: datetime) -> int:
+        """Expire the queued jobs past their expiry. Commits on its own."""
+        result = await db.execute(
+            update(CommandJob)
+            .where(CommandJob.CommandJobStatus == "queued", CommandJob.CommandJobExpiresAt <= now)
+            .values(CommandJobStatus="expired", CommandJobCompleted=now)
+        )
+        await db.commit()
+        return result.rowcount
+
+    @staticmethod
+    async def fail_stale_jobs(db: AsyncSession, started_before: datetime, now: datetime) -> int:
+        """Fail running jobs whose worker stopped before recording a result. Commits on its own."""
+        result = await db.execute(
+            update(CommandJob)
+            .where(CommandJob.CommandJobStatus == "running", CommandJob.CommandJobStarted < started_before)
+            .values(CommandJobStatus="failed", CommandJobError="Interrupted", CommandJobCompleted=now)
+        )
+        await db.commit()
+        return result.rowcount
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional, List
+from typing import Any, Dict, Literal, Optional, List
 from datetime import datetime
 
 # Base schemas for request and response models
@@ -85,6 +85,7 @@ class ChargerBase(BaseModel):
     ChargerPhoto: Optional[str] = None
     ChargerFirmwareVersion: Optional[str] = None
     ChargerPaymentId: Optional[str] = None
+    ChargerSchemaValidation: Optional[Literal["full", "sampled", "off"]] = None
 
 class ChargerCreate(ChargerBase):
     ChargerCompanyId: str
@@ -99,6 +100,7 @@ class ChargerResponse(ChargerBase):
     ChargerCompanyId: str
     ChargerSiteId: str
     ChargerId: str
+    ChargerLocalListVersion: Optional[int] = None
     ChargerCreated: datetime
     Charger_Updated: Optional[datetime] = None
 
@@ -137,6 +139,26 @@ class ConnectorResponse(ConnectorBase):
     class Config:
         orm_mode = True
 
+# DriversGroup schemas
+class DriversGroupBase(BaseModel):
+    DriversGroupName: Optional[str] = None
+    DriversGroupEnabled: bool = True
+    DriversGroupDiscountId: Optional[str] = None
+
+class DriversGroupCreate(DriversGroupBase):
+    DriversGroupId: str
+
+class DriversGroupUpdate(DriversGroupBase):
+    DriversGroupEnabled: Optional[bool] = None
+
+class DriversGroupResponse(DriversGroupBase):
+    DriversGroupId: str
+    DriversGroupCreated: datetime
+    DriversGroupUpdated: Optional[datetime] = None
+
+    class Config:
+        orm_mode = True
+
 # Driver schemas
 class DriverBase(BaseModel):
     DriverFullName: str
@@ -197,6 +219,7 @@ class ChargeSessionBase(BaseModel):
     ChargerSessionSiteId: str
     ChargerSessionChargerId: str
     ChargerSessionConnectorId: str
+    ChargerSessionTransactionId: Optional[int] = None
     ChargerSessionDriverId: Optional[str] = None
     ChargerSessionRFIDCard: Optional[str] = None
     ChargerSessionStart: datetime
@@ -255,4 +278,34 @@ class EventsDataResponse(EventsDataBase):
     EventsDataSessionId: int
 
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+# MeterSample schemas
+class MeterSampleResponse(BaseModel):
+    MeterSampleId: int
+    MeterSampleSessionId: int
+    MeterSampleMeasurand: int
+    MeterSamplePhase: Optional[int] = None
+    MeterSampleTimestamp: datetime
+    MeterSampleValue: float
+
+    class Config:
+        orm_mode = True
+
+# Bulk command schemas
+class BulkCommandRequest(BaseModel):
+    """Chargers to target (combined filters intersect) and the command's arguments"""
+    company_id: Optional[str] = None
+    site_id: Optional[str] = None
+    charge_point_ids: Optional[List[str]] = None
+    all_connected: bool = False
+    params: Dict[str, Any] = {}
+    concurrency: Optional[int] = Field(None, ge=1)
+    timeout: Optional[float] = Field(None, gt=0)
+
+# CommandJob schemas
+class CommandJobCreate(BaseModel):
+    charge_point_id: str
+    command: str
+    params: Dict[str, Any] = {}
+    ttl_seconds: Optional[int] = Field(None, gt=0)
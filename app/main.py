@@ -1,8 +1,10 @@
 from fastapi import FastAPI
 from app.api.routes import router as api_router
 from app.api.db_routes import router as db_router
+from app.api.middleware import WatchdogMiddleware
 from app.ws.websocket_handler import websocket_endpoint
 from contextlib import asynccontextmanager
+import asyncio
 import logging
 
 # Setup logging
@@ -14,16 +16,66 @@ logger = logging.getLogger("ocpp-server")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    from app.adapters.protocol_trace import protocol_trace
+    protocol_trace.start()
+    from app.services.metrics import instrument_pool, loop_lag
+    await loop_lag.start()
+    from app.services.watchdog import watchdog
+    await watchdog.start()
+
     # Initialize database 
     from app.database.database import Base, engine
+    instrument_pool(engine)
     logger.info("Creating database tables...")
-    Base.metadata.create_all(bind=engine)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
     
+    from app.services.write_behind import write_behind
+    await write_behind.start()
+    from app.services.db_executor import db_executor
+    await db_executor.start()
+    from app.services.transaction_ids import transaction_ids
+    await transaction_ids.start()
+    from app.services.charger_directory import charger_directory
+    await charger_directory.start()
+    from app.services.active_sessions import active_sessions
+    await active_sessions.load()
+    from app.services.auth_cache import authorization_cache
+    await authorization_cache.warm()
+    from app.services.schema_validation import schema_validation
+    # Compiling the schemas takes a few hundred ms, keep it off the loop
+    await asyncio.get_running_loop().run_in_executor(None, schema_validation.load)
+    from app.ws.command_bus import command_bus
+    await command_bus.start()
+    from app.services.command_jobs import command_jobs
+    await command_jobs.start()
+    from app.services.heartbeats import heartbeat_scheduler
+    await heartbeat_scheduler.start()
+    from app.services.liveness import liveness
+    await liveness.start()
+    from app.services.local_list import local_list
+    await local_list.start()
+
     logger.info("OCPP Server starting up")
     yield
     logger.info("OCPP Server shutting down")
+    await local_list.stop()
+    await liveness.stop()
+    await heartbeat_scheduler.stop()
+    await command_jobs.stop()
+    await command_bus.stop()
+    await charger_directory.stop()
+    from app.services.task_supervisor import task_supervisor
+    await task_supervisor.drain()
+    await watchdog.stop()
+    await loop_lag.stop()
+    await db_executor.stop()
+    await write_behind.stop()
+    await engine.dispose()
+    protocol_trace.stop()
 
 app = FastAPI(title="OCPP Central System Server", lifespan=lifespan)
+app.add_middleware(WatchdogMiddleware)
 
 # Include routers
 app.include_router(api_router)
@@ -5,11 +5,8 @@ import logging
 from datetime import datetime
 import sys
 from pathlib import Path
-import httpx
-import asyncio
 
 from ocpp.routing import on
-from ocpp.v16 import ChargePoint as cp
 from ocpp.v16 import call, call_result
 from ocpp.v16.datatypes import IdTagInfo
 from ocpp.v16.enums import (
@@ -36,6 +33,22 @@ from ocpp.v16.enums import (
     GenericStatus
 )
 
+from app.database.database import SessionLocal
+from app.services.active_sessions import active_sessions
+from app.services.boot_admission import boot_admission
+from app.services.charge_point_base import ChargePointBase
+from app.services.charger_directory import ChargerEntry, charger_directory
+from app.services.db_executor import db_executor
+from app.services.heartbeats import heartbeat_scheduler
+from app.services.metrics import db_write_seconds
+from app.services.ocpp_service import OCPPService
+from app.services.task_supervisor import task_supervisor
+from app.services.write_behind import write_behind
+from app.services.auth_cache import authorization_cache
+from app.services.local_list import local_list, LOCAL_LIST_SYNC_ON_BOOT
+from app.services.meter_values import parse_meter_values
+from app.services.transaction_ids import transaction_ids
+
 def setup_logger(logger_name):
     """Set up a logger instance."""
     logger = logging.getLogger(logger_name)
@@ -49,25 +62,43 @@ def setup_logger(logger_name):
 # Set up logging
 logger = setup_logger("ocpp_charge_point")
 
-class ChargePoint16(cp):
+class ChargePoint16(ChargePointBase):
     """
     ChargePoint implementation for OCPP 1.6
     """
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.transaction_id = 0
+        self.company_id, self.site_id = charger_directory.tenant(self.id)
 
     @on(Action.boot_notification)
-    def on_boot_notification(self, **kwargs):
+    async def on_boot_notification(self, **kwargs):
         """Handle BootNotification from Charge Point"""
         logger.info(f"Received BootNotification from {self.id}: {kwargs}")
         
-        # Register charge point in the database
-        asyncio.create_task(self._register_charger_in_db(kwargs))
+        # Over the admission rate the charger is told to boot again later
+        retry_interval = boot_admission.admit(self.id)
+        if retry_interval is not None:
+            return call_result.BootNotification(
+                current_time=datetime.now().isoformat(),
+                interval=retry_interval,
+                status=RegistrationStatus.pending
+            )
+        
+        # Register charge point with the next write-behind flush
+        write_behind.record_boot(
+            self.company_id, self.site_id, self.id,
+            kwargs.get('charge_point_vendor', 'Unknown'), kwargs.get('charge_point_model', 'Unknown'),
+            kwargs.get('charge_point_serial_number'), kwargs.get('firmware_version')
+        )
+        if charger_directory.get(self.id) is None:
+            # Admitted with ALLOW_UNKNOWN_CHARGERS, known from now on
+            charger_directory.put(ChargerEntry(self.company_id, self.site_id, self.id))
+        if LOCAL_LIST_SYNC_ON_BOOT:
+            task_supervisor.spawn(self.id, "local_list_sync", self._sync_local_list, retries=2, coalesce=True)
         
         return call_result.BootNotification(
             current_time=datetime.now().isoformat(),
-            interval=300, 
+            interval=heartbeat_scheduler.assign(self),
             status=RegistrationStatus.accepted
         )
 
@@ -76,8 +107,11 @@ class ChargePoint16(cp):
         """Handle StatusNotification from Charge Point"""
         logger.info(f"Received StatusNotification from {self.id}: {kwargs}")
         
-        # Update connector status in the database
-        asyncio.create_task(self._update_connector_status_in_db(kwargs))
+        # Queue connector status for the next write-behind flush
+        write_behind.record_connector_status(
+            self.company_id, self.site_id, self.id,
+            str(kwargs.get('connector_id', '0')), kwargs.get('status', 'Available')
+        )
         
         return call_result.StatusNotification()
 
@@ -86,28 +120,27 @@ class ChargePoint16(cp):
         """Handle Heartbeat from Charge Point"""
         logger.info(f"Received Heartbeat from {self.id}")
         
-        # Update heartbeat in the database
-        asyncio.create_task(self._update_heartbeat_in_db())
+        # Queue heartbeat for the next write-behind flush
+        write_behind.record_heartbeat(self.company_id, self.site_id, self.id)
+        heartbeat_scheduler.heartbeat(self)
         
         return call_result.Heartbeat(current_time=datetime.now().isoformat())
 
     @on(Action.authorize)
-    def on_authorize(self, **kwargs):
+    async def on_authorize(self, **kwargs):
         """Handle Authorize from Charge Point"""
         id_tag = kwargs.get('id_tag')
         logger.info(f"Received Authorize from {self.id} with id_tag: {id_tag}")
         
-        # In a real implementation, you'd validate the ID tag against the database
-        # For now, we'll always accept
+        # Served from memory, the database is only hit on a cache miss
+        authorization = await authorization_cache.authorize(id_tag)
         
         return call_result.Authorize(
-            id_tag_info=IdTagInfo(
-                status=AuthorizationStatus.accepted
-            )
+            id_tag_info=self._id_tag_info(authorization)
         )
 
     @on(Action.start_transaction)
-    def on_start_transaction(self, **kwargs):
+    async def on_start_transaction(self, **kwargs):
         """Handle StartTransaction from Charge Point"""
         id_tag = kwargs.get('id_tag')
         connector_id = kwargs.get('connector_id')
@@ -115,21 +148,27 @@ class ChargePoint16(cp):
         
         logger.info(f"Received StartTransaction from {self.id} on connector {connector_id}")
         
-        # Start charging session in the database
-        self.transaction_id += 1  # In a real implementation, this should be fetched from the database
-        transaction_id = self.transaction_id
+        # Globally unique id, normally served from a pre-reserved block
+        transaction_id = await transaction_ids.next_id()
+        
+        authorization = await authorization_cache.authorize(id_tag)
+        
+        # Queued now, the session is written later and must not overwrite StatusNotifications received meanwhile
+        write_behind.record_connector_status(self.company_id, self.site_id, self.id, str(connector_id), "Charging")
         
         # Start session in the database
-        asyncio.create_task(self._start_session_in_db(connector_id, id_tag, transaction_id))
+        await db_executor.submit(
+            self.id, "start_session", self._start_session_in_db, connector_id, id_tag, transaction_id
+        )
         
-        id_tag_info = IdTagInfo(status=AuthorizationStatus.accepted)
+        id_tag_info = self._id_tag_info(authorization)
         return call_result.StartTransaction(
             transaction_id=transaction_id,
             id_tag_info=id_tag_info
         )
 
     @on(Action.stop_transaction)
-    def on_stop_transaction(self, **kwargs):
+    async def on_stop_transaction(self, **kwargs):
         """Handle StopTransaction from Charge Point"""
         transaction_id = kwargs.get('transaction_id')
         id_tag = kwargs.get('id_tag')
@@ -139,15 +178,25 @@ class ChargePoint16(cp):
         
         logger.info(f"Received StopTransaction from {self.id} for transaction {transaction_id}")
         
+        # Queued now, as for StartTransaction. A session unknown here (its start not written yet, or started
+        # on another worker) is left to the StatusNotification the charger sends after stopping.
+        session = active_sessions.get(transaction_id)
+        if session is not None and session.charger_id == self.id:
+            write_behind.record_connector_status(
+                session.company_id, session.site_id, self.id, session.connector_id, "Available"
+            )
+        
         # End session in the database
-        asyncio.create_task(self._end_session_in_db(transaction_id, meter_stop, reason))
+        await db_executor.submit(
+            self.id, "end_session", self._end_session_in_db, transaction_id, meter_stop, reason
+        )
         
         return call_result.StopTransaction(
             id_tag_info=IdTagInfo(status=AuthorizationStatus.accepted)
         )
 
     @on(Action.meter_values)
-    def on_meter_values(self, **kwargs):
+    async def on_meter_values(self, **kwargs):
         """Handle MeterValues from Charge Point"""
         connector_id = kwargs.get('connector_id')
         transaction_id = kwargs.get('transaction_id')
@@ -155,153 +204,72 @@ class ChargePoint16(cp):
         
         logger.info(f"Received MeterValues from {self.id} for connector {connector_id}")
         
-        # Process meter values
+        # Keep every sampled value, not just the first one
         if transaction_id and meter_values:
-            # Extract meter value (simplified)
-            # In a real implementation, you'd parse the sampled_value structure properly
             try:
-                if len(meter_values) > 0 and 'sampled_value' in meter_values[0]:
-                    sampled_value = meter_values[0]['sampled_value'][0]
-                    if 'value' in sampled_value:
-                        value = float(sampled_value['value'])
-                        # Update meter value in the database
-                        asyncio.create_task(self._update_meter_value_in_db(
-                            transaction_id, connector_id, int(value)
-                        ))
+                samples = parse_meter_values(meter_values)
             except Exception as e:
                 logger.error(f"Error processing meter values: {e}")
+                samples = None
+            if samples:
+                await db_executor.submit(
+                    self.id, "meter_values", self._update_meter_value_in_db, transaction_id, connector_id, samples
+                )
         
         return call_result.MeterValues()
 
-    async def _register_charger_in_db(self, boot_notification_data):
-        """Register charger in the database via API call"""
-        try:
-            vendor = boot_notification_data.get('charge_point_vendor', 'Unknown')
-            model = boot_notification_data.get('charge_point_model', 'Unknown')
-            serial = boot_notification_data.get('charge_point_serial_number')
-            firmware = boot_notification_data.get('firmware_version')
-            
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    "http://localhost:8000/db/ocpp/charger/register",
-                    params={
-                        "charger_id": self.id,
-                        "vendor": vendor,
-                        "model": model,
-                        "serial_number": serial,
-                        "firmware_version": firmware
-                    }
-                )
-                
-                if response.status_code != 200:
-                    logger.warning(f"Failed to register charger: {response.text}")
-                else:
-                    logger.info(f"Charger {self.id} registered successfully in database")
-        except Exception as e:
-            logger.error(f"Error registering charger: {e}")
-
-    async def _update_connector_status_in_db(self, status_data):
-        """Update connector status in the database via API call"""
-        try:
-            connector_id = str(status_data.get('connector_id', '0'))
-            status = status_data.get('status', 'Available')
-            
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    "http://localhost:8000/db/ocpp/connector/status",
-                    params={
-                        "charger_id": self.id,
-                        "connector_id": connector_id,
-                        "status": status
-                    }
-                )
-                
-                if response.status_code != 200:
-                    logger.warning(f"Failed to update connector status: {response.text}")
-                else:
-                    logger.info(f"Connector {self.id}/{connector_id} status updated to {status}")
-        except Exception as e:
-            logger.error(f"Error updating connector status: {e}")
+    @staticmethod
+    def _id_tag_info(authorization):
+        """Build the OCPP IdTagInfo for a cached tag authorization"""
+        return IdTagInfo(
+            status=authorization.status,
+            parent_id_tag=authorization.group_id,
+            expiry_date=authorization.expiry_date.isoformat() if authorization.expiry_date else None
+        )
 
-    async def _update_heartbeat_in_db(self):
-        """Update heartbeat in the database via API call"""
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    "http://localhost:8000/db/ocpp/charger/heartbeat",
-                    params={"charger_id": self.id}
-                )
-                
-                if response.status_code != 200:
-                    logger.warning(f"Failed to update heartbeat: {response.text}")
-                else:
-                    logger.debug(f"Heartbeat for {self.id} updated in database")
-        except Exception as e:
-            logger.error(f"Error updating heartbeat: {e}")
+    async def _sync_local_list(self):
+        """Bring the charger's local authorization list up to date (run by task_supervisor)"""
+        # The list version is stored on the charger row, registered by the flush
+        await write_behind.wait_for_flush(timeout=30)
+        await local_list.sync_charger(
+            self.id, self.send_local_list_req, self.company_id, self.site_id,
+            get_configuration=self.get_configuration_req
+        )
 
     async def _start_session_in_db(self, connector_id, id_tag, transaction_id):
-        """Start charging session in the database via API call"""
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    "http://localhost:8000/db/ocpp/session/start",
-                    params={
-                        "charger_id": self.id,
-                        "connector_id": connector_id,
-                        "id_tag": id_tag,
-                        "transaction_id": transaction_id
-                    }
-                )
-                
-                if response.status_code != 200:
-                    logger.warning(f"Failed to start charging session: {response.text}")
-                else:
-                    logger.info(f"Started charging session for {self.id}/{connector_id}")
-        except Exception as e:
-            logger.error(f"Error starting charging session: {e}")
+        """Start charging session in the database"""
+        async with db_write_seconds.time("start_session"), SessionLocal() as db:
+            await OCPPService.start_session(
+                db, self.id, str(connector_id), id_tag, transaction_id, self.company_id, self.site_id,
+                connector_status=False
+            )
+        logger.info(f"Started charging session for {self.id}/{connector_id}")
 
     async def _end_session_in_db(self, transaction_id, meter_stop, reason):
-        """End charging session in the database via API call"""
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    "http://localhost:8000/db/ocpp/session/end",
-                    params={
-                        "charger_id": self.id,
-                        "connector_id": "1",  # Ideally should be fetched from active session
-                        "transaction_id": transaction_id,
-                        "meter_value": meter_stop,
-                        "reason": reason
-                    }
-                )
-                
-                if response.status_code != 200:
-                    logger.warning(f"Failed to end charging session: {response.text}")
-                else:
-                    logger.info(f"Ended charging session for transaction {transaction_id}")
-        except Exception as e:
-            logger.error(f"Error ending charging session: {e}")
+        """End charging session in the database"""
+        async with db_write_seconds.time("end_session"), SessionLocal() as db:
+            result = await OCPPService.end_session(
+                db, self.id, None, transaction_id, meter_stop, reason, self.company_id, self.site_id,
+                connector_status=False
+            )
 
-    async def _update_meter_value_in_db(self, transaction_id, connector_id, meter_value):
-        """Update meter value in the database via API call"""
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    "http://localhost:8000/db/ocpp/meter-values",
-                    params={
-                        "charger_id": self.id,
-                        "connector_id": connector_id,
-                        "transaction_id": transaction_id,
-                        "meter_value": meter_value
-                    }
-                )
-                
-                if response.status_code != 200:
-                    logger.warning(f"Failed to update meter value: {response.text}")
-                else:
-                    logger.debug(f"Updated meter value for transaction {transaction_id} to {meter_value}")
-        except Exception as e:
-            logger.error(f"Error updating meter value: {e}")
+        if result is None:
+            logger.warning(f"Failed to end charging session: no active session for transaction {transaction_id}")
+        else:
+            logger.info(f"Ended charging session for transaction {transaction_id} on connector {result['connector_id']}")
+
+    async def _update_meter_value_in_db(self, transaction_id, connector_id, samples):
+        """Record meter samples and session energy in the database"""
+        async with db_write_seconds.time("meter_values"), SessionLocal() as db:
+            result = await OCPPService.record_meter_values(
+                db, self.id, str(connector_id), transaction_id, samples=samples,
+                company_id=self.company_id, site_id=self.site_id
+            )
+
+        if result is None:
+            logger.warning(f"Failed to update meter value: no session for transaction {transaction_id}")
+        else:
+            logger.debug(f"Recorded {result['samples_recorded']} meter samples for transaction {transaction_id}")
 
     async def change_configuration_req(self, key, value):
         payload = call.ChangeConfiguration(key=key, value=value)
@@ -354,4 +322,16 @@ class ChargePoint16(cp):
 
     async def cancel_reservation_req(self, reservation_id):
         payload = call.CancelReservation(reservation_id=reservation_id)
-        return await self.call(payload)
\ No newline at end of file
+        return await self.call(payload)
+
+    async def send_local_list_req(self, list_version, update_type, local_authorization_list):
+        payload = call.SendLocalList(
+            list_version=list_version,
+            update_type=update_type,
+            local_authorization_list=local_authorization_list
+        )
+        return await self.call(payload)
+
+    async def get_local_list_version_req(self):
+        payload = call.GetLocalListVersion()
+        return await self.call(payload)
@@ -0,0 +1,64 @@
+"""
+In-memory index of running charge sessions keyed by OCPP transaction id.
+
+StopTransaction and MeterValues only carry the transaction id, so this map lets
+them resolve the session without a query. It is per process: entries are added
+on StartTransaction, removed on StopTransaction and reloaded from the open
+sessions at startup. A miss falls back to the indexed database lookups, which
+covers sessions started by another worker.
+"""
+import logging
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from ..database.database import SessionLocal
+from ..database.repositories.repositories import ChargeSessionRepository
+
+logger = logging.getLogger("ocpp.active_sessions")
+
+
+@dataclass(frozen=True)
+class ActiveSession:
+    session_id: int
+    company_id: str
+    site_id: str
+    charger_id: str
+    connector_id: str
+
+
+class ActiveSessionIndex:
+    def __init__(self, session_factory=SessionLocal):
+        self.session_factory = session_factory
+        self._by_transaction_id: Dict[int, ActiveSession] = {}
+
+    def __len__(self) -> int:
+        return len(self._by_transaction_id)
+
+    def add(self, transaction_id: int, session) -> ActiveSession:
+        entry = ActiveSession(
+            session_id=session.ChargeSessionId,
+            company_id=session.ChargerSessionCompanyId,
+            site_id=session.ChargerSessionSiteId,
+            charger_id=session.ChargerSessionChargerId,
+            connector_id=session.ChargerSessionConnectorId
+        )
+        self._by_transaction_id[transaction_id] = entry
+        return entry
+
+    def get(self, transaction_id: int) -> Optional[ActiveSession]:
+        return self._by_transaction_id.get(transaction_id)
+
+    def discard(self, transaction_id: int):
+        self._by_transaction_id.pop(transaction_id, None)
+
+    async def load(self):
+        """Rebuild the map from the sessions that are still open in the database"""
+        async with self.session_factory() as db:
+            sessions = await ChargeSessionRepository.get_open_sessions_with_transaction_id(db)
+        self._by_transaction_id.clear()
+        for session in sessions:
+            self.add(session.ChargerSessionTransactionId, session)
+        logger.info(f"Loaded {len(sessions)} open charge sessions")
+
+
+active_sessions = ActiveSessionIndex()
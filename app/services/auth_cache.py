@@ -0,0 +1,273 @@
+"""
+In-process id tag authorization cache for Authorize and StartTransaction.
+
+Answers are built from RFIDCard, Driver and DriversGroup: a tag is Accepted
+only if the card, its driver and the driver's group are enabled and the card
+has not expired. Entries live for AUTH_CACHE_TTL_SECONDS (unknown tags for
+AUTH_CACHE_NEGATIVE_TTL_SECONDS) and the least recently used are evicted past
+AUTH_CACHE_MAX_ENTRIES. The RFID card, driver and drivers group CRUD routes
+invalidate the affected tags, the TTL bounds staleness for changes made
+elsewhere. The cache is warmed at startup and concurrent misses for the same
+tag share one query. Every invalidation advances an epoch, and a load that was
+already querying when its tag was invalidated returns its answer without
+storing it, so an old row cannot outlive the change that replaced it.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Optional, Set, Tuple
+
+from ocpp.v16.enums import AuthorizationStatus
+
+from ..database.database import SessionLocal
+from ..database.repositories.repositories import RFIDCardRepository
+
+logger = logging.getLogger("ocpp.auth_cache")
+
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "300"))
+AUTH_CACHE_NEGATIVE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_NEGATIVE_TTL_SECONDS", "60"))
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+
+
+@dataclass(frozen=True)
+class TagAuthorization:
+    status: AuthorizationStatus
+    company_id: Optional[str] = None
+    driver_id: Optional[str] = None
+    group_id: Optional[str] = None
+    expiry_date: Optional[datetime] = None
+
+    @property
+    def accepted(self) -> bool:
+        return self.status == AuthorizationStatus.accepted
+
+    def at(self, now: datetime) -> "TagAuthorization":
+        """Return this answer as of now, so a card expiring while cached reports Expired"""
+        if self.accepted and self.expiry_date is not None and self.expiry_date <= now:
+            return TagAuthorization(
+                AuthorizationStatus.expired, self.company_id, self.driver_id, self.group_id, self.expiry_date
+            )
+        return self
+
+
+UNKNOWN_TAG = TagAuthorization(AuthorizationStatus.invalid)
+
+
+def evaluate_card(card, driver, group) -> TagAuthorization:
+    """Derive the OCPP authorization status of one RFID card row.
+
+    Expiry is carried in expiry_date but not applied; see TagAuthorization.at.
+    """
+    if not card.RFIDCardEnabled or driver is None or not driver.DriverEnabled:
+        status = AuthorizationStatus.blocked
+    elif group is not None and not group.DriversGroupEnabled:
+        status = AuthorizationStatus.blocked
+    else:
+        status = AuthorizationStatus.accepted
+
+    return TagAuthorization(
+        status=status,
+        company_id=card.RFIDCardCompanyId,
+        driver_id=card.RFIDCardDriverId,
+        group_id=driver.DriverGroupId if driver is not None else None,
+        expiry_date=card.RFIDCardExpiration
+    )
+
+
+def choose_authorization(rows) -> TagAuthorization:
+    """Answer for an id tag registered on one or more cards, preferring an accepted one"""
+    answers = [evaluate_card(*row) for row in rows]
+    return next((answer for answer in answers if answer.accepted), answers[0])
+
+
+def group_by_id_tag(rows) -> Dict[str, TagAuthorization]:
+    """Collapse (RFIDCard, Driver, DriversGroup) rows into one answer per id tag"""
+    rows_by_tag: Dict[str, list] = {}
+    for row in rows:
+        rows_by_tag.setdefault(row[0].RFIDCardId, []).append(row)
+    return {id_tag: choose_authorization(tag_rows) for id_tag, tag_rows in rows_by_tag.items()}
+
+
+class AuthorizationCache:
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        ttl_seconds: float = AUTH_CACHE_TTL_SECONDS,
+        negative_ttl_seconds: float = AUTH_CACHE_NEGATIVE_TTL_SECONDS,
+        max_entries: int = AUTH_CACHE_MAX_ENTRIES
+    ):
+        self.session_factory = session_factory
+        self.ttl = ttl_seconds
+        self.negative_ttl = negative_ttl_seconds
+        self.max_entries = max_entries
+
+        # id tag -> (answer, monotonic deadline), oldest use first
+        self._entries: "OrderedDict[str, Tuple[TagAuthorization, float]]" = OrderedDict()
+        # (company, driver) -> id tags cached for that driver
+        self._driver_tags: Dict[Tuple[str, str], Set[str]] = {}
+        # drivers group -> id tags cached for drivers of that group
+        self._group_tags: Dict[str, Set[str]] = {}
+        self._loading: Dict[str, asyncio.Future] = {}
+        self._warming = False
+
+        # Advanced by every invalidation. Loads remember the epoch they started
+        # at and store only if neither their tag (_tag_epochs) nor a driver,
+        # group or full invalidation (_scope_epoch) happened since.
+        self._epoch = 0
+        self._scope_epoch = 0
+        self._tag_epochs: Dict[str, int] = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, id_tag: str) -> Optional[TagAuthorization]:
+        """Return the cached answer for a tag, or None on a miss"""
+        cached = self._entries.get(id_tag)
+        if cached is None:
+            return None
+        authorization, deadline = cached
+        if deadline <= time.monotonic():
+            self._remove(id_tag)
+            return None
+        self._entries.move_to_end(id_tag)
+        return authorization.at(datetime.now())
+
+    async def authorize(self, id_tag: str) -> TagAuthorization:
+        authorization = self.get(id_tag)
+        if authorization is not None:
+            self.hits += 1
+            return authorization
+
+        self.misses += 1
+        # Share one query between concurrent misses for the same tag
+        pending = self._loading.get(id_tag)
+        if pending is not None:
+            return (await asyncio.shield(pending)).at(datetime.now())
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[id_tag] = future
+        try:
+            authorization = await self._load(id_tag)
+            future.set_result(authorization)
+            return authorization
+        except Exception as e:
+            future.set_exception(e)
+            # Retrieve it so waiter-less failures are not reported as unhandled
+            future.exception()
+            raise
+        finally:
+            del self._loading[id_tag]
+            self._forget_epochs()
+
+    async def _load(self, id_tag: str) -> TagAuthorization:
+        started = self._epoch
+        async with self.session_factory() as db:
+            rows = await RFIDCardRepository.get_card_authorizations(db, id_tag)
+
+        if not rows:
+            self._store_current(id_tag, UNKNOWN_TAG, started)
+            return UNKNOWN_TAG
+
+        # The same tag may be registered with more than one company
+        authorization = choose_authorization(rows)
+        self._store_current(id_tag, authorization, started)
+        return authorization.at(datetime.now())
+
+    def _store_current(self, id_tag: str, authorization: TagAuthorization, started: int):
+        """Store an answer read at epoch started unless the tag was invalidated since"""
+        if self._scope_epoch > started or self._tag_epochs.get(id_tag, 0) > started:
+            logger.debug(f"Not caching id tag {id_tag}: invalidated while it was loading")
+            return
+        self._store(id_tag, authorization)
+
+    def _forget_epochs(self):
+        # Tag epochs only matter to loads still in flight
+        if not self._loading and not self._warming:
+            self._tag_epochs.clear()
+
+    def _store(self, id_tag: str, authorization: TagAuthorization):
+        self._remove(id_tag)
+        ttl = self.ttl if authorization.driver_id is not None else self.negative_ttl
+        self._entries[id_tag] = (authorization, time.monotonic() + ttl)
+        if authorization.driver_id is not None:
+            self._driver_tags.setdefault(
+                (authorization.company_id, authorization.driver_id), set()
+            ).add(id_tag)
+        if authorization.group_id is not None:
+            self._group_tags.setdefault(authorization.group_id, set()).add(id_tag)
+
+        while len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+
+    def _remove(self, id_tag: str):
+        cached = self._entries.pop(id_tag, None)
+        if cached is None:
+            return
+        authorization = cached[0]
+        _discard(self._driver_tags, (authorization.company_id, authorization.driver_id), id_tag)
+        _discard(self._group_tags, authorization.group_id, id_tag)
+
+    def invalidate(self, id_tag: str):
+        """Forget a tag after its RFID card was created, changed or deleted"""
+        self._epoch += 1
+        if self._loading or self._warming:
+            self._tag_epochs[id_tag] = self._epoch
+        self._remove(id_tag)
+
+    def invalidate_driver(self, company_id: str, driver_id: str):
+        """Forget every tag of a driver after the driver was changed or deleted"""
+        self._invalidate_scope(self._driver_tags.get((company_id, driver_id), ()))
+
+    def invalidate_group(self, group_id: str):
+        """Forget every tag of a group's drivers after the group was changed or deleted"""
+        self._invalidate_scope(self._group_tags.get(group_id, ()))
+
+    def _invalidate_scope(self, id_tags):
+        # Loads in flight do not know their driver or group yet, so none may store
+        self._epoch += 1
+        self._scope_epoch = self._epoch
+        for id_tag in list(id_tags):
+            self._remove(id_tag)
+
+    def clear(self):
+        self._invalidate_scope(())
+        self._entries.clear()
+        self._driver_tags.clear()
+        self._group_tags.clear()
+
+    async def warm(self):
+        """Preload up to max_entries cards so the first logins of the day hit memory"""
+        started = self._epoch
+        self._warming = True
+        try:
+            async with self.session_factory() as db:
+                rows = await RFIDCardRepository.get_card_authorizations(db, limit=self.max_entries)
+
+            answers = group_by_id_tag(rows)
+            for id_tag, authorization in answers.items():
+                # An answer cached since the query started is newer than ours
+                if id_tag not in self._entries:
+                    self._store_current(id_tag, authorization, started)
+        finally:
+            self._warming = False
+            self._forget_epochs()
+        logger.info(f"Authorization cache warmed with {len(answers)} id tags")
+
+
+def _discard(index: Dict, key, id_tag: str):
+    tags = index.get(key)
+    if tags is not None:
+        tags.discard(id_tag)
+        if not tags:
+            del index[key]
+
+
+authorization_cache = AuthorizationCache()
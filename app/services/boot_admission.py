@@ -0,0 +1,102 @@
+"""
+Admission control for BootNotifications.
+
+After a power cut or a rolling restart thousands of chargers reconnect and
+boot at once, each registration a write. Boots are admitted through a token
+bucket refilled at BOOT_ADMISSION_RATE per second and holding up to
+BOOT_ADMISSION_BURST tokens. A charger that finds the bucket empty is
+answered Pending with a retry interval, after which OCPP 1.6 has it send
+BootNotification again. Intervals are drawn at random between
+BOOT_PENDING_MIN_INTERVAL and the time the bucket needs to admit every
+charger currently waiting (capped at BOOT_PENDING_MAX_INTERVAL), so the
+retries spread out over the backlog instead of coming back as a new storm.
+
+A rate of 0 accepts every boot.
+"""
+import logging
+import os
+import random
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from .metrics import metrics
+
+logger = logging.getLogger("ocpp.boot_admission")
+
+BOOT_ADMISSION_RATE = float(os.getenv("BOOT_ADMISSION_RATE", "50"))
+BOOT_ADMISSION_BURST = int(os.getenv("BOOT_ADMISSION_BURST", "100"))
+BOOT_PENDING_MIN_INTERVAL = int(os.getenv("BOOT_PENDING_MIN_INTERVAL", "10"))
+BOOT_PENDING_MAX_INTERVAL = int(os.getenv("BOOT_PENDING_MAX_INTERVAL", "300"))
+
+boot_notifications = metrics.counter(
+    "ocpp_boot_notifications_total", "BootNotifications by the registration status answered", ["status"])
+
+
+class BootAdmission:
+    def __init__(
+        self,
+        rate: float = BOOT_ADMISSION_RATE,
+        burst: int = BOOT_ADMISSION_BURST,
+        min_interval: int = BOOT_PENDING_MIN_INTERVAL,
+        max_interval: int = BOOT_PENDING_MAX_INTERVAL,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.clock = clock
+        self._tokens = float(burst)
+        self._refilled = clock()
+        # charger id -> when it was last told to retry, oldest first
+        self._waiting: "OrderedDict[str, float]" = OrderedDict()
+
+        metrics.collector(
+            "ocpp_boot_pending_chargers", "Chargers answered Pending and not admitted yet",
+            lambda: [((), len(self._waiting))]
+        )
+
+    def waiting(self) -> int:
+        return len(self._waiting)
+
+    def admit(self, charger_id: str) -> Optional[int]:
+        """Take a token for the charger's boot; returns None when admitted, else the retry interval in seconds"""
+        if self.rate <= 0:
+            boot_notifications.inc("Accepted")
+            return None
+
+        now = self.clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            self._waiting.pop(charger_id, None)
+            boot_notifications.inc("Accepted")
+            return None
+
+        self._waiting.pop(charger_id, None)
+        self._waiting[charger_id] = now
+        self._expire(now)
+        # Long enough for the bucket to admit everyone waiting ahead
+        backlog = len(self._waiting) / self.rate
+        interval = round(random.uniform(self.min_interval, min(self.max_interval, max(self.min_interval, backlog))))
+        boot_notifications.inc("Pending")
+        logger.debug(f"Boot of {charger_id} pending, retry in {interval}s ({len(self._waiting)} waiting)")
+        return interval
+
+    def forget(self, charger_id: str):
+        """Drop a charger that disconnected while waiting"""
+        self._waiting.pop(charger_id, None)
+
+    def _expire(self, now: float):
+        # A charger that did not retry within twice the longest interval is not coming back soon
+        cutoff = now - 2 * self.max_interval
+        while self._waiting:
+            charger_id, since = next(iter(self._waiting.items()))
+            if since >= cutoff:
+                break
+            del self._waiting[charger_id]
+
+
+boot_admission = BootAdmission()
@@ -0,0 +1,140 @@
+"""
+Fleet-wide fan-out of Central System -> Charge Point commands.
+
+A bulk command targets the chargers picked by a selector: an explicit id
+list, the chargers of a company or site, or every connected charger (the
+filters intersect when combined). Each charger gets the same OCPP call
+through the command bus, at most `concurrency` at a time and each bounded by
+`timeout` seconds. Results are yielded as they complete, so the API streams
+them without waiting for the slowest charger. Chargers that are not
+connected are reported without a call being attempted.
+"""
+import asyncio
+import inspect
+import logging
+import os
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from ..database.database import SessionLocal
+from ..database.repositories.repositories import ChargerRepository
+from ..ws.command_bus import ChargePointNotConnected, command_bus, dump_response
+from .ChargePoint16 import ChargePoint16
+from .metrics import metrics
+
+logger = logging.getLogger("ocpp.bulk")
+
+BULK_DEFAULT_CONCURRENCY = int(os.getenv("BULK_DEFAULT_CONCURRENCY", "50"))
+BULK_MAX_CONCURRENCY = int(os.getenv("BULK_MAX_CONCURRENCY", "500"))
+BULK_DEFAULT_TIMEOUT_SECONDS = float(os.getenv("BULK_DEFAULT_TIMEOUT_SECONDS", "30"))
+
+# reset, change_configuration, ... -> the ChargePoint16 method sending it
+COMMANDS = {
+    name[:-len("_req")]: name for name in dir(ChargePoint16) if name.endswith("_req")
+}
+
+bulk_results = metrics.counter(
+    "ocpp_bulk_command_results_total", "Per-charger results of bulk commands", ["command", "status"])
+
+
+class InvalidCommand(ValueError):
+    pass
+
+
+def command_method(command: str, params: Dict[str, Any]) -> str:
+    """Return the ChargePoint16 method for a command, checking its arguments once for the whole fleet"""
+    method = COMMANDS.get(command)
+    if method is None:
+        raise InvalidCommand(f"Unknown command {command}, expected one of {sorted(COMMANDS)}")
+    try:
+        inspect.signature(getattr(ChargePoint16, method)).bind(None, **params)
+    except TypeError as e:
+        raise InvalidCommand(f"Invalid params for {command}: {e}")
+    return method
+
+
+async def resolve_targets(
+    connected: Iterable[str],
+    company_id: Optional[str] = None,
+    site_id: Optional[str] = None,
+    charge_point_ids: Optional[List[str]] = None,
+    all_connected: bool = False,
+    session_factory=SessionLocal
+) -> List[str]:
+    """Charger ids picked by the selector, in a stable order"""
+    if site_id and not company_id:
+        raise InvalidCommand("site_id requires company_id")
+    if not (company_id or charge_point_ids or all_connected):
+        raise InvalidCommand("Select chargers with company_id, charge_point_ids or all_connected")
+
+    targets: Optional[List[str]] = list(dict.fromkeys(charge_point_ids)) if charge_point_ids else None
+    if company_id:
+        async with session_factory() as db:
+            owned = await ChargerRepository.get_charger_ids(db, company_id, site_id)
+        if targets is None:
+            targets = owned
+        else:
+            owned = set(owned)
+            targets = [cp for cp in targets if cp in owned]
+    if all_connected:
+        connected = set(connected)
+        targets = sorted(connected) if targets is None else [cp for cp in targets if cp in connected]
+    return targets
+
+
+async def fan_out(
+    command: str,
+    targets: List[str],
+    params: Dict[str, Any],
+    connected: Iterable[str],
+    concurrency: Optional[int] = None,
+    timeout: Optional[float] = None,
+    call: Callable[..., Awaitable[Any]] = command_bus.call
+) -> AsyncIterator[Dict[str, Any]]:
+    """Send the command to every target and yield one result per charger as they complete"""
+    method = command_method(command, params)
+    concurrency = min(concurrency or BULK_DEFAULT_CONCURRENCY, BULK_MAX_CONCURRENCY)
+    timeout = timeout or BULK_DEFAULT_TIMEOUT_SECONDS
+    connected = set(connected)
+
+    async def send(charge_point_id: str) -> Dict[str, Any]:
+        started = time.perf_counter()
+        result: Dict[str, Any] = {"charge_point_id": charge_point_id}
+        try:
+            if charge_point_id not in connected:
+                raise ChargePointNotConnected(charge_point_id)
+            response = await asyncio.wait_for(call(charge_point_id, method, **params), timeout)
+            if response is None:
+                result["status"] = "call_error"
+            else:
+                result["status"] = "ok"
+                result["result"] = dump_response(response)["payload"]
+        except ChargePointNotConnected:
+            result["status"] = "not_connected"
+        except asyncio.TimeoutError:
+            result["status"] = "timeout"
+        except Exception as e:
+            result["status"] = "error"
+            result["error"] = str(e)
+        result["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        bulk_results.inc(command, result["status"])
+        return result
+
+    results: asyncio.Queue = asyncio.Queue()
+    remaining = iter(targets)
+
+    async def worker():
+        # Workers share the iterator, so at most `concurrency` calls are in flight
+        for charge_point_id in remaining:
+            await results.put(await send(charge_point_id))
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(concurrency, len(targets)))]
+    logger.info(f"Bulk {command} to {len(targets)} chargers | concurrency: {concurrency} | timeout: {timeout}s")
+    try:
+        for _ in range(len(targets)):
+            yield await results.get()
+    finally:
+        # Also reached when the client goes away mid-stream
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
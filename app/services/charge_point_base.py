@@ -0,0 +1,172 @@
+"""
+OCPP 1.6 ChargePoint with a single-parse message pipeline.
+
+The ocpp library's ChargePoint logs every frame in full and serializes each
+message with json.dumps. This base class decodes every inbound frame exactly
+once in route_message (which also takes frames that are already decoded),
+hands the decoded payload through validation to the handlers, and serializes
+every outbound message once with app.adapters.ocpp_json, using orjson when it
+is installed. Payloads are checked by app.services.schema_validation in the
+charger's validation_mode instead of the library's validate_payload. Frame
+logging is left to the adapter's protocol trace.
+"""
+import asyncio
+import inspect
+import time
+from typing import Dict
+
+from ocpp.charge_point import (
+    _raise_key_error, camel_to_snake_case, remove_nones, serialize_as_dict, snake_to_camel_case
+)
+from ocpp.exceptions import OCPPError
+from ocpp.messages import Call, MessageType
+from ocpp.v16 import ChargePoint as cp
+
+from app.adapters.ocpp_json import pack, unpack
+from app.services import metrics
+from app.services.schema_validation import schema_validation
+from app.services.task_supervisor import task_supervisor
+from app.services.watchdog import watchdog
+
+
+async def _wait_for(awaitable):
+    return await awaitable
+
+
+class ChargePointBase(cp):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Handler -> whether it takes call_unique_id, inspected once per action
+        self._takes_unique_id: Dict[object, bool] = {}
+        # full, sampled or off, set from the charger's row when it connects
+        self.validation_mode = schema_validation.default_mode
+
+    async def start(self):
+        while True:
+            await self.route_message(await self._connection.recv())
+
+    def _action_label(self, action) -> str:
+        # Actions are sent by the charger, only known ones become metric labels
+        return action if action in self.route_map else "unknown"
+
+    async def route_message(self, raw_msg):
+        """Route a raw or already decoded frame received from the charge point"""
+        received = time.perf_counter()
+        try:
+            msg = unpack(raw_msg)
+        except OCPPError as e:
+            self.logger.exception(
+                "Unable to parse message: '%s', it doesn't seem to be valid OCPP: %s", raw_msg, e
+            )
+            return
+
+        if msg.message_type_id == MessageType.Call:
+            action = self._action_label(msg.action)
+            metrics.messages_received.inc(action)
+            try:
+                await self._handle_call(msg)
+            except OCPPError as error:
+                self.logger.exception("Error while handling request '%s'", msg)
+                metrics.message_errors.inc(action, error.code)
+                await self._send(pack(msg.create_call_error(error)))
+            metrics.message_seconds.observe(time.perf_counter() - received, action)
+
+        elif msg.message_type_id in (MessageType.CallResult, MessageType.CallError):
+            self._response_queue.put_nowait(msg)
+
+    def _call_handler(self, handler, payload, unique_id):
+        takes_unique_id = self._takes_unique_id.get(handler)
+        if takes_unique_id is None:
+            takes_unique_id = "call_unique_id" in inspect.signature(handler).parameters
+            self._takes_unique_id[handler] = takes_unique_id
+        if takes_unique_id:
+            return handler(**payload, call_unique_id=unique_id)
+        return handler(**payload)
+
+    async def _handle_call(self, msg):
+        """Run the on/after hooks for a Call, as ChargePoint._handle_call does"""
+        try:
+            handlers = self.route_map[msg.action]
+        except KeyError:
+            _raise_key_error(msg.action, self._ocpp_version)
+            return
+
+        skip_validation = handlers.get("_skip_schema_validation", False)
+        if not skip_validation:
+            schema_validation.validate(msg, self.validation_mode)
+
+        snake_case_payload = camel_to_snake_case(msg.payload)
+
+        try:
+            handler = handlers["_on_action"]
+        except KeyError:
+            _raise_key_error(msg.action, self._ocpp_version)
+        try:
+            with metrics.handler_seconds.time(msg.action), watchdog.track("handler", msg.action, self.id):
+                response = self._call_handler(handler, snake_case_payload, msg.unique_id)
+                if inspect.isawaitable(response):
+                    response = await response
+        except Exception as e:
+            self.logger.exception("Error while handling request '%s'", msg)
+            error = msg.create_call_error(e)
+            metrics.message_errors.inc(msg.action, error.error_code)
+            await self._send(pack(error))
+            return
+
+        response_payload = remove_nones(serialize_as_dict(response))
+        response = msg.create_call_result(snake_to_camel_case(response_payload))
+
+        if not skip_validation:
+            schema_validation.validate(response, self.validation_mode)
+
+        await self._send(pack(response))
+
+        after_handler = handlers.get("_after_action")
+        if after_handler is not None:
+            response = self._call_handler(after_handler, snake_case_payload, msg.unique_id)
+            # Run as a task so a call made from the after hook doesn't block routing
+            if inspect.isawaitable(response):
+                task_supervisor.spawn(self.id, f"after_{msg.action}", _wait_for, response)
+        return response
+
+    async def call(self, payload, suppress=True, unique_id=None, skip_schema_validation=False):
+        """Send a Call to the charge point and return its call_result, as ChargePoint.call does"""
+        call = Call(
+            unique_id=unique_id if unique_id is not None else str(self._unique_id_generator()),
+            action=payload.__class__.__name__,
+            payload=remove_nones(snake_to_camel_case(serialize_as_dict(payload)))
+        )
+
+        if not skip_schema_validation:
+            schema_validation.validate(call, self.validation_mode)
+
+        frame = pack(call)
+        async with self._call_lock:
+            sent = time.perf_counter()
+            metrics.outgoing_calls_in_flight.inc()
+            try:
+                await self._send(frame)
+                response = await self._get_specific_response(call.unique_id, self._response_timeout)
+            except asyncio.TimeoutError:
+                metrics.outgoing_calls.inc(call.action, "timeout")
+                raise asyncio.TimeoutError(f"Waited {self._response_timeout}s for response on {frame}.")
+            finally:
+                metrics.outgoing_calls_in_flight.dec()
+        metrics.outgoing_call_seconds.observe(time.perf_counter() - sent, call.action)
+
+        if response.message_type_id == MessageType.CallError:
+            metrics.outgoing_calls.inc(call.action, "error")
+            self.logger.warning("Received a CALLError: %s'", response)
+            if suppress:
+                return
+            raise response.to_exception()
+        metrics.outgoing_calls.inc(call.action, "result")
+        if not skip_schema_validation:
+            response.action = call.action
+            schema_validation.validate(response, self.validation_mode)
+
+        cls = getattr(self._call_result, payload.__class__.__name__)
+        return cls(**camel_to_snake_case(response.payload))
+
+    async def _send(self, message: str):
+        await self._connection.send(message)
@@ -0,0 +1,184 @@
+"""
+In-memory directory of the chargers allowed to connect, keyed by OCPP identity.
+
+A charge point only identifies itself by the id in its websocket URL, while
+chargers are stored under (company, site, charger). The directory maps the
+identity to its tenant and to the attributes needed on every connection
+(enabled, access type, schema validation mode), so handshakes and OCPP
+messages resolve them with a dict lookup instead of a query.
+
+It is loaded at startup and updated by the charger CRUD routes of this
+worker; a full reload every CHARGER_DIRECTORY_REFRESH_SECONDS picks up the
+changes made through other workers. A reload keeps the local changes made
+less than one refresh interval before its query started, so it neither
+reverts a change made while it was reading nor forgets a charger whose
+BootNotification registration is still waiting in the write-behind buffer.
+Identities not in the directory, and
+disabled chargers, are refused at the websocket handshake unless
+ALLOW_UNKNOWN_CHARGERS is set, in which case unknown chargers join
+DEFAULT_COMPANY_ID / DEFAULT_SITE_ID and are registered by their
+BootNotification as before.
+"""
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from ..database.database import SessionLocal
+from ..database.repositories.repositories import ChargerRepository
+from .metrics import metrics
+from .ocpp_service import DEFAULT_COMPANY_ID, DEFAULT_SITE_ID
+
+logger = logging.getLogger("ocpp.charger_directory")
+
+ALLOW_UNKNOWN_CHARGERS = os.getenv("ALLOW_UNKNOWN_CHARGERS", "false").lower() in ("1", "true", "yes")
+CHARGER_DIRECTORY_REFRESH_SECONDS = float(os.getenv("CHARGER_DIRECTORY_REFRESH_SECONDS", "60"))
+
+rejected_connections = metrics.counter(
+    "ocpp_rejected_connections_total", "Websocket handshakes refused by the charger directory", ["reason"])
+
+
+@dataclass(frozen=True)
+class ChargerEntry:
+    company_id: str
+    site_id: str
+    charger_id: str
+    enabled: bool = True
+    access_type: Optional[str] = None
+    schema_validation: Optional[str] = None
+
+
+def charger_entry(charger) -> ChargerEntry:
+    """Directory entry of a Chargers row"""
+    return ChargerEntry(
+        company_id=charger.ChargerCompanyId,
+        site_id=charger.ChargerSiteId,
+        charger_id=charger.ChargerId,
+        # NULL has always meant enabled
+        enabled=charger.ChargerEnabled is not False,
+        access_type=charger.Charger_Access_Type,
+        schema_validation=charger.ChargerSchemaValidation
+    )
+
+
+class ChargerDirectory:
+    def __init__(self, session_factory=SessionLocal, allow_unknown: bool = ALLOW_UNKNOWN_CHARGERS):
+        self.session_factory = session_factory
+        self.allow_unknown = allow_unknown
+        self._entries: Dict[str, ChargerEntry] = {}
+        # charger id -> (monotonic time, company id, site id, entry or None if
+        # removed) of its latest local change, replayed over reloads
+        self._changes: Dict[str, Tuple[float, str, str, Optional[ChargerEntry]]] = {}
+        self._hold = CHARGER_DIRECTORY_REFRESH_SECONDS
+        self._task: Optional[asyncio.Task] = None
+
+        metrics.collector(
+            "ocpp_charger_directory_entries", "Chargers known to the charger directory",
+            lambda: [((), len(self._entries))]
+        )
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, charger_id: str) -> Optional[ChargerEntry]:
+        return self._entries.get(charger_id)
+
+    def tenant(self, charger_id: str) -> Tuple[str, str]:
+        """(company id, site id) of a charger, the default tenant for unknown ones"""
+        entry = self._entries.get(charger_id)
+        if entry is None:
+            return DEFAULT_COMPANY_ID, DEFAULT_SITE_ID
+        return entry.company_id, entry.site_id
+
+    def admit(self, charger_id: str) -> Optional[ChargerEntry]:
+        """Entry for a charger opening a websocket, None when it must be refused"""
+        entry = self._entries.get(charger_id)
+        if entry is None:
+            if not self.allow_unknown:
+                rejected_connections.inc("unknown")
+                return None
+            return ChargerEntry(DEFAULT_COMPANY_ID, DEFAULT_SITE_ID, charger_id)
+        if not entry.enabled:
+            rejected_connections.inc("disabled")
+            return None
+        return entry
+
+    def put(self, entry: ChargerEntry):
+        existing = self._entries.get(entry.charger_id)
+        if existing is not None and (existing.company_id, existing.site_id) != (entry.company_id, entry.site_id):
+            logger.warning(
+                f"Charger id {entry.charger_id} moves from {existing.company_id}/{existing.site_id} "
+                f"to {entry.company_id}/{entry.site_id}, OCPP identities must be unique"
+            )
+        self._entries[entry.charger_id] = entry
+        self._changes[entry.charger_id] = (time.monotonic(), entry.company_id, entry.site_id, entry)
+
+    def update(self, charger):
+        """Record a created or updated Chargers row"""
+        self.put(charger_entry(charger))
+
+    def remove(self, company_id: str, site_id: str, charger_id: str):
+        entry = self._entries.get(charger_id)
+        if entry is not None and (entry.company_id, entry.site_id) == (company_id, site_id):
+            del self._entries[charger_id]
+            self._changes[charger_id] = (time.monotonic(), company_id, site_id, None)
+
+    async def load(self):
+        """Rebuild the directory from the Chargers table, keeping recent local changes"""
+        started = time.monotonic()
+        async with self.session_factory() as db:
+            chargers = await ChargerRepository.get_directory_rows(db)
+        entries: Dict[str, ChargerEntry] = {}
+        for charger in chargers:
+            entry = charger_entry(charger)
+            if entry.charger_id in entries:
+                kept = entries[entry.charger_id]
+                logger.warning(
+                    f"Charger id {entry.charger_id} exists in {kept.company_id}/{kept.site_id} and "
+                    f"{entry.company_id}/{entry.site_id}, OCPP connections resolve to the first"
+                )
+                continue
+            entries[entry.charger_id] = entry
+
+        # Older changes are in the snapshot, or were overridden by other workers
+        horizon = started - self._hold
+        self._changes = {
+            charger_id: change for charger_id, change in self._changes.items() if change[0] >= horizon
+        }
+        for charger_id, (_, company_id, site_id, entry) in self._changes.items():
+            if entry is not None:
+                entries[charger_id] = entry
+            else:
+                removed = entries.get(charger_id)
+                if removed is not None and (removed.company_id, removed.site_id) == (company_id, site_id):
+                    del entries[charger_id]
+        self._entries = entries
+
+    async def start(self, interval: float = CHARGER_DIRECTORY_REFRESH_SECONDS):
+        self._hold = interval
+        await self.load()
+        logger.info(f"Charger directory loaded | chargers: {len(self._entries)}")
+        if interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run(interval))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.load()
+            except Exception as e:
+                logger.error(f"Charger directory refresh failed: {e}")
+
+
+charger_directory = ChargerDirectory()
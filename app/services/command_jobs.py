@@ -0,0 +1,239 @@
+"""
+Durable CS->CP command jobs.
+
+POST /jobs stores the command in CommandJobs and returns its id at once; the
+command is sent by a background task instead of holding the HTTP request
+open. Jobs for a charger are delivered one at a time, oldest first, through
+the command bus (so from any worker), when the job is submitted and whenever
+the charger (re)connects. A charger that is offline keeps its jobs queued
+until COMMAND_JOB_TTL_SECONDS (or the job's own ttl) has passed, after which
+they expire.
+
+Claiming a job is a conditional UPDATE, so a job is sent once even when two
+workers try to deliver it. A timed-out call is retried up to
+COMMAND_JOB_MAX_ATTEMPTS; the periodic sweep expires old jobs, fails jobs
+left running by a stopped worker and re-triggers delivery for the chargers
+connected to this worker. Results are polled at GET /jobs/{id} or streamed at
+GET /jobs/{id}/events.
+"""
+import asyncio
+import json
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+from ..database.database import SessionLocal
+from ..database.repositories.repositories import CommandJobRepository
+from ..ws.command_bus import ChargePointNotConnected, command_bus, dump_response
+from .bulk_commands import command_method
+from .metrics import metrics
+from .task_supervisor import task_supervisor
+
+logger = logging.getLogger("ocpp.jobs")
+
+COMMAND_JOB_TTL_SECONDS = int(os.getenv("COMMAND_JOB_TTL_SECONDS", "86400"))
+COMMAND_JOB_TIMEOUT_SECONDS = float(os.getenv("COMMAND_JOB_TIMEOUT_SECONDS", "35"))
+COMMAND_JOB_MAX_ATTEMPTS = int(os.getenv("COMMAND_JOB_MAX_ATTEMPTS", "3"))
+COMMAND_JOB_SWEEP_SECONDS = float(os.getenv("COMMAND_JOB_SWEEP_SECONDS", "60"))
+
+TERMINAL_STATUSES = ("succeeded", "failed", "expired", "cancelled")
+
+# How often a stream re-reads a job that may be delivered by another worker
+STREAM_POLL_SECONDS = 1.0
+
+job_results = metrics.counter(
+    "ocpp_command_jobs_total", "Command jobs by final status", ["command", "status"])
+
+
+def _isoformat(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+def job_dict(job) -> Dict[str, Any]:
+    return {
+        "job_id": job.CommandJobId,
+        "charge_point_id": job.CommandJobChargerId,
+        "command": job.CommandJobCommand,
+        "params": json.loads(job.CommandJobParams) if job.CommandJobParams else {},
+        "status": job.CommandJobStatus,
+        "result": json.loads(job.CommandJobResult) if job.CommandJobResult else None,
+        "error": job.CommandJobError,
+        "attempts": job.CommandJobAttempts,
+        "created": _isoformat(job.CommandJobCreated),
+        "expires_at": _isoformat(job.CommandJobExpiresAt),
+        "started": _isoformat(job.CommandJobStarted),
+        "completed": _isoformat(job.CommandJobCompleted),
+    }
+
+
+class CommandJobService:
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        call: Callable[..., Awaitable[Any]] = command_bus.call,
+        timeout: float = COMMAND_JOB_TIMEOUT_SECONDS,
+        max_attempts: int = COMMAND_JOB_MAX_ATTEMPTS
+    ):
+        self.session_factory = session_factory
+        self.call = call
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        # job id -> event set on its next status change, for streams on this worker
+        self._changes: Dict[str, asyncio.Event] = {}
+        self._sweeper: Optional[asyncio.Task] = None
+
+    async def submit(
+        self, charge_point_id: str, command: str, params: Dict[str, Any], ttl_seconds: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """Store a job and start delivering it; raises InvalidCommand for unknown commands or params"""
+        command_method(command, params)
+        now = datetime.now()
+        async with self.session_factory() as db:
+            job = await CommandJobRepository.create_job(db, {
+                "CommandJobId": str(uuid.uuid4()),
+                "CommandJobChargerId": charge_point_id,
+                "CommandJobCommand": command,
+                "CommandJobParams": json.dumps(params),
+                "CommandJobStatus": "queued",
+                "CommandJobAttempts": 0,
+                "CommandJobCreated": now,
+                "CommandJobExpiresAt": now + timedelta(seconds=ttl_seconds or COMMAND_JOB_TTL_SECONDS),
+            })
+        logger.info(f"Queued job {job.CommandJobId}: {command} for {charge_point_id}")
+        self.deliver(charge_point_id)
+        return job_dict(job)
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        async with self.session_factory() as db:
+            job = await CommandJobRepository.get_job(db, job_id)
+        return job_dict(job) if job is not None else None
+
+    async def list_jobs(self, charge_point_id: Optional[str] = None, status: Optional[str] = None,
+                        skip: int = 0, limit: int = 100):
+        async with self.session_factory() as db:
+            jobs = await CommandJobRepository.get_jobs(db, charge_point_id, status, skip, limit)
+        return [job_dict(job) for job in jobs]
+
+    async def cancel(self, job_id: str) -> bool:
+        """Cancel a job that has not been sent yet"""
+        async with self.session_factory() as db:
+            cancelled = await CommandJobRepository.set_job_status(
+                db, job_id, "cancelled", "queued", {"CommandJobCompleted": datetime.now()}
+            )
+        if cancelled:
+            self._notify(job_id)
+        return cancelled
+
+    def deliver(self, charge_point_id: str):
+        """Send the charger's queued jobs in the background; one delivery runs per charger"""
+        task_supervisor.spawn(charge_point_id, "command_jobs", self._deliver, charge_point_id, coalesce=True)
+
+    async def _deliver(self, charge_point_id: str):
+        while True:
+            now = datetime.now()
+            async with self.session_factory() as db:
+                job = await CommandJobRepository.get_next_queued(db, charge_point_id, now)
+                if job is None:
+                    return
+                if not await CommandJobRepository.claim_job(db, job.CommandJobId, now):
+                    continue
+            self._notify(job.CommandJobId)
+
+            status, values = await self._send(job)
+            async with self.session_factory() as db:
+                await CommandJobRepository.set_job_status(db, job.CommandJobId, status, "running", values)
+            self._notify(job.CommandJobId)
+            if status == "queued":
+                # Charger gone or not answering, try again on reconnect or the next sweep
+                return
+            job_results.inc(job.CommandJobCommand, status)
+            logger.info(f"Job {job.CommandJobId} {status}: {job.CommandJobCommand} for {charge_point_id}")
+
+    async def _send(self, job):
+        """Run a claimed job and return its new status with the columns to update"""
+        params = json.loads(job.CommandJobParams) if job.CommandJobParams else {}
+        attempts = job.CommandJobAttempts + 1
+        try:
+            method = command_method(job.CommandJobCommand, params)
+            response = await asyncio.wait_for(self.call(job.CommandJobChargerId, method, **params), self.timeout)
+        except ChargePointNotConnected:
+            # Not an attempt, the command never reached the charger
+            return "queued", {"CommandJobAttempts": attempts - 1, "CommandJobStarted": None}
+        except asyncio.TimeoutError:
+            if attempts < self.max_attempts:
+                return "queued", {"CommandJobError": f"Timed out after {self.timeout}s"}
+            return "failed", {"CommandJobError": f"Timed out after {self.timeout}s", "CommandJobCompleted": datetime.now()}
+        except Exception as e:
+            return "failed", {"CommandJobError": str(e), "CommandJobCompleted": datetime.now()}
+
+        if response is None:
+            return "failed", {"CommandJobError": "Charge point replied with a CallError", "CommandJobCompleted": datetime.now()}
+        return "succeeded", {
+            "CommandJobResult": json.dumps(dump_response(response)["payload"]),
+            "CommandJobError": None,
+            "CommandJobCompleted": datetime.now(),
+        }
+
+    def _notify(self, job_id: str):
+        event = self._changes.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    async def stream(self, job_id: str) -> AsyncIterator[Dict[str, Any]]:
+        """Yield the job each time its status changes, until it is finished"""
+        last_status = None
+        while True:
+            event = self._changes.setdefault(job_id, asyncio.Event())
+            job = await self.get(job_id)
+            if job is None:
+                return
+            if job["status"] != last_status:
+                last_status = job["status"]
+                yield job
+            if last_status in TERMINAL_STATUSES:
+                return
+            try:
+                await asyncio.wait_for(event.wait(), STREAM_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    async def sweep(self):
+        """Expire old jobs, fail abandoned ones and retry delivery to chargers connected here"""
+        now = datetime.now()
+        async with self.session_factory() as db:
+            expired = await CommandJobRepository.expire_jobs(db, now)
+            # A running job normally finishes within the call timeout
+            stale = await CommandJobRepository.fail_stale_jobs(db, now - timedelta(seconds=self.timeout * 2), now)
+            queued = await CommandJobRepository.get_queued_charger_ids(db, now)
+        if expired or stale:
+            logger.info(f"Command jobs sweep: {expired} expired, {stale} interrupted")
+        connected = command_bus.connections.get_charge_points()
+        for charge_point_id in queued:
+            if charge_point_id in connected:
+                self.deliver(charge_point_id)
+
+    async def start(self, interval: float = COMMAND_JOB_SWEEP_SECONDS):
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._run(interval))
+
+    async def stop(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+
+    async def _run(self, interval: float):
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Command jobs sweep failed: {e}")
+            await asyncio.sleep(interval)
+
+
+command_jobs = CommandJobService()
@@ -0,0 +1,134 @@
+"""
+Bounded executor for the database writes made on behalf of OCPP messages.
+
+Handlers used to start one fire-and-forget task per write, so a slow or
+unreachable database turned into an unbounded pile of pending tasks. Writes
+are now submitted to a fixed set of workers, DB_EXECUTOR_WORKERS (default:
+one for SQLite, which has a single writer, otherwise the engine's pool size),
+each with a queue of DB_EXECUTOR_QUEUE_SIZE / workers jobs. A charger's jobs
+always go to the same worker, so they run in the order its messages arrived
+(a StopTransaction never overtakes its StartTransaction).
+
+submit() waits while the worker's queue is full. Handlers await it, so a
+backlog stops the charger's receive loop from reading further frames and the
+pressure is pushed back onto its websocket instead of into memory.
+
+A job failing with an OperationalError (database locked or unreachable) is
+retried DB_EXECUTOR_RETRIES times with jittered backoff on its worker, which
+keeps the charger's jobs in order and the backpressure on while it waits.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, List
+
+from sqlalchemy.exc import OperationalError
+
+from ..database.database import WRITER_CONCURRENCY
+from .metrics import metrics
+from .task_supervisor import retry_delay
+
+logger = logging.getLogger("ocpp.db_executor")
+
+
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS") or WRITER_CONCURRENCY)
+DB_EXECUTOR_QUEUE_SIZE = int(os.getenv("DB_EXECUTOR_QUEUE_SIZE", "1000"))
+DB_EXECUTOR_RETRIES = int(os.getenv("DB_EXECUTOR_RETRIES", "2"))
+
+jobs_total = metrics.counter(
+    "ocpp_db_jobs_total", "Database jobs run for OCPP messages by outcome", ["operation", "outcome"])
+queue_wait_seconds = metrics.histogram(
+    "ocpp_db_queue_wait_seconds", "Time database jobs waited in the executor queue")
+submit_blocked = metrics.counter(
+    "ocpp_db_queue_full_total", "Submissions that had to wait for room in a full executor queue")
+
+
+class DatabaseExecutor:
+    def __init__(
+        self,
+        workers: int = DB_EXECUTOR_WORKERS,
+        queue_size: int = DB_EXECUTOR_QUEUE_SIZE,
+        retries: int = DB_EXECUTOR_RETRIES
+    ):
+        self.workers = max(1, workers)
+        self.queue_size = max(self.workers, queue_size)
+        self.retries = retries
+        self._queues: List[asyncio.Queue] = []
+        self._tasks: List[asyncio.Task] = []
+
+        metrics.collector(
+            "ocpp_db_queue_depth", "Database jobs waiting in the executor queues",
+            lambda: [((), self.pending())]
+        )
+
+    def pending(self) -> int:
+        return sum(queue.qsize() for queue in self._queues)
+
+    async def start(self):
+        if self._tasks:
+            return
+        per_worker = self.queue_size // self.workers
+        self._queues = [asyncio.Queue(maxsize=per_worker) for _ in range(self.workers)]
+        self._tasks = [asyncio.create_task(self._run(queue)) for queue in self._queues]
+        logger.info(f"Database executor started | workers: {self.workers} | queue: {per_worker} per worker")
+
+    async def stop(self, timeout: float = 10.0):
+        """Finish the queued jobs (up to timeout seconds) and stop the workers"""
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self._queues)), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Database executor stopped with {self.pending()} jobs still queued")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queues = []
+
+    async def submit(self, key: str, operation: str, function: Callable[..., Awaitable[Any]], *args: Any):
+        """Queue function(*args) on the worker for key, waiting while that worker's queue is full"""
+        if not self._tasks:
+            # Not started (scripts, tests): run inline
+            await self._execute(key, operation, function, args, time.perf_counter())
+            return
+        queue = self._queues[hash(key) % self.workers]
+        job = (key, operation, function, args, time.perf_counter())
+        if queue.full():
+            submit_blocked.inc()
+        await queue.put(job)
+
+    async def _run(self, queue: asyncio.Queue):
+        while True:
+            key, operation, function, args, queued = await queue.get()
+            try:
+                await self._execute(key, operation, function, args, queued)
+            finally:
+                queue.task_done()
+
+    async def _execute(self, key: str, operation: str, function: Callable[..., Awaitable[Any]], args, queued: float):
+        queue_wait_seconds.observe(time.perf_counter() - queued)
+        for attempt in range(self.retries + 1):
+            try:
+                await function(*args)
+                jobs_total.inc(operation, "ok")
+                return
+            except asyncio.CancelledError:
+                raise
+            except OperationalError as e:
+                if attempt == self.retries:
+                    jobs_total.inc(operation, "failed")
+                    logger.error(f"Database job {operation} for {key} failed: {e}")
+                    return
+                jobs_total.inc(operation, "retried")
+                delay = retry_delay(attempt)
+                logger.warning(f"Database job {operation} for {key} failed ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+            except Exception as e:
+                jobs_total.inc(operation, "failed")
+                logger.error(f"Database job {operation} for {key} failed: {e}", exc_info=True)
+                return
+
+
+db_executor = DatabaseExecutor()
@@ -0,0 +1,230 @@
+"""
+Heartbeat interval assignment.
+
+Every charger used to be given the same 300s interval, so a fleet that
+reconnected at once kept sending its heartbeats in synchronized waves. Each
+charger now gets the base interval plus an offset of up to HEARTBEAT_JITTER
+of it, derived from its id. Chargers with different periods drift apart
+after a reconnect, and a charger keeps the same interval across reconnects
+and workers.
+
+Different periods only separate chargers that booted together after several
+cycles, so their phase is spread too: the BootNotification answer carries a
+first interval shortened by a random fraction of up to HEARTBEAT_PHASE_SPREAD,
+and the charger's first heartbeat, at that random phase, is answered with
+ChangeConfiguration HeartbeatInterval for its own interval.
+
+The base interval is stretched while the server is under pressure, up to
+HEARTBEAT_MAX_STRETCH times:
+- event loop lag above HEARTBEAT_LAG_TARGET_MS
+- a filling database executor queue
+- more heartbeats per second than HEARTBEAT_MAX_RATE for the chargers
+  connected here
+
+The pressure is re-evaluated every HEARTBEAT_RETUNE_SECONDS. Connected
+chargers whose interval is off by more than HEARTBEAT_RETUNE_TOLERANCE
+(including chargers that reconnected without booting, whose interval is
+unknown) are sent ChangeConfiguration HeartbeatInterval, at most
+HEARTBEAT_RETUNE_BATCH per round.
+
+Uvicorn pings every websocket (--ws-ping-interval, 20s by default) and closes
+connections that miss the pong, so dead peers are found without heartbeats.
+While WS_PING_INTERVAL_SECONDS says pings are on, heartbeats only keep the
+charger's clock and last-seen time fresh, and HEARTBEAT_INTERVAL_WITH_PING is
+used as the base. A charger whose interval we do not know is expected to use
+the one we would give it now, which the next retune sets, so the liveness
+timeout derived from it (see app.services.liveness) stays a few times the
+current interval rather than assuming the most stretched one.
+"""
+import asyncio
+import logging
+import os
+import random
+import zlib
+from typing import Any, Dict, Optional
+
+from .db_executor import db_executor
+from .metrics import loop_lag, metrics
+from .task_supervisor import task_supervisor
+
+logger = logging.getLogger("ocpp.heartbeats")
+
+HEARTBEAT_INTERVAL = int(os.getenv("HEARTBEAT_INTERVAL", "300"))
+HEARTBEAT_INTERVAL_WITH_PING = int(os.getenv("HEARTBEAT_INTERVAL_WITH_PING", "1800"))
+# Must match uvicorn's --ws-ping-interval, 0 when pings are disabled
+WS_PING_INTERVAL_SECONDS = float(os.getenv("WS_PING_INTERVAL_SECONDS", "20"))
+HEARTBEAT_JITTER = float(os.getenv("HEARTBEAT_JITTER", "0.2"))
+HEARTBEAT_PHASE_SPREAD = float(os.getenv("HEARTBEAT_PHASE_SPREAD", "0.5"))
+HEARTBEAT_MAX_STRETCH = float(os.getenv("HEARTBEAT_MAX_STRETCH", "4"))
+HEARTBEAT_MAX_RATE = float(os.getenv("HEARTBEAT_MAX_RATE", "100"))
+HEARTBEAT_LAG_TARGET_MS = float(os.getenv("HEARTBEAT_LAG_TARGET_MS", "50"))
+HEARTBEAT_RETUNE_SECONDS = float(os.getenv("HEARTBEAT_RETUNE_SECONDS", "60"))
+HEARTBEAT_RETUNE_TOLERANCE = float(os.getenv("HEARTBEAT_RETUNE_TOLERANCE", "0.25"))
+HEARTBEAT_RETUNE_BATCH = int(os.getenv("HEARTBEAT_RETUNE_BATCH", "500"))
+
+# Seconds a charger has to answer ChangeConfiguration
+RETUNE_CALL_TIMEOUT = 30
+
+interval_changes = metrics.counter(
+    "ocpp_heartbeat_interval_changes_total", "ChangeConfiguration HeartbeatInterval by charger answer", ["status"])
+
+
+class HeartbeatScheduler:
+    def __init__(
+        self,
+        base_interval: Optional[int] = None,
+        jitter: float = HEARTBEAT_JITTER,
+        phase_spread: float = HEARTBEAT_PHASE_SPREAD,
+        max_stretch: float = HEARTBEAT_MAX_STRETCH,
+        max_rate: float = HEARTBEAT_MAX_RATE,
+        lag_target_ms: float = HEARTBEAT_LAG_TARGET_MS,
+        tolerance: float = HEARTBEAT_RETUNE_TOLERANCE,
+        batch: int = HEARTBEAT_RETUNE_BATCH
+    ):
+        if base_interval is None:
+            base_interval = HEARTBEAT_INTERVAL_WITH_PING if WS_PING_INTERVAL_SECONDS > 0 else HEARTBEAT_INTERVAL
+        self.base_interval = base_interval
+        self.jitter = jitter
+        self.phase_spread = min(max(phase_spread, 0.0), 0.9)
+        self.max_stretch = max(1.0, max_stretch)
+        self.max_rate = max_rate
+        self.lag_target = lag_target_ms / 1000
+        self.tolerance = tolerance
+        self.batch = batch
+        self.stretch = 1.0
+        # charger id -> [charge point, interval it was given or None when unknown,
+        #                interval to set at its first heartbeat or None]
+        self._chargers: Dict[str, list] = {}
+        self._task: Optional[asyncio.Task] = None
+
+        metrics.collector(
+            "ocpp_heartbeat_stretch", "Factor applied to the base heartbeat interval for the current load",
+            lambda: [((), self.stretch)]
+        )
+
+    def interval_for(self, charger_id: str) -> int:
+        """Heartbeat interval in seconds for the charger at the current load"""
+        # crc32 rather than hash(), which differs between worker processes
+        offset = zlib.crc32(charger_id.encode()) / 0xFFFFFFFF
+        return round(self.base_interval * self.stretch * (1 + self.jitter * offset))
+
+    def expected_interval(self, charger_id: str) -> int:
+        """Longest time the charger should go without a heartbeat, as far as we know"""
+        entry = self._chargers.get(charger_id)
+        if entry is not None and entry[1] is not None:
+            return max(entry[1], entry[2] or 0)
+        # Not given by us, assume the interval the next retune gives it
+        return round(self.base_interval * self.stretch * (1 + self.jitter))
+
+    def assign(self, charge_point) -> int:
+        """Interval for a BootNotification answer, remembered so later load changes can retune it.
+
+        The answer is the charger's interval shortened by a random part of the
+        phase spread; its first heartbeat then sets the full interval.
+        """
+        interval = self.interval_for(charge_point.id)
+        first = round(interval * (1 - self.phase_spread * random.random()))
+        self._chargers[charge_point.id] = [charge_point, first, interval if first != interval else None]
+        return first
+
+    def track(self, charge_point):
+        """Follow a connected charger; its interval is set by the next retune unless it boots first"""
+        entry = self._chargers.get(charge_point.id)
+        if entry is None or entry[0] is not charge_point:
+            self._chargers[charge_point.id] = [charge_point, None, None]
+
+    def heartbeat(self, charge_point):
+        """Give a charger its own interval at its first heartbeat after booting"""
+        entry = self._chargers.get(charge_point.id)
+        if entry is None or entry[0] is not charge_point or entry[2] is None:
+            return
+        interval, entry[2] = entry[2], None
+        task_supervisor.spawn(
+            charge_point.id, "heartbeat_interval", self._change_interval, charge_point, interval, coalesce=True
+        )
+
+    def forget(self, charger_id: str):
+        self._chargers.pop(charger_id, None)
+
+    def target_stretch(self) -> float:
+        """Stretch the current load calls for, 1 when idle"""
+        pressures = [1.0]
+        if self.max_rate > 0 and self._chargers:
+            pressures.append(len(self._chargers) / (self.base_interval * self.max_rate))
+        if self.lag_target > 0:
+            pressures.append(loop_lag.last_lag / self.lag_target)
+        if db_executor.queue_size:
+            pressures.append(self.max_stretch * db_executor.pending() / db_executor.queue_size)
+        return min(self.max_stretch, max(pressures))
+
+    def retune(self):
+        """Update the stretch and reconfigure the chargers whose interval is too far off"""
+        target = self.target_stretch()
+        # Stretch at once, relax gradually so a short spike does not bounce the fleet back and forth
+        self.stretch = target if target >= self.stretch else max(target, self.stretch * 0.8)
+
+        sent = 0
+        for charger_id, (charge_point, assigned, first_heartbeat) in list(self._chargers.items()):
+            if sent >= self.batch:
+                break
+            if first_heartbeat is not None:
+                # Set at the first heartbeat, keeping the phase spread
+                continue
+            interval = self.interval_for(charger_id)
+            if assigned is not None and abs(interval - assigned) <= assigned * self.tolerance:
+                continue
+            if task_supervisor.spawn(
+                charger_id, "heartbeat_interval", self._change_interval, charge_point, interval, coalesce=True
+            ) is not None:
+                sent += 1
+        if sent:
+            logger.info(f"Retuning heartbeat interval of {sent} chargers | stretch: {self.stretch:.2f}")
+
+    async def _change_interval(self, charge_point, interval: int):
+        response = await asyncio.wait_for(
+            charge_point.change_configuration_req("HeartbeatInterval", str(interval)), RETUNE_CALL_TIMEOUT
+        )
+        status = response.status if response is not None else "CallError"
+        interval_changes.inc(status)
+        entry = self._chargers.get(charge_point.id)
+        if entry is None or entry[0] is not charge_point:
+            return
+        if status == "Accepted":
+            entry[1] = interval
+        else:
+            # Not configurable, stop asking
+            logger.info(f"Charger {charge_point.id} answered {status} to HeartbeatInterval={interval}")
+            del self._chargers[charge_point.id]
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "base_interval": self.base_interval,
+            "stretch": round(self.stretch, 2),
+            "target_stretch": round(self.target_stretch(), 2),
+            "chargers": len(self._chargers),
+            "unknown_interval": sum(1 for _, assigned, _ in self._chargers.values() if assigned is None),
+        }
+
+    async def start(self, interval: float = HEARTBEAT_RETUNE_SECONDS):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(interval))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.retune()
+            except Exception as e:
+                logger.error(f"Heartbeat retune failed: {e}")
+
+
+heartbeat_scheduler = HeartbeatScheduler()
@@ -0,0 +1,195 @@
+"""
+Liveness tracking of charge point connections.
+
+A charger that loses power or network without closing its TCP connection
+used to stay "online" until the socket finally errored, possibly hours
+later. Every inbound frame now stamps the charger's last-seen time (one dict
+write). A charger that stays silent for LIVENESS_TIMEOUT_FACTOR times its
+heartbeat interval (see app.services.heartbeats) is considered gone. Its
+receive loop is cancelled, the websocket is closed, and all chargers found
+in the same sweep are marked offline in a single UPDATE.
+
+Deadlines are kept in a hashed timing wheel with LIVENESS_TICK_SECONDS
+slots. Each watched charger sits in exactly one slot, the one of its
+deadline when it was last scheduled. Frames do not touch the wheel. A sweep
+only visits the slots that came due: a charger in such a slot that was seen
+since is moved to the slot of its new deadline, the others have expired. A
+sweep therefore costs about one entry per charger per timeout period, not
+per tick, and never reads the Chargers table.
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Set
+
+from ..database.database import SessionLocal
+from ..database.repositories.repositories import ChargerRepository
+from .heartbeats import heartbeat_scheduler
+from .metrics import metrics
+
+logger = logging.getLogger("ocpp.liveness")
+
+LIVENESS_TICK_SECONDS = float(os.getenv("LIVENESS_TICK_SECONDS", "5"))
+LIVENESS_TIMEOUT_FACTOR = float(os.getenv("LIVENESS_TIMEOUT_FACTOR", "2.5"))
+
+expired_total = metrics.counter(
+    "ocpp_liveness_expired_total", "Connections closed because the charger went silent")
+
+
+class _Watch:
+    __slots__ = ("charge_point", "close", "last_seen", "slot", "expired")
+
+    def __init__(self, charge_point, close: Callable[[], None], last_seen: float):
+        self.charge_point = charge_point
+        self.close = close
+        self.last_seen = last_seen
+        # Wheel slot holding this watch; entries of an earlier connection in other slots are stale
+        self.slot = 0
+        self.expired = False
+
+
+class LivenessTracker:
+    def __init__(
+        self,
+        tick: float = LIVENESS_TICK_SECONDS,
+        timeout_factor: float = LIVENESS_TIMEOUT_FACTOR,
+        interval_of: Callable[[str], float] = heartbeat_scheduler.expected_interval,
+        session_factory=SessionLocal,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.tick = tick
+        self.timeout_factor = timeout_factor
+        self.interval_of = interval_of
+        self.session_factory = session_factory
+        self.clock = clock
+        self._watches: Dict[str, _Watch] = {}
+        # slot number (deadline / tick, rounded up) -> chargers due in it
+        self._wheel: Dict[int, Set[str]] = {}
+        self._next_slot = self._slot(clock())
+        # Chargers closed for silence still to be marked offline, kept until the update succeeds
+        self._offline: Dict[str, tuple] = {}
+        self._task: Optional[asyncio.Task] = None
+
+        metrics.collector(
+            "ocpp_liveness_watched", "Connections watched for liveness",
+            lambda: [((), len(self._watches))]
+        )
+
+    def _slot(self, deadline: float) -> int:
+        return math.ceil(deadline / self.tick)
+
+    def _schedule(self, watch: _Watch, deadline: float):
+        # A slot already swept would never be visited again
+        watch.slot = max(self._slot(deadline), self._next_slot)
+        self._wheel.setdefault(watch.slot, set()).add(watch.charge_point.id)
+
+    def timeout_for(self, charger_id: str) -> float:
+        return self.interval_of(charger_id) * self.timeout_factor
+
+    def watch(self, charge_point, close: Callable[[], None]):
+        """Start watching a connection; close() is called if the charger goes silent.
+
+        An earlier connection of the same charger still watched is half-open
+        (the charger would not reconnect otherwise) and is closed now.
+        """
+        now = self.clock()
+        previous = self._watches.get(charge_point.id)
+        watch = self._watches[charge_point.id] = _Watch(charge_point, close, now)
+        if previous is not None and previous.charge_point is not charge_point and not previous.expired:
+            logger.info(f"Charger {charge_point.id} reconnected, closing its previous connection")
+            previous.close()
+        self._schedule(watch, now + self.timeout_for(charge_point.id))
+
+    def unwatch(self, charge_point) -> bool:
+        """Stop watching a connection that ended; returns whether it was closed for silence"""
+        watch = self._watches.get(charge_point.id)
+        if watch is None or watch.charge_point is not charge_point:
+            # Already replaced by a newer connection of the same charger
+            return False
+        del self._watches[charge_point.id]
+        # Its wheel entry is dropped when its slot comes due
+        return watch.expired
+
+    def seen(self, charger_id: str):
+        """Record an inbound frame"""
+        watch = self._watches.get(charger_id)
+        if watch is not None:
+            watch.last_seen = self.clock()
+
+    def expire_due(self) -> List[_Watch]:
+        """Visit the slots that came due and return the watches whose charger went silent"""
+        now = self.clock()
+        current = self._slot(now)
+        expired = []
+        while self._next_slot <= current:
+            slot = self._next_slot
+            due = self._wheel.pop(slot, ())
+            self._next_slot += 1
+            for charger_id in due:
+                watch = self._watches.get(charger_id)
+                if watch is None or watch.slot != slot or watch.expired:
+                    continue
+                deadline = watch.last_seen + self.timeout_for(charger_id)
+                if deadline > now:
+                    self._schedule(watch, deadline)
+                else:
+                    watch.expired = True
+                    expired.append(watch)
+        return expired
+
+    async def sweep(self) -> int:
+        """Close the connections of silent chargers and mark them offline"""
+        expired = self.expire_due()
+        if expired:
+            expired_total.inc(len(expired))
+            logger.warning(
+                f"Closing {len(expired)} silent connections: {[w.charge_point.id for w in expired][:20]}"
+            )
+        for watch in expired:
+            watch.close()
+            cp = watch.charge_point
+            self._offline[cp.id] = (cp.company_id, cp.site_id, cp.id)
+        # A charger that reconnected since a failed update is online again
+        offline = {
+            charger_id: key for charger_id, key in self._offline.items()
+            if charger_id not in self._watches or self._watches[charger_id].expired
+        }
+        self._offline = {}
+        if offline:
+            try:
+                async with self.session_factory() as db:
+                    async with db.begin():
+                        await ChargerRepository.bulk_set_offline(db, list(offline.values()), datetime.now())
+            except Exception:
+                # Retried by the next sweep
+                for charger_id, key in offline.items():
+                    self._offline.setdefault(charger_id, key)
+                raise
+        return len(expired)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Liveness sweep failed: {e}", exc_info=True)
+
+
+liveness = LivenessTracker()
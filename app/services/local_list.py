@@ -0,0 +1,316 @@
+"""
+OCPP 1.6 local authorization lists.
+
+Each company has one published list in LocalListEntries, derived from its RFID
+cards with the same rules as the authorization cache. Publishing compares the
+cards with the published entries and stamps every changed or removed tag with
+a new list version, so the update for a charger is simply the entries newer
+than the version it last acknowledged (Chargers.ChargerLocalListVersion).
+Chargers that have no list yet, or report a version mismatch, get a full list.
+
+Publishing scans the company's cards, so it is not done per charger sync. The
+RFID card and driver routes request a publish of their company, and every
+company is republished every LOCAL_LIST_PUBLISH_SECONDS (which also picks up
+changes made through other workers and expiry dates passing). Versions are
+claimed from a counter row locked until the publish commits, so two workers
+never publish the same version.
+
+Lists are per company rather than per charger: cards belong to a company and
+are accepted on all of its chargers, so every charger of a company would get
+the same list, and one set of versions serves them all. Before sending, the
+charger's SendLocalListMaxLength and LocalAuthListMaxLength are read with
+GetConfiguration; a full list longer than the first is sent as a Full and
+Differential requests under the versions just below the published one, and
+one longer than the second is not sent.
+"""
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from ocpp.v16.datatypes import AuthorizationData, IdTagInfo
+from ocpp.v16.enums import AuthorizationStatus, UpdateStatus, UpdateType
+
+from ..database.database import SessionLocal
+from ..database.repositories.repositories import (
+    ChargerRepository, LocalListRepository, RFIDCardRepository
+)
+from .auth_cache import group_by_id_tag
+from .ocpp_service import DEFAULT_COMPANY_ID, DEFAULT_SITE_ID
+
+logger = logging.getLogger("ocpp.local_list")
+
+LOCAL_LIST_SYNC_ON_BOOT = os.getenv("LOCAL_LIST_SYNC_ON_BOOT", "true").lower() == "true"
+LOCAL_LIST_PUBLISH_SECONDS = float(os.getenv("LOCAL_LIST_PUBLISH_SECONDS", "300"))
+
+SEND_MAX_LENGTH_KEY = "SendLocalListMaxLength"
+LIST_MAX_LENGTH_KEY = "LocalAuthListMaxLength"
+
+
+def authorization_data(entry) -> AuthorizationData:
+    """Build the SendLocalList entry for a published tag; removed tags carry no IdTagInfo"""
+    if entry.LocalListEntryStatus is None:
+        return AuthorizationData(id_tag=entry.LocalListEntryIdTag)
+    expiry_date = entry.LocalListEntryExpiryDate
+    return AuthorizationData(
+        id_tag=entry.LocalListEntryIdTag,
+        id_tag_info=IdTagInfo(
+            status=AuthorizationStatus(entry.LocalListEntryStatus),
+            parent_id_tag=entry.LocalListEntryParentIdTag,
+            expiry_date=expiry_date.isoformat() if expiry_date else None
+        )
+    )
+
+
+class LocalListManager:
+    def __init__(self, session_factory=SessionLocal):
+        self.session_factory = session_factory
+        # Avoids waiting on the database lock for publishes of this worker
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # Companies whose publish was requested and not done yet
+        self._requested: Set[str] = set()
+        self._publish_requested = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def publish(self, company_id: str) -> int:
+        """Bring the company's published list in line with its RFID cards and return its version"""
+        lock = self._locks.setdefault(company_id, asyncio.Lock())
+        async with lock:
+            async with self.session_factory() as db:
+                # Claimed first, so the cards are read while other workers' publishes wait
+                version = await LocalListRepository.next_version(db, company_id)
+                rows = await RFIDCardRepository.get_card_authorizations(db, company_id=company_id)
+                current = group_by_id_tag(rows)
+                published = {
+                    entry.LocalListEntryIdTag: entry
+                    for entry in await LocalListRepository.get_entries(db, company_id)
+                }
+
+                changes: Dict[str, Dict[str, Any]] = {}
+                for id_tag, authorization in current.items():
+                    values = {
+                        "LocalListEntryStatus": authorization.status.value,
+                        "LocalListEntryExpiryDate": authorization.expiry_date,
+                        "LocalListEntryParentIdTag": authorization.group_id
+                    }
+                    entry = published.get(id_tag)
+                    if entry is None or any(getattr(entry, key) != value for key, value in values.items()):
+                        changes[id_tag] = values
+                for id_tag, entry in published.items():
+                    if id_tag not in current and entry.LocalListEntryStatus is not None:
+                        changes[id_tag] = {
+                            "LocalListEntryStatus": None,
+                            "LocalListEntryExpiryDate": None,
+                            "LocalListEntryParentIdTag": None
+                        }
+
+                if not changes:
+                    # Releases the counter unchanged
+                    await db.rollback()
+                    return version - 1
+                await LocalListRepository.apply_changes(db, company_id, version, changes)
+                logger.info(f"Published local list version {version} for {company_id} with {len(changes)} changes")
+                return version
+
+    def request_publish(self, company_id: str):
+        """Publish the company's list soon, after its cards or drivers changed"""
+        self._requested.add(company_id)
+        self._publish_requested.set()
+
+    async def publish_all(self):
+        async with self.session_factory() as db:
+            company_ids = await LocalListRepository.get_company_ids(db)
+        for company_id in company_ids:
+            try:
+                await self.publish(company_id)
+            except Exception as e:
+                logger.error(f"Publishing the local list of {company_id} failed: {e}")
+
+    async def start(self, interval: float = LOCAL_LIST_PUBLISH_SECONDS):
+        if self._task is None:
+            self._publish_requested = asyncio.Event()
+            if self._requested:
+                self._publish_requested.set()
+            self._task = asyncio.create_task(self._run(interval))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, interval: float):
+        loop = asyncio.get_running_loop()
+        # Everything is published once at startup
+        next_full = loop.time()
+        while True:
+            try:
+                await asyncio.wait_for(self._publish_requested.wait(), timeout=max(0, next_full - loop.time()))
+            except asyncio.TimeoutError:
+                pass
+            self._publish_requested.clear()
+            try:
+                if loop.time() >= next_full:
+                    self._requested.clear()
+                    next_full = loop.time() + interval
+                    await self.publish_all()
+                while self._requested:
+                    company_id = self._requested.pop()
+                    try:
+                        await self.publish(company_id)
+                    except Exception as e:
+                        logger.error(f"Publishing the local list of {company_id} failed: {e}")
+            except Exception as e:
+                logger.error(f"Local list publish failed: {e}")
+
+    async def build_update(self, company_id: str, charger_version: Optional[int]):
+        """Return (version, update type, entries) taking a charger from charger_version to the published list"""
+        async with self.session_factory() as db:
+            version = await LocalListRepository.get_version(db, company_id)
+            if charger_version and 0 < charger_version <= version:
+                entries = await LocalListRepository.get_entries(db, company_id, since_version=charger_version)
+                return version, UpdateType.differential, [authorization_data(entry) for entry in entries]
+
+            entries = await LocalListRepository.get_entries(db, company_id)
+        return version, UpdateType.full, [
+            authorization_data(entry) for entry in entries if entry.LocalListEntryStatus is not None
+        ]
+
+    async def sync_charger(
+        self,
+        charger_id: str,
+        send_local_list: Callable[..., Awaitable[Any]],
+        company_id: str = DEFAULT_COMPANY_ID,
+        site_id: str = DEFAULT_SITE_ID,
+        full: bool = False,
+        get_configuration: Optional[Callable[..., Awaitable[Any]]] = None
+    ) -> Dict[str, Any]:
+        """Push the current list to a connected charger, differentially when possible.
+
+        send_local_list sends the SendLocalList request and get_configuration the
+        GetConfiguration request used to read the charger's list limits, either
+        the charger's own *_req methods or command bus calls to the worker holding it.
+        """
+        async with self.session_factory() as db:
+            charger = await ChargerRepository.get_charger(db, company_id, site_id, charger_id)
+        charger_version = None if full or charger is None else charger.ChargerLocalListVersion
+
+        version, update_type, entries = await self.build_update(company_id, charger_version)
+        if version == 0:
+            # Nothing published yet (first start), the periodic publish will bring a list
+            return {"list_version": 0, "update_type": None, "entries": 0, "status": "NotPublished"}
+        if update_type == UpdateType.differential and not entries:
+            return {"list_version": version, "update_type": None, "entries": 0, "status": "UpToDate"}
+
+        send_max_length, list_max_length = await self._list_limits(charger_id, get_configuration)
+        if update_type == UpdateType.differential and send_max_length and len(entries) > send_max_length:
+            # Differential versions are the published ones, so only a full list can be split
+            version, update_type, entries = await self.build_update(company_id, None)
+
+        status = await self._send_update(
+            charger_id, send_local_list, charger, version, update_type, entries, send_max_length, list_max_length
+        )
+        if status == UpdateStatus.version_mismatch and update_type == UpdateType.differential:
+            logger.info(f"Local list version mismatch on {charger_id}, sending full list")
+            version, update_type, entries = await self.build_update(company_id, None)
+            status = await self._send_update(
+                charger_id, send_local_list, charger, version, update_type, entries, send_max_length, list_max_length
+            )
+
+        if status == UpdateStatus.accepted and charger is not None:
+            async with self.session_factory() as db:
+                await ChargerRepository.update_charger(
+                    db, company_id, site_id, charger_id, {"ChargerLocalListVersion": version}
+                )
+
+        logger.info(
+            f"SendLocalList {update_type.value} v{version} to {charger_id} "
+            f"with {len(entries)} entries: {status}"
+        )
+        return {
+            "list_version": version,
+            "update_type": update_type.value,
+            "entries": len(entries),
+            "status": status
+        }
+
+    async def _list_limits(
+        self, charger_id: str, get_configuration: Optional[Callable[..., Awaitable[Any]]]
+    ) -> Tuple[Optional[int], Optional[int]]:
+        """(SendLocalListMaxLength, LocalAuthListMaxLength) of a charger, None where unknown"""
+        if get_configuration is None:
+            return None, None
+        try:
+            response = await get_configuration(key=[SEND_MAX_LENGTH_KEY, LIST_MAX_LENGTH_KEY])
+        except Exception as e:
+            logger.warning(f"Could not read the local list limits of {charger_id}: {e}")
+            return None, None
+        if response is None:
+            # CallError, sent without limits as before
+            return None, None
+
+        values = {item.get("key"): item.get("value") for item in response.configuration_key or ()}
+        limits = []
+        for key in (SEND_MAX_LENGTH_KEY, LIST_MAX_LENGTH_KEY):
+            try:
+                limits.append(int(values[key]) or None)
+            except (KeyError, TypeError, ValueError):
+                limits.append(None)
+        return limits[0], limits[1]
+
+    async def _send_update(
+        self,
+        charger_id: str,
+        send_local_list: Callable[..., Awaitable[Any]],
+        charger,
+        version: int,
+        update_type: UpdateType,
+        entries: List[AuthorizationData],
+        send_max_length: Optional[int],
+        list_max_length: Optional[int]
+    ) -> str:
+        """Send one update, a full list split over several requests if needed, and return its status"""
+        if update_type == UpdateType.full and list_max_length and len(entries) > list_max_length:
+            logger.warning(
+                f"Local list v{version} has {len(entries)} entries, {charger_id} holds {list_max_length}"
+            )
+            return "TooLarge"
+
+        if update_type == UpdateType.differential or not send_max_length or len(entries) <= send_max_length:
+            chunks = [(version, update_type, entries)]
+        else:
+            # A Full with the first chunk and Differentials with the rest, each
+            # request needing a higher version than the previous one
+            count = -(-len(entries) // send_max_length)
+            first_version = version - count + 1
+            if first_version < 1:
+                logger.warning(f"Local list v{version} is too young to be sent to {charger_id} in {count} parts")
+                return "TooLarge"
+            chunks = [
+                (first_version + i, UpdateType.full if i == 0 else UpdateType.differential,
+                 entries[i * send_max_length:(i + 1) * send_max_length])
+                for i in range(count)
+            ]
+            if charger is not None and charger.ChargerLocalListVersion:
+                # A transfer cut short leaves a partial list, which must get a full one again
+                async with self.session_factory() as db:
+                    await ChargerRepository.update_charger(
+                        db, charger.ChargerCompanyId, charger.ChargerSiteId, charger_id,
+                        {"ChargerLocalListVersion": 0}
+                    )
+
+        for chunk_version, chunk_type, chunk in chunks:
+            response = await send_local_list(
+                list_version=chunk_version, update_type=chunk_type, local_authorization_list=chunk
+            )
+            if response is None:
+                logger.info(f"Charger {charger_id} answered SendLocalList with a CallError")
+                return "CallError"
+            if response.status != UpdateStatus.accepted:
+                return response.status
+        return UpdateStatus.accepted.value
+
+local_list = LocalListManager()
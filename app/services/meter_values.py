@@ -0,0 +1,117 @@
+"""
+Parsing of OCPP 1.6 MeterValues into compact MeterSample rows.
+"""
+import logging
+from datetime import datetime
+from typing import List, Dict, Any, Optional
+
+logger = logging.getLogger("ocpp.meter_values")
+
+# Stable codes stored in MeterSamples.MeterSampleMeasurand. Never renumber.
+MEASURAND_CODES = {
+    "Energy.Active.Import.Register": 1,
+    "Energy.Active.Export.Register": 2,
+    "Energy.Reactive.Import.Register": 3,
+    "Energy.Reactive.Export.Register": 4,
+    "Energy.Active.Import.Interval": 5,
+    "Energy.Active.Export.Interval": 6,
+    "Energy.Reactive.Import.Interval": 7,
+    "Energy.Reactive.Export.Interval": 8,
+    "Power.Active.Import": 9,
+    "Power.Active.Export": 10,
+    "Power.Reactive.Import": 11,
+    "Power.Reactive.Export": 12,
+    "Power.Offered": 13,
+    "Power.Factor": 14,
+    "Current.Import": 15,
+    "Current.Export": 16,
+    "Current.Offered": 17,
+    "Voltage": 18,
+    "Frequency": 19,
+    "Temperature": 20,
+    "SoC": 21,
+    "RPM": 22,
+}
+
+# Stable codes stored in MeterSamples.MeterSamplePhase (NULL when no phase is given)
+PHASE_CODES = {
+    "L1": 1,
+    "L2": 2,
+    "L3": 3,
+    "N": 4,
+    "L1-N": 5,
+    "L2-N": 6,
+    "L3-N": 7,
+    "L1-L2": 8,
+    "L2-L3": 9,
+    "L3-L1": 10,
+}
+
+ENERGY_ACTIVE_IMPORT_REGISTER = MEASURAND_CODES["Energy.Active.Import.Register"]
+
+# Kilo units are scaled to their base unit so the unit need not be stored
+UNIT_SCALE = {
+    "kWh": 1000.0,
+    "kvarh": 1000.0,
+    "kW": 1000.0,
+    "kVA": 1000.0,
+    "kvar": 1000.0,
+}
+
+# OCPP 1.6 defaults when a sampled value omits measurand
+DEFAULT_MEASURAND = "Energy.Active.Import.Register"
+
+
+def parse_timestamp(value: Optional[str]) -> datetime:
+    """Parse an OCPP timestamp into a naive local datetime, like the other timestamps stored"""
+    if not value:
+        return datetime.now()
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+
+def parse_meter_values(meter_values: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Flatten the snake_cased meter_value list of a MeterValues request.
+
+    Returns one dict per sampled value with measurand, phase, timestamp and value
+    keys, ready to be completed with a session id and bulk inserted. Signed or
+    otherwise non-numeric values are skipped.
+    """
+    samples = []
+    for meter_value in meter_values or []:
+        timestamp = parse_timestamp(meter_value.get("timestamp"))
+        for sampled_value in meter_value.get("sampled_value", []):
+            if sampled_value.get("format") == "SignedData":
+                continue
+
+            measurand = MEASURAND_CODES.get(sampled_value.get("measurand", DEFAULT_MEASURAND))
+            if measurand is None:
+                logger.debug(f"Skipping unknown measurand: {sampled_value.get('measurand')}")
+                continue
+
+            try:
+                value = float(sampled_value["value"])
+            except (KeyError, TypeError, ValueError):
+                continue
+
+            value *= UNIT_SCALE.get(sampled_value.get("unit"), 1.0)
+            samples.append({
+                "measurand": measurand,
+                "phase": PHASE_CODES.get(sampled_value.get("phase")),
+                "timestamp": timestamp,
+                "value": value
+            })
+    return samples
+
+
+def latest_energy_register(samples: List[Dict[str, Any]]) -> Optional[int]:
+    """Return the most recent phase-less Energy.Active.Import.Register reading in Wh"""
+    readings = [
+        sample for sample in samples
+        if sample["measurand"] == ENERGY_ACTIVE_IMPORT_REGISTER and sample["phase"] is None
+    ]
+    if not readings:
+        return None
+    return int(max(readings, key=lambda sample: sample["timestamp"])["value"])
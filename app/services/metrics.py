@@ -0,0 +1,300 @@
+"""
+In-process metrics rendered in the Prometheus text format at GET /metrics.
+
+Metrics are updated from the event loop only, so a sample is a dict lookup
+and an addition with no locking, and histograms keep per-bucket counts that
+are only made cumulative when scraped. Values owned by other components
+(connected chargers, write-behind depth, pool usage...) are registered as
+collectors that are called at scrape time and never on the message path.
+"""
+import asyncio
+import logging
+import os
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger("ocpp.metrics")
+
+LOOP_LAG_INTERVAL_SECONDS = float(os.getenv("LOOP_LAG_INTERVAL_SECONDS", "0.5"))
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Labels, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in self.samples():
+            lines.append(f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}")
+        return lines
+
+    def samples(self) -> Iterable[Tuple[Labels, float]]:
+        return ()
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def samples(self):
+        return sorted(self.values.items())
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, *labels: str):
+        self.values[labels] = value
+
+    def dec(self, *labels: str, amount: float = 1.0):
+        self.values[labels] = self.values.get(labels, 0.0) - amount
+
+
+class CollectedMetric(Metric):
+    """Gauge or counter whose samples come from a callback run at scrape time"""
+
+    def __init__(self, name: str, documentation: str, collect: Callable[[], Iterable[Tuple[Labels, float]]],
+                 labels: Sequence[str] = (), kind: str = "gauge"):
+        super().__init__(name, documentation, labels)
+        self.collect = collect
+        self.kind = kind
+
+    def samples(self):
+        try:
+            return sorted(self.collect())
+        except Exception as e:
+            logger.error(f"Collecting {self.name} failed: {e}")
+            return ()
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: "Histogram", labels: Labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+    # Also usable in "async with" next to async context managers
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, *exc_info):
+        self.__exit__(*exc_info)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (last is +Inf), sum]
+        self.series: Dict[Labels, list] = {}
+
+    def observe(self, value: float, *labels: str):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def time(self, *labels: str) -> _Timer:
+        return _Timer(self, labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, (counts, total) in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                bucket_labels = _format_labels(self.labels, labels, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            label_text = _format_labels(self.labels, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(total)}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def _add(self, metric: Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, documentation, labels, buckets))
+
+    def collector(self, name: str, documentation: str, collect: Callable[[], Iterable[Tuple[Labels, float]]],
+                  labels: Sequence[str] = (), kind: str = "gauge") -> CollectedMetric:
+        """Register a metric read from collect() on every scrape, replacing an earlier one"""
+        self._metrics.pop(name, None)
+        return self._add(CollectedMetric(name, documentation, collect, labels, kind))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+# OCPP calls received from charge points
+messages_received = metrics.counter(
+    "ocpp_messages_received_total", "OCPP calls received from charge points", ["action"])
+message_errors = metrics.counter(
+    "ocpp_message_errors_total", "CallErrors sent in reply to charge point calls", ["action", "code"])
+handler_seconds = metrics.histogram(
+    "ocpp_handler_seconds", "Time spent in the on_<action> handler", ["action"])
+message_seconds = metrics.histogram(
+    "ocpp_message_seconds", "Time from receiving a call to sending its reply", ["action"])
+db_write_seconds = metrics.histogram(
+    "ocpp_db_write_seconds", "Time spent writing OCPP state to the database", ["operation"])
+
+# Calls sent to charge points
+outgoing_calls = metrics.counter(
+    "ocpp_outgoing_calls_total", "OCPP calls sent to charge points by outcome", ["action", "outcome"])
+outgoing_call_seconds = metrics.histogram(
+    "ocpp_outgoing_call_seconds", "Round trip of OCPP calls sent to charge points", ["action"])
+outgoing_calls_in_flight = metrics.gauge(
+    "ocpp_outgoing_calls_in_flight", "OCPP calls sent to charge points awaiting their result")
+
+loop_lag_seconds = metrics.histogram(
+    "ocpp_event_loop_lag_seconds", "Delay of the event loop in running a scheduled callback")
+db_pool_checkout_seconds = metrics.histogram(
+    "ocpp_db_pool_checkout_seconds", "Time waited for a database connection from the pool")
+db_connections_opened = metrics.counter(
+    "ocpp_db_connections_opened_total", "Database connections opened by the pool")
+
+
+class LoopLagMonitor:
+    """Measures how late a periodic sleep wakes up, i.e. how long the loop was blocked"""
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL_SECONDS):
+        self.interval = interval
+        self.last_lag = 0.0
+        # time.monotonic() at which the probe is due to wake up, None when stopped
+        self.next_wakeup: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        metrics.collector(
+            "ocpp_event_loop_lag_last_seconds", "Event loop lag measured by the last probe",
+            lambda: [((), self.last_lag)]
+        )
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.next_wakeup = None
+
+    async def _run(self):
+        while True:
+            self.next_wakeup = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            self.last_lag = max(0.0, time.monotonic() - self.next_wakeup)
+            loop_lag_seconds.observe(self.last_lag)
+
+
+loop_lag = LoopLagMonitor()
+
+
+def instrument_pool(engine):
+    """Record how long connection checkouts wait on the engine's pool, and its usage at scrape time"""
+    metrics.collector(
+        "ocpp_db_engine_info", "Database backend and driver of the engine profile",
+        lambda: [((engine.dialect.name, engine.dialect.driver), 1)], labels=["backend", "driver"]
+    )
+    from sqlalchemy import event
+
+    # Engine.connect() checks a connection out of the pool, sessions and
+    # engine.begin() included; pool events only fire once it is handed over
+    sync_engine = engine.sync_engine
+    connect = sync_engine.connect
+
+    def timed_connect():
+        started = time.perf_counter()
+        try:
+            return connect()
+        finally:
+            db_pool_checkout_seconds.observe(time.perf_counter() - started)
+
+    sync_engine.connect = timed_connect
+
+    pool = sync_engine.pool
+    event.listen(pool, "connect", lambda dbapi_connection, connection_record: db_connections_opened.inc())
+    if hasattr(pool, "checkedout"):
+        metrics.collector(
+            "ocpp_db_pool_checked_out", "Database connections currently checked out",
+            lambda: [((), engine.sync_engine.pool.checkedout())]
+        )
+        metrics.collector(
+            "ocpp_db_pool_checked_in", "Idle database connections held by the pool",
+            lambda: [((), engine.sync_engine.pool.checkedin())]
+        )
+        metrics.collector(
+            "ocpp_db_pool_size", "Connections the pool keeps open",
+            lambda: [((), engine.sync_engine.pool.size())]
+        )
+        metrics.collector(
+            "ocpp_db_pool_overflow", "Connections open beyond the pool size (negative while below it)",
+            lambda: [((), engine.sync_engine.pool.overflow())]
+        )
@@ -0,0 +1,322 @@
+"""
+Persistence service for OCPP messages.
+
+Holds the database logic behind the OCPP-DB integration endpoints so it can be
+called in-process by the ChargePoint16 handlers as well as by the REST routes.
+"""
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional, List, Dict, Any
+from datetime import datetime
+import logging
+import os
+
+from ..database.repositories.repositories import (
+    ChargerRepository, ConnectorRepository, ChargeSessionRepository
+)
+from .active_sessions import active_sessions
+from .auth_cache import authorization_cache
+from .meter_values import ENERGY_ACTIVE_IMPORT_REGISTER, latest_energy_register
+from .write_behind import write_behind
+
+logger = logging.getLogger("ocpp.service")
+
+# Tenant of chargers not in the charger directory (see ALLOW_UNKNOWN_CHARGERS)
+DEFAULT_COMPANY_ID = os.getenv("DEFAULT_COMPANY_ID", "DEF01")
+DEFAULT_SITE_ID = os.getenv("DEFAULT_SITE_ID", "MAIN")
+
+
+class OCPPService:
+    @staticmethod
+    async def register_charger(
+        db: AsyncSession,
+        charger_id: str,
+        vendor: str,
+        model: str,
+        serial_number: Optional[str] = None,
+        firmware_version: Optional[str] = None,
+        company_id: str = DEFAULT_COMPANY_ID,
+        site_id: str = DEFAULT_SITE_ID
+    ):
+        """Register or update a charger from OCPP boot notification"""
+        logger.info(f"Registering/updating charger from OCPP: {charger_id}")
+
+        # Created, or refreshed when known, in a single upsert
+        return await ChargerRepository.register_charger(db, {
+            "company_id": company_id,
+            "site_id": site_id,
+            "charger_id": charger_id,
+            "vendor": vendor,
+            "model": model,
+            "serial": serial_number,
+            "firmware": firmware_version,
+            "booted": datetime.now()
+        })
+
+    @staticmethod
+    async def update_connector_status(
+        db: AsyncSession,
+        charger_id: str,
+        connector_id: str,
+        status: str,
+        company_id: str = DEFAULT_COMPANY_ID,
+        site_id: str = DEFAULT_SITE_ID
+    ):
+        """Update connector status from OCPP status notification"""
+        logger.info(f"Updating connector status from OCPP: {charger_id}/{connector_id} to {status}")
+
+        # Update existing connector, None when it does not exist yet
+        connector = await ConnectorRepository.update_connector_status(
+            db, company_id, site_id, charger_id, connector_id, status
+        )
+        if connector:
+            return connector
+
+        # Create new connector
+        new_connector = {
+            "ConnectorCompanyId": company_id,
+            "ConnectorSiteId": site_id,
+            "ConnectorChargerId": charger_id,
+            "ConnectorId": connector_id,
+            "ConnectorName": f"Connector {connector_id}",
+            "ConnectorType": "Unknown",  # Can be updated later with proper type
+            "ConnectorEnabled": True,
+            "ConnectorStatus": status
+        }
+
+        logger.info(f"Creating new connector: {charger_id}/{connector_id}")
+        return await ConnectorRepository.create_connector(db, new_connector)
+
+    @staticmethod
+    async def start_session(
+        db: AsyncSession,
+        charger_id: str,
+        connector_id: str,
+        id_tag: Optional[str] = None,
+        transaction_id: Optional[int] = None,
+        company_id: str = DEFAULT_COMPANY_ID,
+        site_id: str = DEFAULT_SITE_ID,
+        connector_status: bool = True
+    ) -> Dict[str, Any]:
+        """Start a charging session from OCPP StartTransaction.
+
+        connector_status=False leaves the connector's Charging status to the
+        caller, which records it when the message arrives.
+        """
+        logger.info(f"Starting charging session from OCPP: {charger_id}/{connector_id}")
+
+        # Find driver by RFID tag if provided
+        driver_id = None
+        if id_tag:
+            authorization = await authorization_cache.authorize(id_tag)
+            if authorization.accepted:
+                driver_id = authorization.driver_id
+
+        # Create new session
+        new_session = {
+            "ChargerSessionCompanyId": company_id,
+            "ChargerSessionSiteId": site_id,
+            "ChargerSessionChargerId": charger_id,
+            "ChargerSessionConnectorId": connector_id,
+            "ChargerSessionTransactionId": transaction_id,
+            "ChargerSessionDriverId": driver_id,
+            "ChargerSessionRFIDCard": id_tag,
+            "ChargerSessionStart": datetime.now(),
+            "ChargerSessionStatus": "In Progress",
+            "ChargerSessionEnergyKWH": 0
+        }
+
+        # Create the session
+        session = await ChargeSessionRepository.create_session(db, new_session)
+        if transaction_id is not None:
+            active_sessions.add(transaction_id, session)
+
+        if connector_status:
+            # Queue connector status behind any earlier StatusNotification
+            write_behind.record_connector_status(company_id, site_id, charger_id, connector_id, "Charging")
+
+        return {
+            "session_id": session.ChargeSessionId,
+            "transaction_id": transaction_id or session.ChargeSessionId
+        }
+
+    @staticmethod
+    async def _find_open_session_id(
+        db: AsyncSession,
+        charger_id: str,
+        transaction_id: int,
+        connector_id: Optional[str] = None,
+        company_id: str = DEFAULT_COMPANY_ID,
+        site_id: str = DEFAULT_SITE_ID
+    ) -> Optional[int]:
+        """Resolve the running session of a transaction without scanning the charger's history"""
+        entry = active_sessions.get(transaction_id)
+        if entry is not None:
+            if entry.charger_id == charger_id:
+                return entry.session_id
+            logger.warning(f"Transaction {transaction_id} belongs to {entry.charger_id}, not {charger_id}")
+            return None
+
+        # Started by another worker or before a restart
+        session = await ChargeSessionRepository.get_session_by_transaction_id(db, transaction_id)
+        if session is None and connector_id is not None:
+            # Sessions stored before transaction ids were recorded
+            session = await ChargeSessionRepository.get_open_session(
+                db, company_id, site_id, charger_id, connector_id
+            )
+        if session is None or session.ChargerSessionEnd or session.ChargerSessionChargerId != charger_id:
+            return None
+        return session.ChargeSessionId
+
+    @staticmethod
+    async def end_session(
+        db: AsyncSession,
+        charger_id: str,
+        connector_id: Optional[str],
+        transaction_id: int,
+        meter_value: int = 0,
+        reason: str = "Remote",
+        company_id: str = DEFAULT_COMPANY_ID,
+        site_id: str = DEFAULT_SITE_ID,
+        connector_status: bool = True
+    ) -> Optional[Dict[str, Any]]:
+        """End a charging session from OCPP StopTransaction, or None if no session is active.
+
+        StopTransaction carries no connector, so the session is found by its
+        transaction id; connector_id is only used for sessions without one.
+        connector_status=False leaves the connector's Available status to the
+        caller, as for start_session.
+        """
+        logger.info(f"Ending charging session from OCPP: {charger_id}, transaction: {transaction_id}")
+
+        session_id = await OCPPService._find_open_session_id(
+            db, charger_id, transaction_id, connector_id, company_id, site_id
+        )
+        if session_id is None:
+            logger.warning(f"No active session found for {charger_id}, transaction {transaction_id}")
+            return None
+
+        # End the session
+        end_time = datetime.now()
+        ended_session = await ChargeSessionRepository.end_session(
+            db, session_id, end_time, meter_value, reason
+        )
+        active_sessions.discard(transaction_id)
+        if ended_session is None:
+            return None
+
+        if connector_status:
+            # Queue connector status behind any earlier StatusNotification
+            write_behind.record_connector_status(
+                ended_session.ChargerSessionCompanyId, ended_session.ChargerSessionSiteId,
+                charger_id, ended_session.ChargerSessionConnectorId, "Available"
+            )
+
+        return {
+            "session_id": ended_session.ChargeSessionId,
+            "connector_id": ended_session.ChargerSessionConnectorId,
+            "energy_kwh": ended_session.ChargerSessionEnergyKWH,
+            "duration_seconds": ended_session.ChargerSessionDuration
+        }
+
+    @staticmethod
+    async def record_meter_values(
+        db: AsyncSession,
+        charger_id: str,
+        connector_id: str,
+        transaction_id: int,
+        meter_value: Optional[int] = None,
+        samples: Optional[List[Dict[str, Any]]] = None,
+        company_id: str = DEFAULT_COMPANY_ID,
+        site_id: str = DEFAULT_SITE_ID
+    ) -> Optional[Dict[str, Any]]:
+        """Record meter values from OCPP MeterValues, or None if the session is unknown.
+
+        samples are the parsed sampled values of the request (see
+        app.services.meter_values); without them meter_value is stored as a single
+        Energy.Active.Import.Register reading. Samples are appended through the
+        write-behind buffer, the session energy is updated from the latest register,
+        in Wh like the meterStop stored when the session ends.
+        """
+        logger.info(f"Recording meter values from OCPP: {charger_id}/{connector_id}, value: {meter_value}")
+
+        # Find session by its OCPP transaction id
+        entry = active_sessions.get(transaction_id)
+        if entry is not None:
+            session_id = entry.session_id
+        else:
+            session = await ChargeSessionRepository.get_session_by_transaction_id(db, transaction_id)
+            if not session:
+                logger.warning(f"No session found for transaction {transaction_id}")
+                return None
+            session_id = session.ChargeSessionId
+
+        if samples is None:
+            samples = []
+            if meter_value is not None:
+                samples.append({
+                    "measurand": ENERGY_ACTIVE_IMPORT_REGISTER,
+                    "phase": None,
+                    "timestamp": datetime.now(),
+                    "value": float(meter_value)
+                })
+        elif meter_value is None:
+            meter_value = latest_energy_register(samples)
+
+        write_behind.record_meter_samples(session_id, samples)
+
+        # Update energy value
+        if meter_value is not None:
+            session_data = {
+                "ChargerSessionEnergyKWH": meter_value
+            }
+            await ChargeSessionRepository.update_session(db, session_id, session_data)
+
+        return {
+            "session_id": session_id,
+            "meter_value": meter_value,
+            "samples_recorded": len(samples)
+        }
+
+    @staticmethod
+    async def record_heartbeat(
+        db: AsyncSession,
+        charger_id: str,
+        company_id: str = DEFAULT_COMPANY_ID,
+        site_id: str = DEFAULT_SITE_ID
+    ) -> Optional[Dict[str, Any]]:
+        """Record heartbeat from OCPP Heartbeat, or None if the charger is unknown"""
+        logger.info(f"Recording heartbeat from OCPP: {charger_id}")
+
+        # Update charger's last heartbeat
+        charger_data = {
+            "ChargerLastHeartbeat": datetime.now(),
+            "ChargerIsOnline": True
+        }
+
+        updated_charger = await ChargerRepository.update_charger(
+            db, company_id, site_id, charger_id, charger_data
+        )
+
+        if not updated_charger:
+            logger.warning(f"Charger not found: {charger_id}")
+            return None
+
+        return {
+            "charger_id": updated_charger.ChargerId,
+            "last_heartbeat": updated_charger.ChargerLastHeartbeat,
+            "is_online": updated_charger.ChargerIsOnline
+        }
+
+    @staticmethod
+    async def update_charger_connection_status(
+        db: AsyncSession,
+        charger_id: str,
+        connected: bool,
+        company_id: str = DEFAULT_COMPANY_ID,
+        site_id: str = DEFAULT_SITE_ID
+    ):
+        """Mark a charger online/offline when its websocket connects or drops"""
+        status = "Available" if connected else "Unavailable"
+        return await ChargerRepository.update_charger_status(
+            db, company_id, site_id, charger_id, status, connected
+        )
@@ -0,0 +1,198 @@
+"""
+JSON schema validation of OCPP 1.6 payloads.
+
+The ocpp library builds its validators lazily and validates every message in
+the default thread pool, which costs more than validating a Heartbeat itself.
+Here every schema shipped with the library is compiled once per action and
+direction (load(), run at startup) and messages are validated inline with
+their time recorded per action. When fastjsonschema is installed (pip install
+fastjsonschema) the schemas are compiled to Python code, several times faster
+than jsonschema; a Draft4Validator is kept to report the errors exactly as the
+ocpp library does.
+
+The mode is full, sampled (SCHEMA_VALIDATION_SAMPLE_RATE of the messages) or
+off. SCHEMA_VALIDATION_MODE is the default; Chargers.ChargerSchemaValidation
+overrides it for a charger (e.g. off for trusted hardware) and is taken from
+the charger directory when the charger connects.
+"""
+import decimal
+import json
+import logging
+import os
+import random
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import ocpp
+from jsonschema import Draft4Validator
+from jsonschema.exceptions import ValidationError as SchemaValidationError
+from ocpp.exceptions import (
+    FormatViolationError, NotImplementedError, ProtocolError, TypeConstraintViolationError
+)
+from ocpp.messages import MessageType
+
+from .metrics import metrics
+
+try:
+    import fastjsonschema
+except ImportError:
+    fastjsonschema = None
+
+logger = logging.getLogger("ocpp.validation")
+
+VALIDATION_MODES = ("full", "sampled", "off")
+
+SCHEMA_VALIDATION_MODE = os.getenv("SCHEMA_VALIDATION_MODE", "full").lower()
+SCHEMA_VALIDATION_SAMPLE_RATE = float(os.getenv("SCHEMA_VALIDATION_SAMPLE_RATE", "0.1"))
+
+if SCHEMA_VALIDATION_MODE not in VALIDATION_MODES:
+    raise ValueError(f"Unknown SCHEMA_VALIDATION_MODE: {SCHEMA_VALIDATION_MODE}")
+
+SCHEMA_DIR = Path(ocpp.__file__).parent / "v16" / "schemas"
+
+# Schemas with decimal fields (multipleOf 0.1) that must be checked on Decimal values,
+# see ocpp.messages._validate_payload
+DECIMAL_SCHEMAS = {
+    (MessageType.Call, "SetChargingProfile"),
+    (MessageType.Call, "RemoteStartTransaction"),
+    (MessageType.CallResult, "GetCompositeSchedule"),
+}
+
+# Like the ocpp library (no jsonschema format checker), formats are not enforced
+UNCHECKED_FORMATS = {"date-time": lambda value: True, "uri": lambda value: True}
+
+DIRECTIONS = {MessageType.Call: "call", MessageType.CallResult: "result"}
+
+
+def schema_error(message, error: SchemaValidationError):
+    """Map a schema violation to the OCPPError the ocpp library raises for it"""
+    if error.validator == "required":
+        return ProtocolError(details={"cause": error.message})
+    if error.validator in ("type", "maxLength"):
+        return TypeConstraintViolationError(details={"cause": error.message, "ocpp_message": message})
+    if error.validator == "additionalProperties":
+        return FormatViolationError(details={"cause": error.message, "ocpp_message": message})
+    return FormatViolationError(details={
+        "cause": f"Payload '{message.payload}' for action '{message.action}' is not valid: {error}",
+        "ocpp_message": message,
+    })
+
+
+class SchemaValidation:
+    def __init__(
+        self,
+        default_mode: str = SCHEMA_VALIDATION_MODE,
+        sample_rate: float = SCHEMA_VALIDATION_SAMPLE_RATE
+    ):
+        self.default_mode = default_mode
+        self.sample_rate = sample_rate
+        self._validators: Dict[Tuple[int, str], Draft4Validator] = {}
+        self._compiled: Dict[Tuple[int, str], Callable[[Any], Any]] = {}
+        # (action, direction) -> [validated, seconds, failed]
+        self._stats: Dict[Tuple[str, str], list] = {}
+        self.skipped = 0
+
+        metrics.collector(
+            "ocpp_schema_validations_total", "OCPP payloads validated",
+            lambda: [(key, stats[0]) for key, stats in self._stats.items()],
+            labels=["action", "direction"], kind="counter"
+        )
+        metrics.collector(
+            "ocpp_schema_validation_failures_total", "OCPP payloads that failed validation",
+            lambda: [(key, stats[2]) for key, stats in self._stats.items()],
+            labels=["action", "direction"], kind="counter"
+        )
+        metrics.collector(
+            "ocpp_schema_validation_seconds_total", "Time spent validating OCPP payloads",
+            lambda: [(key, stats[1]) for key, stats in self._stats.items()],
+            labels=["action", "direction"], kind="counter"
+        )
+        metrics.collector(
+            "ocpp_schema_validation_skipped_total", "OCPP payloads not validated in sampled or off mode",
+            lambda: [((), self.skipped)], kind="counter"
+        )
+
+    def load(self):
+        """Compile the validator of every OCPP 1.6 action and response"""
+        validators, compiled = {}, {}
+        for path in SCHEMA_DIR.glob("*.json"):
+            name = path.stem
+            if name.endswith("Response"):
+                key = (MessageType.CallResult, name[:-len("Response")])
+            else:
+                key = (MessageType.Call, name)
+            parse_float = decimal.Decimal if key in DECIMAL_SCHEMAS else float
+            schema = json.loads(path.read_text(encoding="utf-8-sig"), parse_float=parse_float)
+            Draft4Validator.check_schema(schema)
+            validators[key] = Draft4Validator(schema)
+            if fastjsonschema is not None and key not in DECIMAL_SCHEMAS:
+                compiled[key] = fastjsonschema.compile(schema, formats=UNCHECKED_FORMATS, use_default=False)
+        self._validators, self._compiled = validators, compiled
+        logger.info(f"Compiled {len(validators)} OCPP 1.6 schemas ({len(compiled)} with fastjsonschema)")
+
+    def validate(self, message, mode: Optional[str] = None):
+        """Validate a Call or CallResult unless the mode skips it; raises the matching OCPPError"""
+        mode = mode or self.default_mode
+        if mode == "off" or (mode == "sampled" and random.random() >= self.sample_rate):
+            self.skipped += 1
+            return
+
+        if not self._validators:
+            self.load()
+        key = (message.message_type_id, message.action)
+        validator = self._validators.get(key)
+        if validator is None:
+            raise NotImplementedError(details={"cause": f"Failed to validate action: {message.action}"})
+
+        payload = message.payload
+        if key in DECIMAL_SCHEMAS:
+            # Values may already be Decimals, e.g. a payload validated before
+            payload = json.loads(json.dumps(payload, default=float), parse_float=decimal.Decimal)
+
+        stats = self._stats.get((message.action, DIRECTIONS[message.message_type_id]))
+        if stats is None:
+            stats = self._stats[(message.action, DIRECTIONS[message.message_type_id])] = [0, 0.0, 0]
+        started = time.perf_counter()
+        try:
+            compiled = self._compiled.get(key)
+            if compiled is None:
+                validator.validate(payload)
+            else:
+                try:
+                    compiled(payload)
+                except fastjsonschema.JsonSchemaException:
+                    validator.validate(payload)
+        except SchemaValidationError as e:
+            stats[2] += 1
+            raise schema_error(message, e)
+        finally:
+            stats[0] += 1
+            stats[1] += time.perf_counter() - started
+
+    def mode_for(self, charger_id: str, mode: Optional[str]) -> str:
+        """Return the validation mode configured for a charger (its ChargerSchemaValidation), or the default"""
+        if mode not in VALIDATION_MODES:
+            if mode is not None:
+                logger.warning(f"Unknown validation mode {mode} for {charger_id}, using {self.default_mode}")
+            mode = self.default_mode
+        return mode
+
+    def stats(self) -> Dict[str, Any]:
+        actions: Dict[str, Dict[str, Any]] = {}
+        for (action, direction), (validated, seconds, failed) in sorted(self._stats.items()):
+            actions.setdefault(action, {})[direction] = {
+                "validated": validated,
+                "failed": failed,
+                "seconds": seconds,
+                "mean_us": seconds / validated * 1e6 if validated else 0.0,
+            }
+        return {
+            "default_mode": self.default_mode,
+            "sample_rate": self.sample_rate,
+            "skipped": self.skipped,
+            "actions": actions,
+        }
+
+
+schema_validation = SchemaValidation()
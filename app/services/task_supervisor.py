@@ -0,0 +1,160 @@
+"""
+Supervisor for the background side effects of OCPP connections.
+
+Work that must not hold up the charger's message loop (connection status
+updates, local list sync, after-action hooks, forwarded commands) is started
+with task_supervisor.spawn() instead of a bare asyncio.create_task. The
+supervisor keeps a reference to every task so none is garbage collected
+mid-flight. It limits the tasks per charger (TASK_MAX_PER_CHARGER) and in
+total (TASK_MAX_TOTAL), rejecting new ones over either limit. Failed
+attempts are retried with exponential backoff and full jitter.
+
+A task spawned with coalesce=True replaces the pending arguments of the same
+task for that charger instead of queuing another run, so a status that is
+superseded before it was written (connected, then disconnected) is never
+written. drain() waits for the tasks at shutdown and cancels the stragglers.
+"""
+import asyncio
+import logging
+import os
+import random
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from .metrics import metrics
+
+logger = logging.getLogger("ocpp.tasks")
+
+TASK_MAX_PER_CHARGER = int(os.getenv("TASK_MAX_PER_CHARGER", "20"))
+TASK_MAX_TOTAL = int(os.getenv("TASK_MAX_TOTAL", "5000"))
+TASK_RETRY_BASE_SECONDS = float(os.getenv("TASK_RETRY_BASE_SECONDS", "0.5"))
+TASK_RETRY_MAX_SECONDS = float(os.getenv("TASK_RETRY_MAX_SECONDS", "30"))
+
+tasks_total = metrics.counter(
+    "ocpp_background_tasks_total", "Background tasks by outcome", ["name", "outcome"])
+
+
+def retry_delay(attempt: int, base: float = TASK_RETRY_BASE_SECONDS, cap: float = TASK_RETRY_MAX_SECONDS) -> float:
+    """Exponential backoff with full jitter for the given retry (0 for the first)"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class TaskSupervisor:
+    def __init__(self, max_per_charger: int = TASK_MAX_PER_CHARGER, max_total: int = TASK_MAX_TOTAL):
+        self.max_per_charger = max_per_charger
+        self.max_total = max_total
+        # charger id -> its running tasks
+        self._tasks: Dict[str, Set[asyncio.Task]] = {}
+        # (charger id, name) -> [arguments of the next run, None once taken] of a coalescing task
+        self._pending: Dict[Tuple[str, str], list] = {}
+        self._closing = False
+
+        metrics.collector(
+            "ocpp_background_tasks_in_flight", "Background tasks running or waiting to retry",
+            lambda: [((name,), count) for name, count in self._counts().items()],
+            labels=["name"]
+        )
+
+    def _counts(self) -> Counter:
+        return Counter(task.get_name() for tasks in self._tasks.values() for task in tasks)
+
+    def in_flight(self) -> int:
+        return sum(len(tasks) for tasks in self._tasks.values())
+
+    def spawn(
+        self,
+        charger_id: str,
+        name: str,
+        function: Callable[..., Awaitable[Any]],
+        *args: Any,
+        retries: int = 0,
+        coalesce: bool = False
+    ) -> Optional[asyncio.Task]:
+        """Run function(*args) in the background for a charger; returns None when rejected"""
+        key = (charger_id, name)
+        if coalesce and key in self._pending:
+            slot = self._pending[key]
+            if slot[0] is not None:
+                tasks_total.inc(name, "coalesced")
+            slot[0] = args
+            return None
+
+        tasks = self._tasks.setdefault(charger_id, set())
+        if self._closing or len(tasks) >= self.max_per_charger or self.in_flight() >= self.max_total:
+            tasks_total.inc(name, "rejected")
+            logger.warning(f"Rejected background task {name} for {charger_id}: {len(tasks)} running for it")
+            if not tasks:
+                del self._tasks[charger_id]
+            return None
+
+        if coalesce:
+            self._pending[key] = [args]
+            runner = self._run_coalesced(key, function, retries)
+        else:
+            runner = self._run(charger_id, name, function, args, retries)
+        task = asyncio.create_task(runner, name=name)
+        tasks.add(task)
+        task.add_done_callback(lambda done: self._discard(charger_id, done))
+        return task
+
+    def _discard(self, charger_id: str, task: asyncio.Task):
+        tasks = self._tasks.get(charger_id)
+        if tasks is not None:
+            tasks.discard(task)
+            if not tasks:
+                del self._tasks[charger_id]
+
+    async def _run_coalesced(self, key: Tuple[str, str], function, retries: int):
+        slot = self._pending[key]
+        try:
+            while slot[0] is not None:
+                args, slot[0] = slot[0], None
+                await self._run(key[0], key[1], function, args, retries)
+        finally:
+            del self._pending[key]
+
+    async def _run(self, charger_id: str, name: str, function, args, retries: int):
+        for attempt in range(retries + 1):
+            try:
+                await function(*args)
+                tasks_total.inc(name, "ok")
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if attempt == retries:
+                    tasks_total.inc(name, "failed")
+                    logger.error(f"Background task {name} for {charger_id} failed: {e}", exc_info=True)
+                    return
+                delay = retry_delay(attempt)
+                tasks_total.inc(name, "retried")
+                logger.warning(f"Background task {name} for {charger_id} failed ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def drain(self, timeout: float = 10.0):
+        """Stop accepting tasks, wait up to timeout seconds for the running ones and cancel the rest"""
+        self._closing = True
+        tasks: List[asyncio.Task] = [task for tasks in self._tasks.values() for task in tasks]
+        if not tasks:
+            return
+        logger.info(f"Draining {len(tasks)} background tasks")
+        done, pending = await asyncio.wait(tasks, timeout=timeout)
+        if pending:
+            logger.warning(f"Cancelling {len(pending)} background tasks still running after {timeout}s")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight(),
+            "limits": {"per_charger": self.max_per_charger, "total": self.max_total},
+            "by_name": dict(self._counts()),
+            "by_charger": {
+                charger_id: dict(Counter(task.get_name() for task in tasks))
+                for charger_id, tasks in sorted(self._tasks.items())
+            },
+        }
+
+
+task_supervisor = TaskSupervisor()
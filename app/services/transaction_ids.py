@@ -0,0 +1,89 @@
+"""
+Globally unique OCPP transaction ids using a hi/lo scheme.
+
+Each worker reserves a block of TRANSACTION_ID_BLOCK_SIZE ids at a time from
+the IdBlocks table and hands them out from memory. The next block is fetched
+in the background once fewer than TRANSACTION_ID_LOW_WATERMARK ids remain, so
+StartTransaction normally never waits on the database. Ids stay unique across
+restarts and across any number of workers sharing the database.
+"""
+import asyncio
+import logging
+import os
+from collections import deque
+from typing import Deque, Optional
+
+from ..database.database import SessionLocal
+from ..database.repositories.repositories import IdBlockRepository
+
+logger = logging.getLogger("ocpp.transaction_ids")
+
+TRANSACTION_ID_BLOCK_SIZE = int(os.getenv("TRANSACTION_ID_BLOCK_SIZE", "1000"))
+TRANSACTION_ID_LOW_WATERMARK = int(os.getenv("TRANSACTION_ID_LOW_WATERMARK", "200"))
+
+
+class TransactionIdAllocator:
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        name: str = "transaction",
+        block_size: int = TRANSACTION_ID_BLOCK_SIZE,
+        low_watermark: int = TRANSACTION_ID_LOW_WATERMARK
+    ):
+        self.session_factory = session_factory
+        self.name = name
+        self.block_size = block_size
+        self.low_watermark = low_watermark
+
+        # Reserved but unused ranges as [next, end) pairs
+        self._ranges: Deque[list] = deque()
+        self._reserving: Optional[asyncio.Task] = None
+
+    def available(self) -> int:
+        return sum(end - start for start, end in self._ranges)
+
+    async def start(self):
+        """Reserve the first block so the first StartTransaction does not wait"""
+        if not self._ranges:
+            await self._reserve_shared()
+
+    async def next_id(self) -> int:
+        while not self._ranges:
+            await self._reserve_shared()
+
+        current = self._ranges[0]
+        transaction_id = current[0]
+        current[0] += 1
+        if current[0] >= current[1]:
+            self._ranges.popleft()
+
+        if self.available() < self.low_watermark:
+            self._reserve_in_background()
+        return transaction_id
+
+    def _reserve_in_background(self):
+        if self._reserving is None or self._reserving.done():
+            self._reserving = asyncio.create_task(self._prefetch())
+
+    async def _prefetch(self):
+        try:
+            await self._reserve()
+        except Exception as e:
+            logger.error(f"Failed to prefetch {self.name} id block: {e}")
+
+    async def _reserve_shared(self):
+        """Wait for a block, sharing one in-flight reservation (a prefetch included) between all waiters"""
+        if self._reserving is None or self._reserving.done():
+            self._reserving = asyncio.create_task(self._reserve())
+        # A cancelled waiter must not cancel the reservation the others wait for
+        await asyncio.shield(self._reserving)
+
+    async def _reserve(self):
+        async with self.session_factory() as db:
+            hi = await IdBlockRepository.reserve_block(db, self.name)
+        start = hi * self.block_size + 1
+        self._ranges.append([start, start + self.block_size])
+        logger.info(f"Reserved {self.name} id block {start}-{start + self.block_size - 1}")
+
+
+transaction_ids = TransactionIdAllocator()
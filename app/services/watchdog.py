@@ -0,0 +1,261 @@
+"""
+Watchdog for event loop stalls and slow OCPP handlers and HTTP routes.
+
+A sampler thread checks every WATCHDOG_SAMPLE_INTERVAL_MS whether the loop
+lag probe (app.services.metrics.loop_lag) woke up on time. When it is late by
+more than WATCHDOG_LOOP_STALL_MS the loop is blocked and the thread captures
+the loop thread's stack, which shows the call doing the blocking.
+
+Handlers and routes are wrapped in watchdog.track(). An operation running
+past its threshold is sampled by the same thread: the loop thread's stack if
+the loop is stalled, otherwise the await chain of its task. When it finishes
+it is recorded with its action or route, charger id, duration and stack.
+
+Events are kept in memory (WATCHDOG_MAX_EVENTS), shown at GET /admin/watchdog
+and counted in /metrics. Only the event loop records events and updates
+metrics; the thread hands its results over with call_soon_threadsafe.
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from .metrics import LATENCY_BUCKETS, loop_lag, metrics
+
+logger = logging.getLogger("ocpp.watchdog")
+
+WATCHDOG_ENABLED = os.getenv("WATCHDOG_ENABLED", "true").lower() == "true"
+WATCHDOG_LOOP_STALL_MS = float(os.getenv("WATCHDOG_LOOP_STALL_MS", "100"))
+WATCHDOG_SLOW_HANDLER_MS = float(os.getenv("WATCHDOG_SLOW_HANDLER_MS", "500"))
+WATCHDOG_SLOW_ROUTE_MS = float(os.getenv("WATCHDOG_SLOW_ROUTE_MS", "1000"))
+WATCHDOG_SAMPLE_INTERVAL_MS = float(os.getenv("WATCHDOG_SAMPLE_INTERVAL_MS", "20"))
+WATCHDOG_MAX_EVENTS = int(os.getenv("WATCHDOG_MAX_EVENTS", "200"))
+
+MAX_STACK_FRAMES = 30
+
+slow_operations = metrics.counter(
+    "ocpp_slow_operations_total", "Handlers and routes that ran past their watchdog threshold", ["kind", "name"])
+loop_stalls = metrics.counter(
+    "ocpp_event_loop_stalls_total", "Times the event loop was blocked past WATCHDOG_LOOP_STALL_MS")
+loop_stall_seconds = metrics.histogram(
+    "ocpp_event_loop_stall_seconds", "Duration of event loop stalls", buckets=LATENCY_BUCKETS)
+
+
+def format_frames(frame, limit: int = MAX_STACK_FRAMES) -> List[str]:
+    """Format a thread's stack, innermost call last"""
+    lines = []
+    while frame is not None and len(lines) < limit:
+        lines.append(f"{frame.f_code.co_filename}:{frame.f_lineno} in {frame.f_code.co_name}")
+        frame = frame.f_back
+    return lines[::-1]
+
+
+def task_stack(task: Optional[asyncio.Task]) -> List[str]:
+    """Format the await chain a task is suspended in, innermost call last"""
+    lines = []
+    coro = task.get_coro() if task is not None else None
+    while coro is not None and len(lines) < MAX_STACK_FRAMES:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is not None:
+            lines.append(f"{frame.f_code.co_filename}:{frame.f_lineno} in {frame.f_code.co_name}")
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return lines
+
+
+class Operation:
+    """A handler or route being timed; usable with "with" and "async with\""""
+    __slots__ = ("watchdog", "kind", "name", "charger_id", "threshold", "started", "task", "stack")
+
+    def __init__(self, watchdog: "Watchdog", kind: str, name: str, charger_id: Optional[str], threshold: float):
+        self.watchdog = watchdog
+        self.kind = kind
+        self.name = name
+        self.charger_id = charger_id
+        self.threshold = threshold
+        self.started = time.monotonic()
+        self.stack: Optional[List[str]] = None
+        try:
+            self.task = asyncio.current_task()
+        except RuntimeError:
+            self.task = None
+
+    def finish(self):
+        self.watchdog._finish(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.finish()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.finish()
+
+
+class _NoOperation:
+    name = None
+
+    def finish(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+class Watchdog:
+    def __init__(
+        self,
+        enabled: bool = WATCHDOG_ENABLED,
+        loop_stall_ms: float = WATCHDOG_LOOP_STALL_MS,
+        slow_handler_ms: float = WATCHDOG_SLOW_HANDLER_MS,
+        slow_route_ms: float = WATCHDOG_SLOW_ROUTE_MS,
+        sample_interval_ms: float = WATCHDOG_SAMPLE_INTERVAL_MS,
+        max_events: int = WATCHDOG_MAX_EVENTS
+    ):
+        self.enabled = enabled
+        self.loop_stall = loop_stall_ms / 1000
+        self.thresholds = {"handler": slow_handler_ms / 1000, "route": slow_route_ms / 1000}
+        self.sample_interval = sample_interval_ms / 1000
+        self.events: deque = deque(maxlen=max_events)
+
+        self._operations: Dict[int, Operation] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._stall: Optional[Dict[str, Any]] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+    def track(self, kind: str, name: str, charger_id: Optional[str] = None):
+        """Time a handler ("handler") or route ("route") against its threshold"""
+        if not self.enabled:
+            return _NoOperation()
+        operation = Operation(self, kind, name, charger_id, self.thresholds[kind])
+        self._operations[id(operation)] = operation
+        return operation
+
+    def _finish(self, operation: Operation):
+        if self._operations.pop(id(operation), None) is None:
+            return
+        elapsed = time.monotonic() - operation.started
+        if elapsed < operation.threshold:
+            return
+        slow_operations.inc(operation.kind, operation.name)
+        self.events.append({
+            "kind": operation.kind,
+            "name": operation.name,
+            "charger_id": operation.charger_id,
+            "duration_ms": round(elapsed * 1000, 1),
+            "started_at": (datetime.now() - timedelta(seconds=elapsed)).isoformat(),
+            "stack": operation.stack or [],
+        })
+        logger.warning(
+            f"Slow {operation.kind} {operation.name}"
+            f"{f' for {operation.charger_id}' if operation.charger_id else ''}: {elapsed * 1000:.0f}ms"
+        )
+
+    async def start(self):
+        if not self.enabled or self._thread is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="ocpp-watchdog", daemon=True)
+        self._thread.start()
+        logger.info(
+            f"Watchdog started | loop stall: {self.loop_stall * 1000:.0f}ms "
+            f"| handler: {self.thresholds['handler'] * 1000:.0f}ms | route: {self.thresholds['route'] * 1000:.0f}ms"
+        )
+
+    async def stop(self):
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+
+    def _loop_stack(self) -> List[str]:
+        return format_frames(sys._current_frames().get(self._loop_thread_id))
+
+    def _run(self):
+        while not self._stopping.wait(self.sample_interval):
+            try:
+                self._sample(time.monotonic())
+            except Exception as e:
+                logger.error(f"Watchdog sample failed: {e}")
+
+    def _sample(self, now: float):
+        # loop_lag wakes up at next_wakeup unless the loop is busy; it only runs once started
+        overdue = now - loop_lag.next_wakeup if loop_lag.next_wakeup else 0.0
+        stalled = overdue > self.loop_stall
+
+        if stalled and self._stall is None:
+            self._stall = {"since": loop_lag.next_wakeup, "stack": self._loop_stack()}
+        elif not stalled and self._stall is not None:
+            stall, self._stall = self._stall, None
+            self._loop.call_soon_threadsafe(self._finish_stall, stall, now)
+
+        running = asyncio.current_task(self._loop)
+        for operation in list(self._operations.values()):
+            if operation.stack is None and now - operation.started > operation.threshold:
+                if stalled and operation.task is running:
+                    operation.stack = self._loop_stack()
+                else:
+                    operation.stack = task_stack(operation.task)
+
+    def _finish_stall(self, stall: Dict[str, Any], ended: float):
+        duration = ended - stall["since"]
+        loop_stalls.inc()
+        loop_stall_seconds.observe(duration)
+        self.events.append({
+            "kind": "loop_stall",
+            "name": stall["stack"][-1] if stall["stack"] else None,
+            "charger_id": None,
+            "duration_ms": round(duration * 1000, 1),
+            "started_at": (datetime.now() - timedelta(seconds=time.monotonic() - stall["since"])).isoformat(),
+            "stack": stall["stack"],
+        })
+        logger.warning(f"Event loop blocked for {duration * 1000:.0f}ms at {stall['stack'][-1:]}")
+
+    def report(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "enabled": self.enabled,
+            "thresholds_ms": {
+                "loop_stall": self.loop_stall * 1000,
+                **{kind: threshold * 1000 for kind, threshold in self.thresholds.items()}
+            },
+            "loop_lag_ms": loop_lag.last_lag * 1000,
+            "running": [
+                {
+                    "kind": operation.kind,
+                    "name": operation.name,
+                    "charger_id": operation.charger_id,
+                    "elapsed_ms": round((now - operation.started) * 1000, 1),
+                }
+                for operation in self._operations.values()
+                if now - operation.started > operation.threshold
+            ],
+            "events": list(self.events)[::-1],
+        }
+
+    def clear(self):
+        self.events.clear()
+
+
+watchdog = Watchdog()
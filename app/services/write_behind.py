@@ -0,0 +1,349 @@
+"""
+Write-behind buffer for high-frequency OCPP state updates.
+
+Heartbeats, connector statuses and boot registrations are coalesced in
+memory, keeping only the latest value per charger / connector, while meter
+samples are appended. All of
+it is flushed in a single bulk transaction every WRITE_BEHIND_FLUSH_INTERVAL_MS
+or as soon as WRITE_BEHIND_MAX_ENTRIES entries are pending. Those two settings
+bound how much state can be lost if the process dies between flushes;
+WRITE_BEHIND_MAX_PENDING_SAMPLES caps memory while the database is unreachable.
+Work that needs a queued row to exist (the local list sync after a boot)
+awaits wait_for_flush().
+
+A batch failing with an OperationalError (database locked or unreachable) is
+put back and retried whole by the next flush. Any other error means some rows
+cannot be written (a constraint or foreign key violation): the batch is then
+written kind by kind, halving a failing part until the rows failing on their
+own are found. The others are written; a failing row is retried by the next
+flushes and dropped after WRITE_BEHIND_MAX_ROW_FAILURES failures, so it cannot
+hold back everything queued behind it.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple, Any
+
+from sqlalchemy.exc import InterfaceError, OperationalError
+
+from ..database.database import SessionLocal
+from ..database.repositories.repositories import (
+    ChargerRepository, ConnectorRepository, MeterSampleRepository
+)
+from .metrics import db_write_seconds, metrics
+
+logger = logging.getLogger("ocpp.write_behind")
+
+WRITE_BEHIND_FLUSH_INTERVAL_MS = int(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL_MS", "1000"))
+WRITE_BEHIND_MAX_ENTRIES = int(os.getenv("WRITE_BEHIND_MAX_ENTRIES", "500"))
+WRITE_BEHIND_MAX_PENDING_SAMPLES = int(os.getenv("WRITE_BEHIND_MAX_PENDING_SAMPLES", "100000"))
+WRITE_BEHIND_MAX_ROW_FAILURES = int(os.getenv("WRITE_BEHIND_MAX_ROW_FAILURES", "3"))
+
+ChargerKey = Tuple[str, str, str]
+ConnectorKey = Tuple[str, str, str, str]
+
+# Batch kinds, in the order they are written
+KINDS = ("boots", "heartbeats", "statuses", "samples")
+
+dropped_rows = metrics.counter(
+    "ocpp_write_behind_dropped_rows_total", "Buffered rows dropped after failing to be written", ["kind"])
+
+
+def _is_transient(error: Exception) -> bool:
+    """Whether a failed write may succeed unchanged later (database locked, unreachable or restarting)"""
+    return isinstance(error, (OperationalError, InterfaceError)) or getattr(error, "connection_invalidated", False)
+
+
+def _sample_key(sample: Dict[str, Any]) -> tuple:
+    return (
+        sample["MeterSampleSessionId"], sample["MeterSampleMeasurand"],
+        sample["MeterSamplePhase"], sample["MeterSampleTimestamp"]
+    )
+
+
+class WriteBehindBuffer:
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        flush_interval_ms: int = WRITE_BEHIND_FLUSH_INTERVAL_MS,
+        max_entries: int = WRITE_BEHIND_MAX_ENTRIES,
+        max_pending_samples: int = WRITE_BEHIND_MAX_PENDING_SAMPLES,
+        max_row_failures: int = WRITE_BEHIND_MAX_ROW_FAILURES
+    ):
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_entries = max_entries
+        self.max_pending_samples = max_pending_samples
+        self.max_row_failures = max(1, max_row_failures)
+
+        self._boots: Dict[ChargerKey, Dict[str, Any]] = {}
+        self._heartbeats: Dict[ChargerKey, datetime] = {}
+        self._connector_statuses: Dict[ConnectorKey, Tuple[str, datetime]] = {}
+        self._meter_samples: List[Dict[str, Any]] = []
+        self.dropped_samples = 0
+        # (kind, key) -> failed writes of a row isolated from its batch
+        self._row_failures: Dict[tuple, int] = {}
+
+        self._flush_requested = asyncio.Event()
+        # Set and replaced after every successful flush
+        self._flushed = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+        metrics.collector(
+            "ocpp_write_behind_pending", "Boots, heartbeats, connector statuses and meter samples awaiting a flush",
+            lambda: [((), self.pending())]
+        )
+        metrics.collector(
+            "ocpp_write_behind_dropped_samples_total", "Meter samples dropped while the backlog was full",
+            lambda: [((), self.dropped_samples)], kind="counter"
+        )
+
+    def record_boot(
+        self,
+        company_id: str,
+        site_id: str,
+        charger_id: str,
+        vendor: str,
+        model: str,
+        serial: Optional[str] = None,
+        firmware: Optional[str] = None,
+        timestamp: Optional[datetime] = None
+    ):
+        """Queue the registration of an accepted BootNotification, replacing any earlier one for the charger"""
+        self._boots[(company_id, site_id, charger_id)] = {
+            "vendor": vendor,
+            "model": model,
+            "serial": serial,
+            "firmware": firmware,
+            "booted": timestamp or datetime.now()
+        }
+        self._check_size()
+
+    def record_heartbeat(
+        self, company_id: str, site_id: str, charger_id: str, timestamp: Optional[datetime] = None
+    ):
+        """Queue a heartbeat, replacing any earlier one for the same charger"""
+        self._heartbeats[(company_id, site_id, charger_id)] = timestamp or datetime.now()
+        self._check_size()
+
+    def record_connector_status(
+        self,
+        company_id: str,
+        site_id: str,
+        charger_id: str,
+        connector_id: str,
+        status: str,
+        timestamp: Optional[datetime] = None
+    ):
+        """Queue a connector status, replacing any earlier one for the same connector"""
+        key = (company_id, site_id, charger_id, connector_id)
+        self._connector_statuses[key] = (status, timestamp or datetime.now())
+        self._check_size()
+
+    def record_meter_samples(self, session_id: int, samples: List[Dict[str, Any]]):
+        """Queue parsed meter samples (see app.services.meter_values) for a session"""
+        self._meter_samples.extend(
+            {
+                "MeterSampleSessionId": session_id,
+                "MeterSampleMeasurand": sample["measurand"],
+                "MeterSamplePhase": sample["phase"],
+                "MeterSampleTimestamp": sample["timestamp"],
+                "MeterSampleValue": sample["value"]
+            }
+            for sample in samples
+        )
+        self._trim_samples()
+        self._check_size()
+
+    def pending(self) -> int:
+        return len(self._boots) + len(self._heartbeats) + len(self._connector_statuses) + len(self._meter_samples)
+
+    def _trim_samples(self):
+        overflow = len(self._meter_samples) - self.max_pending_samples
+        if overflow > 0:
+            del self._meter_samples[:overflow]
+            self.dropped_samples += overflow
+            logger.warning(f"Write-behind sample backlog full, dropped {overflow} oldest meter samples")
+
+    async def wait_for_flush(self, timeout: Optional[float] = None):
+        """Wait until the next successful flush has written everything queued before the call"""
+        if self._task is None:
+            # Not running (scripts, shutdown), write it out now
+            await self.flush()
+            return
+        if self._flush_lock.locked():
+            # The running flush may have taken its batch before ours was queued
+            await asyncio.wait_for(self._flushed.wait(), timeout)
+        flushed = self._flushed
+        self._flush_requested.set()
+        await asyncio.wait_for(flushed.wait(), timeout)
+
+    def _check_size(self):
+        if self.pending() >= self.max_entries:
+            self._flush_requested.set()
+
+    async def start(self):
+        if self._task is None:
+            self._flush_requested = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+            logger.info(
+                f"Write-behind buffer started | interval: {self.flush_interval * 1000:.0f}ms "
+                f"| max entries: {self.max_entries}"
+            )
+
+    async def stop(self):
+        """Stop the periodic flush and write out everything still pending"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        logger.info("Write-behind buffer stopped")
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Write-behind flush failed: {e}", exc_info=True)
+
+    async def flush(self) -> int:
+        """Write all pending entries in one transaction and return how many were written"""
+        async with self._flush_lock:
+            batch = {
+                "boots": list(self._boots.items()),
+                "heartbeats": list(self._heartbeats.items()),
+                "statuses": list(self._connector_statuses.items()),
+                "samples": [(_sample_key(sample), sample) for sample in self._meter_samples],
+            }
+            self._boots, self._heartbeats, self._connector_statuses, self._meter_samples = {}, {}, {}, []
+            if not any(batch.values()):
+                self._signal_flushed()
+                return 0
+
+            try:
+                await self._write(**batch)
+                written = sum(len(items) for items in batch.values())
+            except Exception as e:
+                if _is_transient(e):
+                    for kind in KINDS:
+                        self._requeue(kind, batch[kind])
+                    raise
+                logger.warning(f"Write-behind flush failed ({e}), writing the batch in parts to find the failing rows")
+                written = 0
+                for position, kind in enumerate(KINDS):
+                    try:
+                        written += await self._write_part(kind, batch[kind])
+                    except Exception:
+                        # Transient: the failing part put itself back, so do the kinds not tried yet
+                        for later in KINDS[position + 1:]:
+                            self._requeue(later, batch[later])
+                        raise
+
+            logger.debug(
+                f"Write-behind flushed {len(batch['boots'])} boots, {len(batch['heartbeats'])} heartbeats, "
+                f"{len(batch['statuses'])} connector statuses and {len(batch['samples'])} meter samples"
+            )
+            self._signal_flushed()
+            return written
+
+    async def _write(self, boots=(), heartbeats=(), statuses=(), samples=()):
+        """Write (key, value) items of each kind in one transaction"""
+        async with db_write_seconds.time("write_behind_flush"), self.session_factory() as db:
+            async with db.begin():
+                # Registered first, so this batch's heartbeats find the new chargers
+                await ChargerRepository.bulk_register(db, [
+                    {"company_id": key[0], "site_id": key[1], "charger_id": key[2], **boot}
+                    for key, boot in boots
+                ])
+                await ChargerRepository.bulk_update_heartbeats(db, [
+                    {
+                        "company_id": key[0],
+                        "site_id": key[1],
+                        "charger_id": key[2],
+                        "heartbeat": heartbeat
+                    }
+                    for key, heartbeat in heartbeats
+                ])
+                await ConnectorRepository.bulk_upsert_statuses(db, [
+                    {
+                        "company_id": key[0],
+                        "site_id": key[1],
+                        "charger_id": key[2],
+                        "connector_id": key[3],
+                        "status": status,
+                        "updated": updated
+                    }
+                    for key, (status, updated) in statuses
+                ])
+                await MeterSampleRepository.bulk_insert(db, [sample for _, sample in samples])
+
+    async def _write_part(self, kind: str, items: List[tuple]) -> int:
+        """Write items of one kind, halving them on failure until the failing rows are isolated.
+
+        Returns how many were written; a transient error puts the unwritten items back and is raised.
+        """
+        if not items:
+            return 0
+        try:
+            await self._write(**{kind: items})
+        except Exception as e:
+            if _is_transient(e):
+                self._requeue(kind, items)
+                raise
+            if len(items) == 1:
+                self._reject(kind, items[0], e)
+                return 0
+            middle = len(items) // 2
+            try:
+                written = await self._write_part(kind, items[:middle])
+            except Exception:
+                self._requeue(kind, items[middle:])
+                raise
+            return written + await self._write_part(kind, items[middle:])
+        if self._row_failures:
+            for key, _ in items:
+                self._row_failures.pop((kind, key), None)
+        return len(items)
+
+    def _reject(self, kind: str, item: tuple, error: Exception):
+        """Retry a row that failed on its own in a later flush, or drop it once it failed too often"""
+        key = (kind, item[0])
+        failures = self._row_failures.get(key, 0) + 1
+        if failures < self.max_row_failures:
+            self._row_failures[key] = failures
+            logger.warning(f"Write-behind {kind} row {item[0]} failed ({failures}/{self.max_row_failures}): {error}")
+            self._requeue(kind, [item])
+            return
+        self._row_failures.pop(key, None)
+        dropped_rows.inc(kind)
+        logger.error(f"Dropping write-behind {kind} row {item[0]} after {failures} failures: {error}")
+
+    def _requeue(self, kind: str, items: List[tuple]):
+        """Put items back for the next flush, without overwriting anything newer queued meanwhile"""
+        if kind == "samples":
+            self._meter_samples[:0] = [sample for _, sample in items]
+            self._trim_samples()
+            return
+        buffer = {
+            "boots": self._boots, "heartbeats": self._heartbeats, "statuses": self._connector_statuses
+        }[kind]
+        for key, value in items:
+            buffer.setdefault(key, value)
+
+    def _signal_flushed(self):
+        flushed, self._flushed = self._flushed, asyncio.Event()
+        flushed.set()
+
+
+write_behind = WriteBehindBuffer()
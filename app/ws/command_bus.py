@@ -0,0 +1,301 @@
+"""
+Routing of Central System -> Charge Point commands to the owning worker.
+
+REST routes call command_bus.call(charge_point_id, "<method>_req", **kwargs).
+When the websocket is held by this worker the ChargePoint16 method is called
+directly; otherwise the command is forwarded to the owning worker, executed
+there and the call_result is rebuilt on this side. The transport follows
+CLUSTER_BACKEND (see app.ws.registry):
+
+- local: no forwarding, commands for other workers fail as not connected
+- unix: one socket per worker in COMMAND_SOCKET_DIR; without a shared
+  registry the owner is found by asking every worker on the host
+- redis: a request list per worker and a reply list per command
+"""
+import asyncio
+import glob
+import json
+import logging
+import os
+import uuid
+from dataclasses import asdict, is_dataclass
+from typing import Any, Dict, Optional
+
+from ocpp.v16 import call_result
+
+from ..services.task_supervisor import task_supervisor
+from .registry import CLUSTER_BACKEND, WORKER_ID, ConnectionRegistry, registry
+from .connection_manager import ConnectionManager, manager
+
+logger = logging.getLogger("ocpp.command_bus")
+
+COMMAND_TIMEOUT_SECONDS = float(os.getenv("COMMAND_TIMEOUT_SECONDS", "35"))
+COMMAND_SOCKET_DIR = os.getenv("COMMAND_SOCKET_DIR", "/tmp/ocpp-csms")
+# Requests and replies are single JSON lines; full local lists and
+# configurations are far beyond asyncio's 64 KiB line limit
+COMMAND_MAX_MESSAGE_BYTES = int(os.getenv("COMMAND_MAX_MESSAGE_BYTES", str(64 * 1024 * 1024)))
+
+
+class ChargePointNotConnected(Exception):
+    pass
+
+
+class CommandFailed(Exception):
+    pass
+
+
+def encode(value: Any):
+    """json.dumps default for the OCPP dataclasses passed as command arguments"""
+    if is_dataclass(value):
+        return asdict(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dump_response(response) -> Optional[Dict[str, Any]]:
+    # None is a CallError the charge point method suppressed
+    if response is None:
+        return None
+    return {"action": type(response).__name__, "payload": asdict(response)}
+
+
+def load_response(result: Optional[Dict[str, Any]]):
+    if result is None:
+        return None
+    return getattr(call_result, result["action"])(**result["payload"])
+
+
+class LocalCommandBus:
+    """Runs commands for charge points connected to this worker"""
+
+    def __init__(
+        self,
+        connections: ConnectionManager,
+        connection_registry: ConnectionRegistry,
+        worker_id: str = WORKER_ID,
+        timeout: float = COMMAND_TIMEOUT_SECONDS
+    ):
+        self.connections = connections
+        self.registry = connection_registry
+        self.worker_id = worker_id
+        self.timeout = timeout
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        await self.registry.unregister_worker(self.worker_id)
+
+    async def call(self, charge_point_id: str, method: str, **kwargs):
+        """Send a command to a charge point wherever it is connected and return its call_result"""
+        charge_point = self.connections.get_charge_points().get(charge_point_id)
+        if charge_point is not None:
+            return await getattr(charge_point, method)(**kwargs)
+        return await self._forward(charge_point_id, method, kwargs)
+
+    async def _forward(self, charge_point_id: str, method: str, kwargs: Dict[str, Any]):
+        raise ChargePointNotConnected(charge_point_id)
+
+    async def list_charge_points(self) -> Dict[str, str]:
+        """Return charge point id -> worker id for every connected charge point"""
+        return await self.registry.all()
+
+    async def _execute(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Run a forwarded command and build the reply sent back to the caller"""
+        charge_point = self.connections.get_charge_points().get(request["charge_point_id"])
+        if charge_point is None:
+            return {"error": "not_connected"}
+
+        method = request["method"]
+        if not method.endswith("_req") or not hasattr(charge_point, method):
+            return {"error": "failed", "detail": f"Unknown command {method}"}
+        try:
+            response = await getattr(charge_point, method)(**request["kwargs"])
+            return {"result": dump_response(response)}
+        except Exception as e:
+            logger.error(f"Forwarded {method} for {request['charge_point_id']} failed: {e}")
+            return {"error": "failed", "detail": str(e)}
+
+    def _reply_to_response(self, charge_point_id: str, reply: Dict[str, Any]):
+        if reply.get("error") == "not_connected":
+            raise ChargePointNotConnected(charge_point_id)
+        if "error" in reply:
+            raise CommandFailed(reply.get("detail", reply["error"]))
+        return load_response(reply["result"])
+
+
+class UnixSocketCommandBus(LocalCommandBus):
+    """Forwards commands between workers on one host over UNIX sockets"""
+
+    def __init__(self, *args, socket_dir: str = COMMAND_SOCKET_DIR, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.socket_dir = socket_dir
+        self.path = os.path.join(socket_dir, f"{self.worker_id}.sock")
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        os.makedirs(self.socket_dir, exist_ok=True)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(
+            self._handle, path=self.path, limit=COMMAND_MAX_MESSAGE_BYTES
+        )
+        logger.info(f"Command bus listening on {self.path}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        await super().stop()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = json.loads(await reader.readline())
+            if request.get("op") == "list":
+                reply = {"charge_points": {
+                    charge_point_id: self.worker_id
+                    for charge_point_id in self.connections.get_charge_points()
+                }}
+            else:
+                reply = await self._execute(request)
+            writer.write(json.dumps(reply, default=encode).encode() + b"\n")
+            await writer.drain()
+        except Exception as e:
+            logger.error(f"Command bus request failed: {e}")
+        finally:
+            writer.close()
+
+    def _peer_paths(self):
+        return [
+            path for path in glob.glob(os.path.join(self.socket_dir, "*.sock"))
+            if path != self.path
+        ]
+
+    async def _request(self, path: str, request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Send one request to a peer, or None if the peer is gone"""
+        try:
+            reader, writer = await asyncio.open_unix_connection(path, limit=COMMAND_MAX_MESSAGE_BYTES)
+        except (ConnectionRefusedError, FileNotFoundError):
+            return None
+        try:
+            writer.write(json.dumps(request, default=encode).encode() + b"\n")
+            await writer.drain()
+            line = await asyncio.wait_for(reader.readline(), timeout=self.timeout)
+            return json.loads(line) if line else None
+        finally:
+            writer.close()
+
+    async def _forward(self, charge_point_id: str, method: str, kwargs: Dict[str, Any]):
+        request = {"op": "call", "charge_point_id": charge_point_id, "method": method, "kwargs": kwargs}
+        owner = await self.registry.owner(charge_point_id) if self.registry.shared else None
+        paths = [os.path.join(self.socket_dir, f"{owner}.sock")] if owner else self._peer_paths()
+
+        for path in paths:
+            reply = await self._request(path, request)
+            if reply is None or reply.get("error") == "not_connected":
+                continue
+            return self._reply_to_response(charge_point_id, reply)
+        raise ChargePointNotConnected(charge_point_id)
+
+    async def list_charge_points(self) -> Dict[str, str]:
+        charge_points = await self.registry.all()
+        for path in self._peer_paths():
+            reply = await self._request(path, {"op": "list"})
+            if reply is not None:
+                charge_points.update(reply["charge_points"])
+        return charge_points
+
+
+class RedisCommandBus(LocalCommandBus):
+    """Forwards commands between workers and nodes through Redis lists"""
+
+    def __init__(self, client, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.client = client
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def queue_key(worker_id: str) -> str:
+        return f"ocpp:commands:{worker_id}"
+
+    @staticmethod
+    def reply_key(request_id: str) -> str:
+        return f"ocpp:replies:{request_id}"
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Command bus consuming {self.queue_key(self.worker_id)}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await super().stop()
+
+    async def _run(self):
+        while True:
+            try:
+                item = await self.client.blpop(self.queue_key(self.worker_id), timeout=1)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Command bus receive failed: {e}")
+                await asyncio.sleep(1)
+                continue
+            if item is not None:
+                request = json.loads(item[1])
+                if task_supervisor.spawn(
+                    request["charge_point_id"], "forwarded_command", self._serve, request
+                ) is None:
+                    # Answer at once rather than leaving the caller to time out
+                    await self._reply(request, {
+                        "error": "failed", "detail": f"Worker {self.worker_id} is too busy to run {request['method']}"
+                    })
+
+    async def _serve(self, request: Dict[str, Any]):
+        await self._reply(request, await self._execute(request))
+
+    async def _reply(self, request: Dict[str, Any], reply: Dict[str, Any]):
+        key = self.reply_key(request["request_id"])
+        await self.client.rpush(key, json.dumps(reply, default=encode))
+        await self.client.expire(key, int(self.timeout) + 1)
+
+    async def _forward(self, charge_point_id: str, method: str, kwargs: Dict[str, Any]):
+        owner = await self.registry.owner(charge_point_id)
+        if owner is None or owner == self.worker_id:
+            raise ChargePointNotConnected(charge_point_id)
+
+        request_id = str(uuid.uuid4())
+        await self.client.rpush(self.queue_key(owner), json.dumps({
+            "request_id": request_id,
+            "charge_point_id": charge_point_id,
+            "method": method,
+            "kwargs": kwargs
+        }, default=encode))
+
+        item = await self.client.blpop(self.reply_key(request_id), timeout=self.timeout)
+        if item is None:
+            raise asyncio.TimeoutError(f"No reply from worker {owner} for {method} on {charge_point_id}")
+        return self._reply_to_response(charge_point_id, json.loads(item[1]))
+
+
+def create_command_bus(
+    connections: ConnectionManager = manager,
+    connection_registry: ConnectionRegistry = registry,
+    backend: str = CLUSTER_BACKEND
+) -> LocalCommandBus:
+    if backend == "redis":
+        return RedisCommandBus(connection_registry.client, connections, connection_registry)
+    if backend == "unix":
+        return UnixSocketCommandBus(connections, connection_registry)
+    return LocalCommandBus(connections, connection_registry)
+
+
+command_bus = create_command_bus()
@@ -1,5 +1,8 @@
 from typing import Dict
 from app.services.ChargePoint16 import ChargePoint16
+from app.ws.registry import registry, WORKER_ID
+from app.services.metrics import metrics
+from collections import Counter
 import logging
 import time
 from datetime import datetime
@@ -10,20 +13,35 @@ class ConnectionManager:
     def __init__(self):
         self.active_connections: Dict[str, ChargePoint16] = {}
         self.connection_times: Dict[str, float] = {}
+        metrics.collector(
+            "ocpp_connected_chargers", "Charge points connected to this worker",
+            self.connected_by_site, labels=["company", "site"]
+        )
         logger.info(f"🚀 CONNECTION MANAGER INITIALIZED | Ready to accept connections")
 
     async def connect(self, charge_point_id: str, charge_point: ChargePoint16):
         connect_time = time.time()
         self.active_connections[charge_point_id] = charge_point
         self.connection_times[charge_point_id] = connect_time
+        # Let other workers route commands for this charge point here
+        try:
+            await registry.register(charge_point_id, WORKER_ID)
+        except Exception as e:
+            logger.error(f"❌ REGISTRY UPDATE FAILED | ID: {charge_point_id} | Error: {e}")
         
         formatted_time = datetime.fromtimestamp(connect_time).strftime('%Y-%m-%d %H:%M:%S')
         
         logger.info(f"🔌 CHARGE POINT CONNECTED | ID: {charge_point_id} | Time: {formatted_time}")
         logger.info(f"📊 ACTIVE CONNECTIONS: {len(self.active_connections)} | IDs: {list(self.active_connections.keys())}")
 
-    def disconnect(self, charge_point_id: str):
-        if charge_point_id in self.active_connections:
+    async def disconnect(self, charge_point_id: str, charge_point: ChargePoint16) -> bool:
+        """Remove a connection that ended; returns False when the charger has reconnected meanwhile"""
+        current = self.active_connections.get(charge_point_id)
+        if current is not None and current is not charge_point:
+            # Superseded by a newer connection of the same charger, which stays registered
+            logger.info(f"🔌 PREVIOUS CONNECTION CLOSED | ID: {charge_point_id}")
+            return False
+        if current is not None:
             connect_time = self.connection_times.get(charge_point_id, 0)
             disconnect_time = time.time()
             session_duration = disconnect_time - connect_time
@@ -31,15 +49,24 @@ class ConnectionManager:
             del self.active_connections[charge_point_id]
             if charge_point_id in self.connection_times:
                 del self.connection_times[charge_point_id]
+            try:
+                await registry.unregister(charge_point_id, WORKER_ID)
+            except Exception as e:
+                logger.error(f"❌ REGISTRY UPDATE FAILED | ID: {charge_point_id} | Error: {e}")
                 
             logger.info(f"🔌 CHARGE POINT DISCONNECTED | ID: {charge_point_id} | Duration: {session_duration:.2f} seconds")
             logger.info(f"📊 REMAINING CONNECTIONS: {len(self.active_connections)} | IDs: {list(self.active_connections.keys())}")
-        else:
-            logger.warning(f"⚠️ DISCONNECT CALLED FOR UNKNOWN CHARGE POINT | ID: {charge_point_id}")
+            return True
+        logger.warning(f"⚠️ DISCONNECT CALLED FOR UNKNOWN CHARGE POINT | ID: {charge_point_id}")
+        return False
 
     def get_charge_points(self):
         return self.active_connections
     
+    def connected_by_site(self):
+        counts = Counter((cp.company_id, cp.site_id) for cp in self.active_connections.values())
+        return list(counts.items())
+
     def get_connection_stats(self):
         stats = {}
         current_time = time.time()
@@ -0,0 +1,171 @@
+"""
+Registry of the worker that holds each charge point's websocket.
+
+CLUSTER_BACKEND selects the implementation:
+
+- local: in-memory, only this process sees its charge points (single worker)
+- unix: in-memory as well; workers on one host find each other through the
+  command bus sockets in COMMAND_SOCKET_DIR
+- redis: a hash at REDIS_URL shared by every worker and node
+
+The Redis backend only needs a handful of hash and list commands, so any
+client with the redis.asyncio interface works; InMemoryRedis stands in for a
+server in tests and single-process setups.
+"""
+import asyncio
+import logging
+import os
+import socket
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+logger = logging.getLogger("ocpp.registry")
+
+CLUSTER_BACKEND = os.getenv("CLUSTER_BACKEND", "local").lower()
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# HDEL KEYS[1] ARGV[1] if its value is still ARGV[2], atomically
+HDEL_IF_EQUAL = """
+if redis.call("HGET", KEYS[1], ARGV[1]) == ARGV[2] then
+    return redis.call("HDEL", KEYS[1], ARGV[1])
+end
+return 0
+"""
+
+
+class ConnectionRegistry:
+    """In-memory registry, only visible to this process"""
+    shared = False
+
+    def __init__(self):
+        self._owners: Dict[str, str] = {}
+
+    async def register(self, charge_point_id: str, worker_id: str = WORKER_ID):
+        self._owners[charge_point_id] = worker_id
+
+    async def unregister(self, charge_point_id: str, worker_id: str = WORKER_ID):
+        """Forget a charge point unless it has reconnected to another worker meanwhile"""
+        if self._owners.get(charge_point_id) == worker_id:
+            del self._owners[charge_point_id]
+
+    async def owner(self, charge_point_id: str) -> Optional[str]:
+        return self._owners.get(charge_point_id)
+
+    async def all(self) -> Dict[str, str]:
+        return dict(self._owners)
+
+    async def unregister_worker(self, worker_id: str = WORKER_ID):
+        for charge_point_id, owner in list((await self.all()).items()):
+            if owner == worker_id:
+                await self.unregister(charge_point_id, worker_id)
+
+
+class RedisRegistry(ConnectionRegistry):
+    """Registry kept in a Redis hash of charge point id -> worker id"""
+    shared = True
+
+    def __init__(self, client, key: str = "ocpp:connections"):
+        super().__init__()
+        self.client = client
+        self.key = key
+
+    async def register(self, charge_point_id: str, worker_id: str = WORKER_ID):
+        await self.client.hset(self.key, charge_point_id, worker_id)
+
+    async def unregister(self, charge_point_id: str, worker_id: str = WORKER_ID):
+        # A reconnect registering on another worker may land between a read and a delete
+        await self.client.eval(HDEL_IF_EQUAL, 1, self.key, charge_point_id, worker_id)
+
+    async def owner(self, charge_point_id: str) -> Optional[str]:
+        return await self.client.hget(self.key, charge_point_id)
+
+    async def all(self) -> Dict[str, str]:
+        return await self.client.hgetall(self.key)
+
+
+class InMemoryRedis:
+    """Stand-in for the subset of redis.asyncio.Redis used by the cluster backends"""
+
+    def __init__(self):
+        self._hashes: Dict[str, Dict[str, Any]] = {}
+        self._lists: Dict[str, List[Any]] = {}
+        self._changed = asyncio.Condition()
+
+    async def hset(self, name: str, key: str, value: Any) -> int:
+        values = self._hashes.setdefault(name, {})
+        created = key not in values
+        values[key] = value
+        return int(created)
+
+    async def hget(self, name: str, key: str) -> Optional[Any]:
+        return self._hashes.get(name, {}).get(key)
+
+    async def hdel(self, name: str, *keys: str) -> int:
+        values = self._hashes.get(name, {})
+        return sum(values.pop(key, None) is not None for key in keys)
+
+    async def hgetall(self, name: str) -> Dict[str, Any]:
+        return dict(self._hashes.get(name, {}))
+
+    async def eval(self, script: str, numkeys: int, *keys_and_args: Any) -> Any:
+        """Run one of this module's scripts; there is no Lua here"""
+        if script != HDEL_IF_EQUAL:
+            raise NotImplementedError("InMemoryRedis only runs the scripts of app.ws.registry")
+        name, key, value = keys_and_args
+        if self._hashes.get(name, {}).get(key) != value:
+            return 0
+        return await self.hdel(name, key)
+
+    async def rpush(self, name: str, *values: Any) -> int:
+        async with self._changed:
+            items = self._lists.setdefault(name, [])
+            items.extend(values)
+            self._changed.notify_all()
+            return len(items)
+
+    async def blpop(self, keys: Union[str, List[str]], timeout: float = 0) -> Optional[Tuple[str, Any]]:
+        keys = [keys] if isinstance(keys, str) else list(keys)
+
+        def pop():
+            for key in keys:
+                if self._lists.get(key):
+                    return key, self._lists[key].pop(0)
+            return None
+
+        async with self._changed:
+            try:
+                await asyncio.wait_for(
+                    self._changed.wait_for(lambda: any(self._lists.get(key) for key in keys)),
+                    timeout=timeout or None
+                )
+            except asyncio.TimeoutError:
+                return None
+            return pop()
+
+    async def expire(self, name: str, seconds: int) -> bool:
+        return name in self._lists or name in self._hashes
+
+    async def delete(self, *names: str) -> int:
+        deleted = 0
+        for name in names:
+            deleted += (self._lists.pop(name, None) is not None) + (self._hashes.pop(name, None) is not None)
+        return deleted
+
+
+def get_redis_client():
+    try:
+        import redis.asyncio as redis
+    except ImportError as e:
+        raise RuntimeError("CLUSTER_BACKEND=redis requires the redis package (pip install redis)") from e
+    return redis.from_url(REDIS_URL, decode_responses=True)
+
+
+def create_registry(backend: str = CLUSTER_BACKEND) -> ConnectionRegistry:
+    if backend == "redis":
+        return RedisRegistry(get_redis_client())
+    if backend not in ("local", "unix"):
+        raise ValueError(f"Unknown CLUSTER_BACKEND: {backend}")
+    return ConnectionRegistry()
+
+
+registry = create_registry()
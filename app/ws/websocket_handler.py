@@ -1,13 +1,18 @@
-from fastapi import WebSocket, WebSocketDisconnect, Depends
-from sqlalchemy.orm import Session
+from fastapi import WebSocket, WebSocketDisconnect
 from app.adapters.websocket_adapter import WebSocketAdapter
 from app.services.ChargePoint16 import ChargePoint16
+from app.services.boot_admission import boot_admission
+from app.services.charger_directory import charger_directory
+from app.services.command_jobs import command_jobs
+from app.services.heartbeats import heartbeat_scheduler
+from app.services.liveness import liveness
+from app.services.task_supervisor import task_supervisor
+from app.services.ocpp_service import OCPPService
+from app.services.schema_validation import schema_validation
 from app.ws.connection_manager import manager
-from app.database.database import get_db
-from app.database.repositories.repositories import ChargerRepository
-import logging
-import httpx
+from app.database.database import SessionLocal
 import asyncio
+import logging
 
 logger = logging.getLogger("ocpp-server")
 
@@ -17,41 +22,78 @@ async def websocket_endpoint(websocket: WebSocket, charge_point_id: str):
         logger.error(f"Client {charge_point_id} missing OCPP protocol.")
         return
 
+    # Closing before accept refuses the handshake with HTTP 403
+    entry = charger_directory.admit(charge_point_id)
+    if entry is None:
+        logger.warning(f"Refused connection from unknown or disabled charger {charge_point_id}")
+        await websocket.close(code=1008)
+        return
+
+    cp = None
+    silent = False
+    current = False
     try:
         await websocket.accept(subprotocol="ocpp1.6")
         logger.info(f"Accepted OCPP 1.6 connection from {charge_point_id}")
-        adapter = WebSocketAdapter(websocket)
+        adapter = WebSocketAdapter(websocket, charge_point_id)
         cp = ChargePoint16(charge_point_id, adapter)
+        cp.validation_mode = schema_validation.mode_for(charge_point_id, entry.schema_validation)
         await manager.connect(charge_point_id, cp)
         
-        # Update charger status in the database (async)
-        asyncio.create_task(update_charger_connection_status(charge_point_id, True))
+        # Update charger status in the database, a disconnect supersedes a connect not yet written
+        task_supervisor.spawn(
+            charge_point_id, "connection_status", update_charger_connection_status,
+            charge_point_id, True, entry.company_id, entry.site_id, retries=3, coalesce=True
+        )
+        # Send the commands queued while it was offline
+        command_jobs.deliver(charge_point_id)
+        # A charger reconnecting without a boot keeps an interval we may not have given it
+        heartbeat_scheduler.track(cp)
         
-        await cp.start()
+        # Run the receive loop as a task the liveness sweep can cancel when the charger goes silent
+        receiving = asyncio.create_task(cp.start())
+        liveness.watch(cp, receiving.cancel)
+        try:
+            await asyncio.wait([receiving])
+        finally:
+            receiving.cancel()
+        if receiving.cancelled():
+            if manager.get_charge_points().get(charge_point_id) is cp:
+                logger.warning(f"Charge point {charge_point_id} went silent, closing its connection")
+            else:
+                logger.info(f"Charge point {charge_point_id} reconnected, closing its previous connection")
+            try:
+                await asyncio.wait_for(websocket.close(code=1001), 5)
+            except Exception:
+                pass
+        else:
+            receiving.result()
 
     except WebSocketDisconnect:
         logger.info(f"Charge point {charge_point_id} disconnected")
     except Exception as e:
         logger.error(f"Error with charge point {charge_point_id}: {e}", exc_info=True)
     finally:
-        manager.disconnect(charge_point_id)
-        # Update charger status in the database (async)
-        asyncio.create_task(update_charger_connection_status(charge_point_id, False))
-
-async def update_charger_connection_status(charge_point_id: str, connected: bool):
-    """Update charger connection status in the database using the API endpoint"""
-    try:
-        status = "Available" if connected else "Unavailable"
-        is_online = connected
-        
-        # Use httpx to call our own API endpoint
-        async with httpx.AsyncClient() as client:
-            response = await client.put(
-                f"http://localhost:8000/db/companies/DEF01/sites/MAIN/chargers/{charge_point_id}/status",
-                params={"status": status, "is_online": is_online}
+        if cp is not None:
+            silent = liveness.unwatch(cp)
+            current = await manager.disconnect(charge_point_id, cp)
+        # A connection superseded by a reconnect leaves the charger's state to the new one
+        if current:
+            boot_admission.forget(charge_point_id)
+            heartbeat_scheduler.forget(charge_point_id)
+        # Update charger status in the database, silent chargers are marked offline by the liveness sweep
+        if current and not silent:
+            task_supervisor.spawn(
+                charge_point_id, "connection_status", update_charger_connection_status,
+                charge_point_id, False, entry.company_id, entry.site_id, retries=3, coalesce=True
             )
-            
-            if response.status_code != 200:
-                logger.warning(f"Failed to update charger status: {response.text}")
-    except Exception as e:
-        logger.error(f"Error updating charger connection status: {e}", exc_info=True)
\ No newline at end of file
+
+async def update_charger_connection_status(charge_point_id: str, connected: bool, company_id: str, site_id: str):
+    """Update charger connection status in the database (run by task_supervisor, which logs failures)"""
+    async with SessionLocal() as db:
+        charger = await OCPPService.update_charger_connection_status(
+            db, charge_point_id, connected, company_id, site_id
+        )
+
+    if not charger:
+        logger.warning(f"Failed to update charger status: charger {charge_point_id} not found")
@@ -0,0 +1,453 @@
+"""
+OCPP 1.6 Load Test
+
+Runs a fleet of simulated charge points against a Central System to measure
+its message handling capacity. Every charger boots, reports its connectors,
+heartbeats at a fixed interval and starts sessions on each connector at a
+Poisson arrival rate; running sessions send MeterValues at a fixed cadence.
+Round-trip latency of every request is recorded per action and the results
+are written as a JSON report so runs can be compared over time.
+
+Example:
+    python load_test.py --url ws://localhost:8000/ocpp --chargers 2000 \\
+        --processes 4 --duration 300 --report load_report.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import random
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import websockets
+
+from charge_point_simulator import ChargePointSimulator
+
+logger = logging.getLogger("cp.load_test")
+
+# Latency bucket upper bounds in milliseconds, 25% apart from 0.1ms to ~70s
+BUCKET_BOUNDS_MS = [round(0.1 * 1.25 ** i, 3) for i in range(61)]
+
+
+class LatencyHistogram:
+    """Bucketed round-trip latencies of one action"""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.total_ms = 0.0
+        self.min_ms = math.inf
+        self.max_ms = 0.0
+
+    def record(self, latency_ms):
+        index = next((i for i, bound in enumerate(BUCKET_BOUNDS_MS) if latency_ms <= bound), len(BUCKET_BOUNDS_MS))
+        self.buckets[index] += 1
+        self.count += 1
+        self.total_ms += latency_ms
+        self.min_ms = min(self.min_ms, latency_ms)
+        self.max_ms = max(self.max_ms, latency_ms)
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of samples, capped at the maximum"""
+        if not self.count:
+            return None
+        threshold = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= threshold:
+                return min(BUCKET_BOUNDS_MS[index], self.max_ms) if index < len(BUCKET_BOUNDS_MS) else self.max_ms
+        return self.max_ms
+
+    def merge(self, other):
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+        self.count += other.count
+        self.errors += other.errors
+        self.timeouts += other.timeouts
+        self.total_ms += other.total_ms
+        self.min_ms = min(self.min_ms, other.min_ms)
+        self.max_ms = max(self.max_ms, other.max_ms)
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "min_ms": self.min_ms if self.count else None,
+            "mean_ms": self.total_ms / self.count if self.count else None,
+            "p50_ms": self.percentile(0.50),
+            "p90_ms": self.percentile(0.90),
+            "p99_ms": self.percentile(0.99),
+            "p999_ms": self.percentile(0.999),
+            "max_ms": self.max_ms if self.count else None,
+            "buckets": [
+                [BUCKET_BOUNDS_MS[i] if i < len(BUCKET_BOUNDS_MS) else None, count]
+                for i, count in enumerate(self.buckets) if count
+            ],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls()
+        for bound, count in data["buckets"]:
+            index = BUCKET_BOUNDS_MS.index(bound) if bound is not None else len(BUCKET_BOUNDS_MS)
+            histogram.buckets[index] = count
+        histogram.count = data["count"]
+        histogram.errors = data["errors"]
+        histogram.timeouts = data["timeouts"]
+        histogram.total_ms = (data["mean_ms"] or 0) * data["count"]
+        histogram.min_ms = data["min_ms"] if data["min_ms"] is not None else math.inf
+        histogram.max_ms = data["max_ms"] or 0.0
+        return histogram
+
+
+class LoadStats:
+    """Latency histograms per action plus connection counters"""
+
+    def __init__(self):
+        self.actions = {}
+        self.connected = 0
+        self.connect_failures = 0
+        self.disconnects = 0
+        self.sessions_started = 0
+        self.sessions_completed = 0
+
+    def histogram(self, action):
+        if action not in self.actions:
+            self.actions[action] = LatencyHistogram()
+        return self.actions[action]
+
+    def merge(self, other):
+        for action, histogram in other.actions.items():
+            self.histogram(action).merge(histogram)
+        self.connected += other.connected
+        self.connect_failures += other.connect_failures
+        self.disconnects += other.disconnects
+        self.sessions_started += other.sessions_started
+        self.sessions_completed += other.sessions_completed
+
+    def to_dict(self):
+        return {
+            "chargers": {
+                "connected": self.connected,
+                "connect_failures": self.connect_failures,
+                "disconnects": self.disconnects,
+            },
+            "sessions": {
+                "started": self.sessions_started,
+                "completed": self.sessions_completed,
+            },
+            "actions": {action: histogram.to_dict() for action, histogram in sorted(self.actions.items())},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.connected = data["chargers"]["connected"]
+        stats.connect_failures = data["chargers"]["connect_failures"]
+        stats.disconnects = data["chargers"]["disconnects"]
+        stats.sessions_started = data["sessions"]["started"]
+        stats.sessions_completed = data["sessions"]["completed"]
+        for action, histogram in data["actions"].items():
+            stats.actions[action] = LatencyHistogram.from_dict(histogram)
+        return stats
+
+
+class LoadTestChargePoint(ChargePointSimulator):
+    """
+    Simulated charge point that waits for each response and records its latency
+    """
+    def __init__(self, cp_id, csms_url, connector_count, options, stats, rng):
+        super().__init__(cp_id, csms_url, connector_count)
+        self.options = options
+        self.stats = stats
+        self.rng = rng
+        self.pending = {}
+        self.meter = {connector_id: 0 for connector_id in range(1, connector_count + 1)}
+
+    async def call(self, action, payload):
+        """Send a request and return the response payload, or None on error or timeout"""
+        if self.connection_closed:
+            return None
+        message_id = str(uuid.uuid4())
+        future = asyncio.get_running_loop().create_future()
+        self.pending[message_id] = future
+        started = time.perf_counter()
+        histogram = self.stats.histogram(action)
+        try:
+            await self.websocket.send(json.dumps([2, message_id, action, payload]))
+            message_type_id, response = await asyncio.wait_for(future, timeout=self.options.timeout)
+        except asyncio.TimeoutError:
+            histogram.timeouts += 1
+            return None
+        except Exception:
+            histogram.errors += 1
+            self.connection_closed = True
+            return None
+        finally:
+            self.pending.pop(message_id, None)
+
+        if message_type_id == 4:
+            histogram.errors += 1
+            return None
+        histogram.record((time.perf_counter() - started) * 1000)
+        return response
+
+    async def receive_messages(self):
+        try:
+            async for message in self.websocket:
+                await self.handle_message(message)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            self.connection_closed = True
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Connection closed"))
+
+    async def handle_call(self, unique_id, action, payload):
+        # Answer the local list sync the server sends after BootNotification
+        if action == "SendLocalList":
+            await self.websocket.send(json.dumps([3, unique_id, {"status": "Accepted"}]))
+        elif action == "GetLocalListVersion":
+            await self.websocket.send(json.dumps([3, unique_id, {"listVersion": 0}]))
+        else:
+            await super().handle_call(unique_id, action, payload)
+
+    async def handle_message(self, message):
+        parsed_message = json.loads(message)
+        if parsed_message[0] == 2:
+            await self.handle_call(parsed_message[1], parsed_message[2], parsed_message[3])
+            return
+        future = self.pending.get(parsed_message[1])
+        if future is not None and not future.done():
+            future.set_result((parsed_message[0], parsed_message[2] if parsed_message[0] == 3 else parsed_message))
+
+    async def run(self, deadline):
+        connected = False
+        started = time.perf_counter()
+        try:
+            connected = await self.connect()
+        finally:
+            if not connected:
+                self.stats.connect_failures += 1
+        if not connected:
+            return
+        self.stats.connected += 1
+        self.stats.histogram("Connect").record((time.perf_counter() - started) * 1000)
+
+        receive_task = asyncio.create_task(self.receive_messages())
+        try:
+            await self.call("BootNotification", {
+                "chargePointVendor": "LoadTest",
+                "chargePointModel": "Simulated",
+                "chargePointSerialNumber": f"{self.cp_id}-SN",
+                "firmwareVersion": "1.0.0"
+            })
+            for connector_id in range(1, self.connector_count + 1):
+                await self.status(connector_id, "Available")
+
+            tasks = [asyncio.create_task(self.heartbeat_loop(deadline))]
+            tasks += [
+                asyncio.create_task(self.connector_loop(connector_id, deadline))
+                for connector_id in range(1, self.connector_count + 1)
+            ]
+            await asyncio.gather(*tasks)
+        finally:
+            if self.connection_closed:
+                self.stats.disconnects += 1
+            self.connection_closed = True
+            await self.websocket.close()
+            receive_task.cancel()
+
+    async def sleep_until(self, delay, deadline):
+        """Sleep for delay seconds, returning False if the test ends first"""
+        remaining = deadline - time.monotonic()
+        await asyncio.sleep(max(0.0, min(delay, remaining)))
+        return delay < remaining and not self.connection_closed
+
+    async def heartbeat_loop(self, deadline):
+        # Spread heartbeats instead of having the whole fleet beat in step
+        offset = self.rng.uniform(0, self.options.heartbeat_interval)
+        while await self.sleep_until(offset, deadline):
+            await self.call("Heartbeat", {})
+            offset = self.options.heartbeat_interval
+
+    async def status(self, connector_id, status):
+        await self.call("StatusNotification", {
+            "connectorId": connector_id,
+            "errorCode": "NoError",
+            "status": status,
+            "timestamp": datetime.utcnow().isoformat() + "Z"
+        })
+
+    async def connector_loop(self, connector_id, deadline):
+        rate_per_second = self.options.session_rate / 3600
+        if rate_per_second <= 0:
+            return
+        id_tag = self.options.id_tag
+        while await self.sleep_until(self.rng.expovariate(rate_per_second), deadline):
+            await self.call("Authorize", {"idTag": id_tag})
+            await self.status(connector_id, "Preparing")
+            response = await self.call("StartTransaction", {
+                "connectorId": connector_id,
+                "idTag": id_tag,
+                "meterStart": self.meter[connector_id],
+                "timestamp": datetime.utcnow().isoformat() + "Z"
+            })
+            if not response or "transactionId" not in response:
+                continue
+            transaction_id = response["transactionId"]
+            self.stats.sessions_started += 1
+            await self.status(connector_id, "Charging")
+
+            # Charge for an exponentially distributed time, reporting the register
+            session_end = time.monotonic() + self.rng.expovariate(1 / self.options.session_duration)
+            ended = False
+            while not ended:
+                interval = min(self.options.meter_interval, session_end - time.monotonic())
+                ended = not await self.sleep_until(max(interval, 0.0), min(deadline, session_end))
+                self.meter[connector_id] += int(self.options.power_w * max(interval, 0.0) / 3600)
+                if ended:
+                    break
+                await self.call("MeterValues", {
+                    "connectorId": connector_id,
+                    "transactionId": transaction_id,
+                    "meterValue": [{
+                        "timestamp": datetime.utcnow().isoformat() + "Z",
+                        "sampledValue": [
+                            {"value": str(self.meter[connector_id]), "measurand": "Energy.Active.Import.Register", "unit": "Wh"},
+                            {"value": f"{self.options.power_w / 230:.1f}", "measurand": "Current.Import", "unit": "A"},
+                            {"value": "230", "measurand": "Voltage", "unit": "V"}
+                        ]
+                    }]
+                })
+
+            if self.connection_closed:
+                return
+            await self.call("StopTransaction", {
+                "transactionId": transaction_id,
+                "idTag": id_tag,
+                "meterStop": self.meter[connector_id],
+                "timestamp": datetime.utcnow().isoformat() + "Z",
+                "reason": "Local"
+            })
+            self.stats.sessions_completed += 1
+            await self.status(connector_id, "Finishing")
+            await self.status(connector_id, "Available")
+
+
+async def run_fleet(options, charger_ids):
+    """Run the given chargers until the test duration is over and return their stats"""
+    stats = LoadStats()
+    rng = random.Random(f"{options.seed}-{charger_ids[0] if charger_ids else ''}")
+    start = time.monotonic()
+    deadline = start + options.ramp_up + options.duration
+
+    async def run_one(index, cp_id):
+        # Ramp up linearly so the server is not hit by every connect at once
+        await asyncio.sleep(options.ramp_up * index / max(len(charger_ids), 1))
+        charge_point = LoadTestChargePoint(
+            cp_id, options.url, options.connectors, options, stats, random.Random(rng.random())
+        )
+        try:
+            await charge_point.run(deadline)
+        except Exception as e:
+            logger.error(f"{cp_id} failed: {e}")
+
+    await asyncio.gather(*(run_one(index, cp_id) for index, cp_id in enumerate(charger_ids)))
+    return stats
+
+
+def run_fleet_in_process(options, charger_ids):
+    logging.getLogger("cp.simulator").setLevel(logging.CRITICAL)
+    return asyncio.run(run_fleet(options, charger_ids)).to_dict()
+
+
+def build_report(options, stats, started_at, elapsed):
+    report = stats.to_dict()
+    completed = sum(histogram.count for action, histogram in stats.actions.items() if action != "Connect")
+    report.update({
+        "started_at": started_at.isoformat() + "Z",
+        "elapsed_seconds": elapsed,
+        "config": {
+            key: value for key, value in vars(options).items() if key not in ("report",)
+        },
+        "messages": {
+            "completed": completed,
+            "errors": sum(histogram.errors for histogram in stats.actions.values()),
+            "timeouts": sum(histogram.timeouts for histogram in stats.actions.values()),
+            "throughput_per_second": completed / elapsed if elapsed else None,
+        },
+    })
+    return report
+
+
+def print_summary(report):
+    print(f"\nChargers connected: {report['chargers']['connected']} "
+          f"(failed: {report['chargers']['connect_failures']}, dropped: {report['chargers']['disconnects']})")
+    print(f"Sessions started/completed: {report['sessions']['started']}/{report['sessions']['completed']}")
+    print(f"Messages: {report['messages']['completed']} in {report['elapsed_seconds']:.1f}s "
+          f"= {report['messages']['throughput_per_second']:.1f}/s "
+          f"(errors: {report['messages']['errors']}, timeouts: {report['messages']['timeouts']})\n")
+    print(f"{'Action':<20}{'count':>9}{'mean ms':>10}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>10}")
+    for action, data in report["actions"].items():
+        if not data["count"]:
+            continue
+        print(f"{action:<20}{data['count']:>9}{data['mean_ms']:>10.2f}{data['p50_ms']:>9.2f}"
+              f"{data['p90_ms']:>9.2f}{data['p99_ms']:>9.2f}{data['max_ms']:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='OCPP 1.6 Load Test')
+    parser.add_argument('--url', type=str, default='ws://localhost:8000/ocpp', help='CSMS WebSocket URL')
+    parser.add_argument('--chargers', type=int, default=100, help='Number of simulated charge points')
+    parser.add_argument('--prefix', type=str, default='LOAD', help='Charge point id prefix')
+    parser.add_argument('--connectors', type=int, default=2, help='Connectors per charge point')
+    parser.add_argument('--processes', type=int, default=1, help='Worker processes to spread the chargers over')
+    parser.add_argument('--duration', type=float, default=60, help='Test duration in seconds after ramp-up')
+    parser.add_argument('--ramp-up', type=float, default=10, help='Seconds over which chargers connect')
+    parser.add_argument('--heartbeat-interval', type=float, default=60, help='Heartbeat interval in seconds')
+    parser.add_argument('--session-rate', type=float, default=6, help='Session arrivals per connector per hour')
+    parser.add_argument('--session-duration', type=float, default=600, help='Mean session duration in seconds')
+    parser.add_argument('--meter-interval', type=float, default=30, help='MeterValues interval in seconds')
+    parser.add_argument('--power-w', type=float, default=11000, help='Simulated charging power in W')
+    parser.add_argument('--id-tag', type=str, default='RFID1234567890', help='Id tag used for sessions')
+    parser.add_argument('--timeout', type=float, default=30, help='Response timeout in seconds')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed')
+    parser.add_argument('--report', type=str, default='load_report.json', help='Path of the JSON report')
+    options = parser.parse_args()
+
+    logging.getLogger("cp.simulator").setLevel(logging.CRITICAL)
+    charger_ids = [f"{options.prefix}{index:05d}" for index in range(options.chargers)]
+    started_at = datetime.utcnow()
+    start = time.perf_counter()
+
+    stats = LoadStats()
+    if options.processes > 1:
+        slices = [charger_ids[index::options.processes] for index in range(options.processes)]
+        with ProcessPoolExecutor(max_workers=options.processes) as pool:
+            for result in pool.map(run_fleet_in_process, [options] * len(slices), slices):
+                stats.merge(LoadStats.from_dict(result))
+    else:
+        stats = asyncio.run(run_fleet(options, charger_ids))
+
+    report = build_report(options, stats, started_at, time.perf_counter() - start)
+    with open(options.report, "w") as report_file:
+        json.dump(report, report_file, indent=2)
+    print_summary(report)
+    print(f"\nReport written to {options.report}")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(1)
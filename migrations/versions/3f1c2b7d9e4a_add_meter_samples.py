@@ -0,0 +1,39 @@
+"""Add meter samples time-series table
+
+Revision ID: 3f1c2b7d9e4a
+Revises: a49478984503
+Create Date: 2026-10-17 09:12:40.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1c2b7d9e4a'
+down_revision: Union[str, None] = 'a49478984503'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('MeterSamples',
+    sa.Column('MeterSampleId', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), autoincrement=True, nullable=False),
+    sa.Column('MeterSampleSessionId', sa.Integer(), nullable=False),
+    sa.Column('MeterSampleMeasurand', sa.SmallInteger(), nullable=False),
+    sa.Column('MeterSamplePhase', sa.SmallInteger(), nullable=True),
+    sa.Column('MeterSampleTimestamp', sa.DateTime(), nullable=False),
+    sa.Column('MeterSampleValue', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['MeterSampleSessionId'], ['ChargeSessions.ChargeSessionId'], ),
+    sa.PrimaryKeyConstraint('MeterSampleId')
+    )
+    op.create_index('ix_MeterSamples_Session_Timestamp', 'MeterSamples', ['MeterSampleSessionId', 'MeterSampleTimestamp'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_MeterSamples_Session_Timestamp', table_name='MeterSamples')
+    op.drop_table('MeterSamples')
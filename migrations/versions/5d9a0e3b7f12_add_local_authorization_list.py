@@ -0,0 +1,43 @@
+"""Add local authorization list
+
+Revision ID: 5d9a0e3b7f12
+Revises: c81d4f2a6b37
+Create Date: 2026-10-17 12:41:37.916205
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d9a0e3b7f12'
+down_revision: Union[str, None] = 'c81d4f2a6b37'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('LocalListEntries',
+    sa.Column('LocalListEntryCompanyId', sa.String(length=5), nullable=False),
+    sa.Column('LocalListEntryIdTag', sa.String(length=20), nullable=False),
+    sa.Column('LocalListEntryStatus', sa.String(length=20), nullable=True),
+    sa.Column('LocalListEntryExpiryDate', sa.DateTime(), nullable=True),
+    sa.Column('LocalListEntryParentIdTag', sa.String(length=20), nullable=True),
+    sa.Column('LocalListEntryVersion', sa.Integer(), nullable=False),
+    sa.Column('LocalListEntryUpdated', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['LocalListEntryCompanyId'], ['Companies.CompanyId'], ),
+    sa.PrimaryKeyConstraint('LocalListEntryCompanyId', 'LocalListEntryIdTag')
+    )
+    op.create_index('ix_LocalListEntries_Company_Version', 'LocalListEntries', ['LocalListEntryCompanyId', 'LocalListEntryVersion'], unique=False)
+    op.add_column('Chargers', sa.Column('ChargerLocalListVersion', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('Chargers') as batch_op:
+        batch_op.drop_column('ChargerLocalListVersion')
+    op.drop_index('ix_LocalListEntries_Company_Version', table_name='LocalListEntries')
+    op.drop_table('LocalListEntries')
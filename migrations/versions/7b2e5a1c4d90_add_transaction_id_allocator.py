@@ -0,0 +1,38 @@
+"""Add transaction id allocator and session transaction ids
+
+Revision ID: 7b2e5a1c4d90
+Revises: 3f1c2b7d9e4a
+Create Date: 2026-10-17 10:03:51.442917
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7b2e5a1c4d90'
+down_revision: Union[str, None] = '3f1c2b7d9e4a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('IdBlocks',
+    sa.Column('IdBlockName', sa.String(length=30), nullable=False),
+    sa.Column('IdBlockNextHi', sa.BigInteger(), nullable=False),
+    sa.Column('IdBlockUpdated', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('IdBlockName')
+    )
+    op.add_column('ChargeSessions', sa.Column('ChargerSessionTransactionId', sa.Integer(), nullable=True))
+    op.create_index(op.f('ix_ChargeSessions_ChargerSessionTransactionId'), 'ChargeSessions', ['ChargerSessionTransactionId'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_ChargeSessions_ChargerSessionTransactionId'), table_name='ChargeSessions')
+    with op.batch_alter_table('ChargeSessions') as batch_op:
+        batch_op.drop_column('ChargerSessionTransactionId')
+    op.drop_table('IdBlocks')
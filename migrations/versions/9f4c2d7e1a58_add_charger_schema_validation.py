@@ -0,0 +1,29 @@
+"""Add charger schema validation mode
+
+Revision ID: 9f4c2d7e1a58
+Revises: 5d9a0e3b7f12
+Create Date: 2026-10-17 14:05:12.384920
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9f4c2d7e1a58'
+down_revision: Union[str, None] = '5d9a0e3b7f12'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('Chargers', sa.Column('ChargerSchemaValidation', sa.String(length=10), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('Chargers') as batch_op:
+        batch_op.drop_column('ChargerSchemaValidation')
@@ -0,0 +1,34 @@
+"""Add partial index on open charge sessions
+
+Revision ID: c81d4f2a6b37
+Revises: 7b2e5a1c4d90
+Create Date: 2026-10-17 11:20:14.508316
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c81d4f2a6b37'
+down_revision: Union[str, None] = '7b2e5a1c4d90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        'ix_ChargeSessions_Open', 'ChargeSessions',
+        ['ChargerSessionCompanyId', 'ChargerSessionSiteId', 'ChargerSessionChargerId', 'ChargerSessionConnectorId'],
+        unique=False,
+        postgresql_where=sa.text('"ChargerSessionEnd" IS NULL'),
+        sqlite_where=sa.text('"ChargerSessionEnd" IS NULL')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_ChargeSessions_Open', table_name='ChargeSessions')
@@ -0,0 +1,46 @@
+"""Add command jobs
+
+Revision ID: e2b8c4f6a913
+Revises: 9f4c2d7e1a58
+Create Date: 2026-10-17 16:22:48.517306
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2b8c4f6a913'
+down_revision: Union[str, None] = '9f4c2d7e1a58'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('CommandJobs',
+    sa.Column('CommandJobId', sa.String(length=36), nullable=False),
+    sa.Column('CommandJobChargerId', sa.String(length=10), nullable=False),
+    sa.Column('CommandJobCommand', sa.String(length=40), nullable=False),
+    sa.Column('CommandJobParams', sa.Text(), nullable=True),
+    sa.Column('CommandJobStatus', sa.String(length=10), nullable=False),
+    sa.Column('CommandJobResult', sa.Text(), nullable=True),
+    sa.Column('CommandJobError', sa.Text(), nullable=True),
+    sa.Column('CommandJobAttempts', sa.Integer(), nullable=False),
+    sa.Column('CommandJobCreated', sa.DateTime(), nullable=False),
+    sa.Column('CommandJobExpiresAt', sa.DateTime(), nullable=False),
+    sa.Column('CommandJobStarted', sa.DateTime(), nullable=True),
+    sa.Column('CommandJobCompleted', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('CommandJobId')
+    )
+    op.create_index('ix_CommandJobs_Charger_Status', 'CommandJobs', ['CommandJobChargerId', 'CommandJobStatus', 'CommandJobCreated'], unique=False)
+    op.create_index('ix_CommandJobs_Status_ExpiresAt', 'CommandJobs', ['CommandJobStatus', 'CommandJobExpiresAt'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_CommandJobs_Status_ExpiresAt', table_name='CommandJobs')
+    op.drop_index('ix_CommandJobs_Charger_Status', table_name='CommandJobs')
+    op.drop_table('CommandJobs')
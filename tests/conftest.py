@@ -0,0 +1,46 @@
+"""
+Shared fixtures.
+
+The engine in app.database.database is created from DATABASE_URL when it is
+first imported, so it is pointed at a throwaway SQLite file here, before any
+test module imports the app. Tests are plain functions running their
+coroutines with the run fixture, one event loop per call.
+"""
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+_DATABASE_DIR = tempfile.mkdtemp(prefix="ocpp-csms-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_DATABASE_DIR, 'test.db')}"
+os.environ.pop("ASYNC_DATABASE_URL", None)
+
+
+@pytest.fixture
+def run():
+    """Run a coroutine on a new event loop and release the engine's connections after it"""
+    from app.database.database import engine
+
+    def runner(coroutine):
+        async def wrapper():
+            try:
+                return await coroutine
+            finally:
+                # aiosqlite connections belong to the loop that opened them
+                await engine.dispose()
+        return asyncio.run(wrapper())
+    return runner
+
+
+@pytest.fixture
+def database(run):
+    """Empty tables for one test"""
+    from app.database.database import Base, engine
+    from app.database.models import models  # noqa: F401, registers the tables
+
+    async def reset():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(Base.metadata.create_all)
+    run(reset())
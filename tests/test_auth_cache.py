@@ -0,0 +1,199 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from ocpp.v16.enums import AuthorizationStatus
+from sqlalchemy import update
+
+from app.database.database import SessionLocal
+from app.database.models.models import Driver, DriversGroup, RFIDCard
+from app.database.repositories.repositories import RFIDCardRepository
+from app.services import auth_cache
+from app.services.auth_cache import AuthorizationCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+async def add_cards(*id_tags, group_enabled=True, expiry=None):
+    async with SessionLocal() as db:
+        db.add(DriversGroup(DriversGroupId="G1", DriversGroupEnabled=group_enabled))
+        db.add(Driver(DriverCompanyId="C1", DriverId="D1", DriverFullName="d", DriverGroupId="G1"))
+        for id_tag in id_tags:
+            db.add(RFIDCard(RFIDCardCompanyId="C1", RFIDCardDriverId="D1", RFIDCardId=id_tag, RFIDCardExpiration=expiry))
+        await db.commit()
+
+
+async def disable_card(id_tag):
+    async with SessionLocal() as db:
+        await db.execute(update(RFIDCard).where(RFIDCard.RFIDCardId == id_tag).values(RFIDCardEnabled=False))
+        await db.commit()
+
+
+def test_answers_follow_card_driver_and_group(database, run):
+    async def scenario():
+        await add_cards("T1", group_enabled=False)
+        cache = AuthorizationCache()
+        return (await cache.authorize("T1")), (await cache.authorize("UNKNOWN"))
+
+    blocked, unknown = run(scenario())
+    assert blocked.status == AuthorizationStatus.blocked
+    assert (blocked.company_id, blocked.driver_id, blocked.group_id) == ("C1", "D1", "G1")
+    assert unknown.status == AuthorizationStatus.invalid
+
+
+def test_entries_expire_after_their_ttl(database, run, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(auth_cache.time, "monotonic", clock)
+
+    async def scenario():
+        await add_cards("T1")
+        cache = AuthorizationCache(ttl_seconds=60, negative_ttl_seconds=10)
+        await cache.authorize("T1")
+        await cache.authorize("UNKNOWN")
+        await disable_card("T1")
+
+        clock.now += 30
+        within_ttl = await cache.authorize("T1"), cache.get("UNKNOWN")
+        clock.now += 31
+        after_ttl = await cache.authorize("T1")
+        return within_ttl, after_ttl, cache.hits, cache.misses
+
+    (cached, unknown), reloaded, hits, misses = run(scenario())
+    assert cached.status == AuthorizationStatus.accepted
+    # Unknown tags are kept for the shorter negative TTL
+    assert unknown is None
+    assert reloaded.status == AuthorizationStatus.blocked
+    assert (hits, misses) == (1, 3)
+
+
+def test_card_expiring_while_cached_reports_expired(database, run):
+    async def scenario():
+        await add_cards("T1", expiry=datetime.now() + timedelta(milliseconds=50))
+        cache = AuthorizationCache()
+        first = await cache.authorize("T1")
+        await asyncio.sleep(0.1)
+        return first, await cache.authorize("T1")
+
+    first, later = run(scenario())
+    assert first.status == AuthorizationStatus.accepted
+    assert later.status == AuthorizationStatus.expired
+
+
+def test_least_recently_used_entries_are_evicted(database, run):
+    async def scenario():
+        await add_cards("T1", "T2", "T3")
+        cache = AuthorizationCache(max_entries=2)
+        await cache.authorize("T1")
+        await cache.authorize("T2")
+        cache.get("T1")
+        await cache.authorize("T3")
+        return [id_tag for id_tag in ("T1", "T2", "T3") if cache.get(id_tag) is not None], cache._driver_tags
+
+    cached, driver_tags = run(scenario())
+    assert cached == ["T1", "T3"]
+    assert driver_tags == {("C1", "D1"): {"T1", "T3"}}
+
+
+def test_driver_and_group_invalidation_forget_their_tags(database, run):
+    async def scenario():
+        await add_cards("T1", "T2")
+        cache = AuthorizationCache()
+        await cache.warm()
+        warmed = len(cache)
+        cache.invalidate_driver("C1", "D1")
+        after_driver = len(cache)
+        await cache.warm()
+        cache.invalidate_group("G1")
+        return warmed, after_driver, len(cache), cache._group_tags
+
+    warmed, after_driver, after_group, group_tags = run(scenario())
+    assert warmed == 2
+    assert after_driver == 0
+    assert after_group == 0
+    assert group_tags == {}
+
+
+def slow_queries(monkeypatch):
+    """Hold card queries until the returned event is set"""
+    release = asyncio.Event()
+    query = RFIDCardRepository.get_card_authorizations
+
+    async def held(db, *args, **kwargs):
+        rows = await query(db, *args, **kwargs)
+        await release.wait()
+        return rows
+
+    monkeypatch.setattr(RFIDCardRepository, "get_card_authorizations", held)
+    return release
+
+
+def test_load_invalidated_while_in_flight_is_not_stored(database, run, monkeypatch):
+    async def scenario():
+        await add_cards("T1")
+        release = slow_queries(monkeypatch)
+        cache = AuthorizationCache()
+
+        load = asyncio.create_task(cache.authorize("T1"))
+        await asyncio.sleep(0.05)
+        cache.invalidate("T1")
+        release.set()
+        answer = await load
+        return answer, cache.get("T1"), cache._tag_epochs
+
+    answer, cached, tag_epochs = run(scenario())
+    # The caller still gets its answer, the cache does not keep it
+    assert answer.status == AuthorizationStatus.accepted
+    assert cached is None
+    assert tag_epochs == {}
+
+
+def test_group_invalidation_drops_loads_in_flight(database, run, monkeypatch):
+    async def scenario():
+        await add_cards("T1")
+        release = slow_queries(monkeypatch)
+        cache = AuthorizationCache()
+
+        load = asyncio.create_task(cache.authorize("T1"))
+        await asyncio.sleep(0.05)
+        # The load does not know its group yet, so any group change must drop it
+        cache.invalidate_group("G1")
+        release.set()
+        await load
+        stale = cache.get("T1")
+
+        release.clear()
+        reload = asyncio.create_task(cache.authorize("T1"))
+        await asyncio.sleep(0.05)
+        release.set()
+        await reload
+        return stale, cache.get("T1")
+
+    stale, fresh = run(scenario())
+    assert stale is None
+    assert fresh.status == AuthorizationStatus.accepted
+
+
+def test_concurrent_misses_share_one_query(database, run, monkeypatch):
+    async def scenario():
+        await add_cards("T1")
+        calls = []
+        query = RFIDCardRepository.get_card_authorizations
+
+        async def counted(db, *args, **kwargs):
+            calls.append(args)
+            await asyncio.sleep(0.05)
+            return await query(db, *args, **kwargs)
+
+        monkeypatch.setattr(RFIDCardRepository, "get_card_authorizations", counted)
+        cache = AuthorizationCache()
+        answers = await asyncio.gather(*(cache.authorize("T1") for _ in range(10)))
+        return answers, len(calls)
+
+    answers, queries = run(scenario())
+    assert {answer.status for answer in answers} == {AuthorizationStatus.accepted}
+    assert queries == 1
@@ -0,0 +1,77 @@
+from app.services import boot_admission
+from app.services.boot_admission import BootAdmission
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_burst_is_admitted_then_chargers_wait():
+    admission = BootAdmission(rate=1, burst=3, min_interval=10, max_interval=300, clock=Clock())
+
+    assert [admission.admit(f"CP{i}") for i in range(3)] == [None, None, None]
+    interval = admission.admit("CP3")
+    assert 10 <= interval <= 300
+    assert admission.waiting() == 1
+
+
+def test_bucket_refills_at_the_rate_up_to_the_burst():
+    clock = Clock()
+    admission = BootAdmission(rate=2, burst=4, clock=clock)
+    for i in range(4):
+        admission.admit(f"CP{i}")
+
+    clock.now += 1
+    assert [admission.admit(f"CP{i}") for i in range(4, 7)] == [None, None, 10]
+    clock.now += 3600
+    admitted = [admission.admit(f"CP{i}") for i in range(7, 12)]
+    assert admitted == [None, None, None, None, 10]
+
+
+def test_retry_intervals_spread_over_the_backlog(monkeypatch):
+    monkeypatch.setattr(boot_admission.random, "uniform", lambda low, high: high)
+    admission = BootAdmission(rate=2, burst=0, min_interval=10, max_interval=300, clock=Clock())
+
+    intervals = [admission.admit(f"CP{i}") for i in range(1000)]
+    # Never below the minimum, then as long as the bucket needs for everyone waiting, capped
+    assert intervals[0] == 10
+    assert intervals[99] == 50
+    assert intervals[999] == 300
+
+
+def test_a_retrying_charger_is_counted_once():
+    clock = Clock()
+    admission = BootAdmission(rate=1, burst=1, clock=clock)
+    admission.admit("CP1")
+    admission.admit("CP2")
+    admission.admit("CP2")
+    admission.admit("CP3")
+    assert admission.waiting() == 2
+
+    clock.now += 1
+    assert admission.admit("CP2") is None
+    admission.forget("CP3")
+    assert admission.waiting() == 0
+
+
+def test_chargers_that_never_retry_are_forgotten():
+    clock = Clock()
+    admission = BootAdmission(rate=1, burst=0, min_interval=10, max_interval=60, clock=clock)
+    admission.admit("CP1")
+    clock.now += 100
+    admission.admit("CP2")
+    assert admission.waiting() == 2
+
+    clock.now += 21
+    admission.admit("CP3")
+    assert list(admission._waiting) == ["CP2", "CP3"]
+
+
+def test_rate_zero_accepts_every_boot():
+    admission = BootAdmission(rate=0, burst=0, clock=Clock())
+    assert {admission.admit(f"CP{i}") for i in range(100)} == {None}
+    assert admission.waiting() == 0
@@ -0,0 +1,195 @@
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+
+from app.database.database import SessionLocal
+from app.database.models.models import Charger
+from app.services.liveness import LivenessTracker
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class Connection:
+    def __init__(self, charger_id):
+        self.charge_point = SimpleNamespace(id=charger_id, company_id="C1", site_id="S1")
+        self.closed = 0
+
+    def close(self):
+        self.closed += 1
+
+
+def tracker(clock, intervals=None, **kwargs):
+    # 60s timeout unless the charger has its own interval
+    intervals = intervals or {}
+    return LivenessTracker(
+        tick=5, timeout_factor=2, interval_of=lambda charger_id: intervals.get(charger_id, 30), clock=clock,
+        **kwargs
+    )
+
+
+def expired_ids(liveness):
+    return sorted(watch.charge_point.id for watch in liveness.expire_due())
+
+
+def test_silent_charger_expires_after_its_timeout():
+    clock = Clock()
+    liveness = tracker(clock)
+    connection = Connection("CP1")
+    liveness.watch(connection.charge_point, connection.close)
+
+    clock.now += 59
+    assert expired_ids(liveness) == []
+    clock.now += 5
+    assert expired_ids(liveness) == ["CP1"]
+    # Expired once, not again on later sweeps
+    clock.now += 120
+    assert expired_ids(liveness) == []
+    assert liveness.unwatch(connection.charge_point) is True
+
+
+def test_frames_push_the_deadline_without_touching_the_wheel():
+    clock = Clock()
+    liveness = tracker(clock)
+    connection = Connection("CP1")
+    liveness.watch(connection.charge_point, connection.close)
+    wheel = dict(liveness._wheel)
+
+    for _ in range(10):
+        clock.now += 10
+        liveness.seen("CP1")
+        assert liveness._wheel == wheel
+    clock.now += 55
+    assert expired_ids(liveness) == []
+    clock.now += 10
+    assert expired_ids(liveness) == ["CP1"]
+
+
+def test_timeout_follows_each_chargers_heartbeat_interval():
+    clock = Clock()
+    liveness = tracker(clock, intervals={"SLOW": 300})
+    for charger_id in ("FAST", "SLOW"):
+        connection = Connection(charger_id)
+        liveness.watch(connection.charge_point, connection.close)
+
+    clock.now += 65
+    assert expired_ids(liveness) == ["FAST"]
+    clock.now += 540
+    assert expired_ids(liveness) == ["SLOW"]
+
+
+def test_reconnect_closes_the_half_open_connection():
+    clock = Clock()
+    liveness = tracker(clock)
+    old, new = Connection("CP1"), Connection("CP1")
+    liveness.watch(old.charge_point, old.close)
+    clock.now += 30
+    liveness.watch(new.charge_point, new.close)
+
+    assert (old.closed, new.closed) == (1, 0)
+    # The old connection ending does not stop watching the new one
+    assert liveness.unwatch(old.charge_point) is False
+    clock.now += 35
+    # The old connection's wheel entry is stale
+    assert expired_ids(liveness) == []
+    clock.now += 30
+    assert expired_ids(liveness) == ["CP1"]
+
+
+def test_unwatched_charger_never_expires():
+    clock = Clock()
+    liveness = tracker(clock)
+    connection = Connection("CP1")
+    liveness.watch(connection.charge_point, connection.close)
+    assert liveness.unwatch(connection.charge_point) is False
+
+    clock.now += 600
+    assert expired_ids(liveness) == []
+    assert liveness._wheel == {}
+
+
+def test_late_sweep_catches_up_on_every_slot():
+    clock = Clock()
+    liveness = tracker(clock)
+    for i in range(20):
+        connection = Connection(f"CP{i}")
+        liveness.watch(connection.charge_point, connection.close)
+        clock.now += 7
+
+    clock.now += 3600
+    assert len(expired_ids(liveness)) == 20
+    assert liveness._wheel == {}
+
+
+async def add_chargers(*charger_ids):
+    async with SessionLocal() as db:
+        for charger_id in charger_ids:
+            db.add(Charger(
+                ChargerCompanyId="C1", ChargerSiteId="S1", ChargerId=charger_id, ChargerName=charger_id,
+                ChargerIsOnline=True
+            ))
+        await db.commit()
+
+
+async def online():
+    async with SessionLocal() as db:
+        rows = await db.execute(select(Charger.ChargerId).where(Charger.ChargerIsOnline.is_(True)))
+        return sorted(charger_id for charger_id, in rows)
+
+
+def test_sweep_closes_silent_connections_and_marks_them_offline(database, run):
+    clock = Clock()
+    liveness = tracker(clock)
+    connections = [Connection(charger_id) for charger_id in ("CP1", "CP2", "CP3")]
+
+    async def scenario():
+        await add_chargers("CP1", "CP2", "CP3")
+        for connection in connections:
+            liveness.watch(connection.charge_point, connection.close)
+        clock.now += 30
+        liveness.seen("CP3")
+        clock.now += 35
+        return await liveness.sweep(), await online()
+
+    closed, still_online = run(scenario())
+    assert closed == 2
+    assert [connection.closed for connection in connections] == [1, 1, 0]
+    assert still_online == ["CP3"]
+
+
+def test_failed_offline_update_is_retried_unless_the_charger_came_back(database, run):
+    clock = Clock()
+    sessions = []
+
+    def session_factory():
+        if not sessions:
+            sessions.append(None)
+            raise OperationalError("BEGIN", {}, Exception("database is locked"))
+        return SessionLocal()
+
+    liveness = tracker(clock, session_factory=session_factory)
+    cp1, cp2 = Connection("CP1"), Connection("CP2")
+
+    async def scenario():
+        await add_chargers("CP1", "CP2")
+        liveness.watch(cp1.charge_point, cp1.close)
+        liveness.watch(cp2.charge_point, cp2.close)
+        clock.now += 65
+        with pytest.raises(OperationalError):
+            await liveness.sweep()
+        # CP2 reconnects before the retry, its new connection keeps it online
+        liveness.unwatch(cp2.charge_point)
+        liveness.watch(Connection("CP2").charge_point, lambda: None)
+        clock.now += 5
+        return await liveness.sweep(), await online()
+
+    closed, still_online = run(scenario())
+    assert closed == 0
+    assert still_online == ["CP2"]
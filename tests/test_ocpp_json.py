@@ -0,0 +1,56 @@
+import decimal
+import json
+
+import pytest
+from ocpp import messages
+from ocpp.exceptions import FormatViolationError, PropertyConstraintViolationError, ProtocolError
+from ocpp.messages import Call, CallError, CallResult
+
+from app.adapters.ocpp_json import pack, unpack
+
+FRAMES = [
+    '[2,"19223201","BootNotification",{"chargePointVendor":"V","chargePointModel":"M"}]',
+    '[3,"19223201",{"currentTime":"2024-01-01T00:00:00Z","interval":300,"status":"Accepted"}]',
+    '[4,"19223201","NotImplemented","Unknown action",{"action":"Foo"}]',
+]
+
+
+@pytest.mark.parametrize("frame", FRAMES)
+def test_unpack_matches_the_ocpp_library(frame):
+    expected = messages.unpack(frame)
+    for raw in (frame, frame.encode(), json.loads(frame)):
+        message = unpack(raw)
+        assert type(message) is type(expected)
+        assert vars(message) == vars(expected)
+
+
+@pytest.mark.parametrize("frame, error", [
+    ("not json", FormatViolationError),
+    (b"\xff\xfe", FormatViolationError),
+    ('{"messageTypeId": 2}', ProtocolError),
+    ("[]", ProtocolError),
+    ('[2,"1"]', ProtocolError),
+    ('[9,"1",{}]', PropertyConstraintViolationError),
+])
+def test_malformed_frames_raise_the_ocpp_library_errors(frame, error):
+    with pytest.raises(error):
+        unpack(frame)
+    if isinstance(frame, str):
+        with pytest.raises(error):
+            messages.unpack(frame)
+
+
+@pytest.mark.parametrize("message", [
+    Call("1", "Heartbeat", {}),
+    Call("2", "MeterValues", {"connectorId": 1, "meterValue": [{"sampledValue": [{"value": "12.5"}]}]}),
+    CallResult("3", {"status": "Accepted"}),
+    CallError("4", "InternalError", "Boom", {}),
+])
+def test_pack_matches_to_json(message):
+    assert pack(message) == message.to_json()
+    assert vars(unpack(pack(message))) == vars(message)
+
+
+def test_pack_encodes_decimals_and_non_ascii_like_the_ocpp_library():
+    message = CallResult("5", {"value": decimal.Decimal("1.25"), "name": "Straße"})
+    assert json.loads(pack(message)) == json.loads(message.to_json())
@@ -0,0 +1,103 @@
+import copy
+
+import pytest
+from ocpp import messages
+from ocpp.exceptions import NotImplementedError, OCPPError
+from ocpp.messages import Call, CallResult
+
+from app.services.schema_validation import SchemaValidation
+
+CASES = [
+    Call("1", "BootNotification", {"chargePointVendor": "V", "chargePointModel": "M"}),
+    # required
+    Call("2", "BootNotification", {"chargePointVendor": "V"}),
+    # type
+    Call("3", "Heartbeat", []),
+    Call("4", "StartTransaction", {"connectorId": "1", "idTag": "T", "meterStart": 0, "timestamp": "x"}),
+    # maxLength
+    Call("5", "Authorize", {"idTag": "X" * 21}),
+    # additionalProperties
+    Call("6", "Heartbeat", {"extra": 1}),
+    # enum
+    Call("7", "StatusNotification", {"connectorId": 1, "errorCode": "NoError", "status": "Sleeping"}),
+    # decimal multipleOf, validated on Decimal values
+    Call("8", "SetChargingProfile", {"connectorId": 1, "csChargingProfiles": {
+        "chargingProfileId": 1, "stackLevel": 0, "chargingProfilePurpose": "TxDefaultProfile",
+        "chargingProfileKind": "Absolute", "chargingSchedule": {
+            "chargingRateUnit": "A", "chargingSchedulePeriod": [{"startPeriod": 0, "limit": 16.05}]
+        }
+    }}),
+    Call("9", "SetChargingProfile", {"connectorId": 1, "csChargingProfiles": {
+        "chargingProfileId": 1, "stackLevel": 0, "chargingProfilePurpose": "TxDefaultProfile",
+        "chargingProfileKind": "Absolute", "chargingSchedule": {
+            "chargingRateUnit": "A", "chargingSchedulePeriod": [{"startPeriod": 0, "limit": 16.1}]
+        }
+    }}),
+    CallResult("10", {"status": "Accepted"}, action="SendLocalList"),
+    CallResult("11", {"status": "Maybe"}, action="SendLocalList"),
+]
+
+
+def library_error(message):
+    try:
+        # It replaces the payload of decimal schemas with a Decimal one
+        messages._validate_payload(copy.deepcopy(message), "1.6")
+    except OCPPError as e:
+        return e
+    return None
+
+
+@pytest.fixture(params=["compiled", "draft4"])
+def validation(request):
+    validation = SchemaValidation(default_mode="full")
+    validation.load()
+    if request.param == "draft4":
+        validation._compiled = {}
+    return validation
+
+
+@pytest.mark.parametrize("message", CASES, ids=lambda message: f"{message.unique_id}-{message.action}")
+def test_errors_match_the_ocpp_library(validation, message):
+    expected = library_error(message)
+    if expected is None:
+        validation.validate(message)
+        return
+    with pytest.raises(OCPPError) as raised:
+        validation.validate(message)
+    assert type(raised.value) is type(expected)
+    # The library quotes the payload it converted to Decimal, the message keeps its own
+    assert raised.value.details["cause"].split(" is not valid: ")[-1] == \
+        expected.details["cause"].split(" is not valid: ")[-1]
+
+
+def test_decimal_payload_values_are_accepted(validation):
+    message = copy.deepcopy(CASES[8])
+    messages._validate_payload(message, "1.6")
+    # Now holds Decimal values, which json.dumps cannot encode
+    validation.validate(message)
+
+
+def test_unknown_action_is_not_implemented(validation):
+    with pytest.raises(NotImplementedError):
+        validation.validate(Call("1", "Teleport", {}))
+
+
+def test_modes_and_sampling():
+    validation = SchemaValidation(default_mode="sampled", sample_rate=0.0)
+    invalid = Call("1", "Heartbeat", {"extra": 1})
+
+    validation.validate(invalid)
+    validation.validate(invalid, mode="off")
+    assert validation.skipped == 2
+    with pytest.raises(OCPPError):
+        validation.validate(invalid, mode="full")
+
+    stats = validation.stats()["actions"]["Heartbeat"]["call"]
+    assert (stats["validated"], stats["failed"]) == (1, 1)
+
+
+def test_unknown_charger_mode_falls_back_to_the_default():
+    validation = SchemaValidation(default_mode="full")
+    assert validation.mode_for("CP1", "off") == "off"
+    assert validation.mode_for("CP1", None) == "full"
+    assert validation.mode_for("CP1", "strict") == "full"
@@ -0,0 +1,78 @@
+import asyncio
+
+from sqlalchemy import select
+
+from app.database.database import SessionLocal
+from app.database.models.models import IdBlock
+from app.services.transaction_ids import TransactionIdAllocator
+
+
+async def next_hi(name="transaction"):
+    async with SessionLocal() as db:
+        return (await db.execute(select(IdBlock.IdBlockNextHi).where(IdBlock.IdBlockName == name))).scalar_one()
+
+
+def test_ids_run_through_consecutive_blocks(database, run):
+    async def scenario():
+        allocator = TransactionIdAllocator(block_size=5, low_watermark=0)
+        return [await allocator.next_id() for _ in range(12)], await next_hi()
+
+    ids, hi = run(scenario())
+    assert ids == list(range(1, 13))
+    assert hi == 3
+
+
+def test_workers_sharing_the_database_never_share_ids(database, run):
+    async def scenario():
+        workers = [TransactionIdAllocator(block_size=4, low_watermark=0) for _ in range(3)]
+        ids = []
+        for round_ in range(10):
+            for worker in workers:
+                ids.append(await worker.next_id())
+        return ids
+
+    ids = run(scenario())
+    assert len(ids) == len(set(ids)) == 30
+
+
+def test_restart_does_not_reuse_reserved_ids(database, run):
+    async def first_process():
+        allocator = TransactionIdAllocator(block_size=10, low_watermark=0)
+        return [await allocator.next_id() for _ in range(3)]
+
+    async def second_process():
+        allocator = TransactionIdAllocator(block_size=10, low_watermark=0)
+        await allocator.start()
+        return await allocator.next_id()
+
+    before = run(first_process())
+    after = run(second_process())
+    # The rest of the first block is skipped, not handed out again
+    assert before == [1, 2, 3]
+    assert after == 11
+
+
+def test_concurrent_misses_share_one_reservation(database, run):
+    async def scenario():
+        allocator = TransactionIdAllocator(block_size=100, low_watermark=0)
+        ids = await asyncio.gather(*(allocator.next_id() for _ in range(20)))
+        return ids, await next_hi(), allocator.available()
+
+    ids, hi, available = run(scenario())
+    assert sorted(ids) == list(range(1, 21))
+    assert hi == 1
+    assert available == 80
+
+
+def test_next_block_is_prefetched_below_the_low_watermark(database, run):
+    async def scenario():
+        allocator = TransactionIdAllocator(block_size=10, low_watermark=5)
+        await allocator.start()
+        for _ in range(6):
+            await allocator.next_id()
+        await allocator._reserving
+        return allocator.available(), list(map(tuple, allocator._ranges))
+
+    available, ranges = run(scenario())
+    assert available == 14
+    assert ranges == [(7, 11), (11, 21)]
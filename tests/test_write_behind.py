@@ -0,0 +1,125 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+
+from app.database.database import SessionLocal
+from app.database.models.models import Charger, Connector, MeterSample
+from app.services.write_behind import WriteBehindBuffer
+
+T0 = datetime(2024, 1, 1, 12, 0, 0)
+
+
+def sample(value, timestamp=T0, measurand=1):
+    return {"measurand": measurand, "phase": None, "timestamp": timestamp, "value": value}
+
+
+async def add_charger(charger_id="CP1"):
+    async with SessionLocal() as db:
+        db.add(Charger(ChargerCompanyId="C1", ChargerSiteId="S1", ChargerId=charger_id, ChargerName=charger_id))
+        await db.commit()
+
+
+async def read(query):
+    async with SessionLocal() as db:
+        return (await db.execute(query)).all()
+
+
+def test_heartbeats_and_statuses_keep_the_latest_value():
+    buffer = WriteBehindBuffer()
+    buffer.record_heartbeat("C1", "S1", "CP1", T0)
+    buffer.record_heartbeat("C1", "S1", "CP1", T0 + timedelta(seconds=30))
+    buffer.record_connector_status("C1", "S1", "CP1", "1", "Preparing", T0)
+    buffer.record_connector_status("C1", "S1", "CP1", "1", "Charging", T0)
+    buffer.record_connector_status("C1", "S1", "CP1", "2", "Available", T0)
+
+    assert buffer.pending() == 3
+    assert buffer._heartbeats[("C1", "S1", "CP1")] == T0 + timedelta(seconds=30)
+    assert buffer._connector_statuses[("C1", "S1", "CP1", "1")][0] == "Charging"
+
+
+def test_meter_samples_are_appended_and_capped():
+    buffer = WriteBehindBuffer(max_pending_samples=3)
+    buffer.record_meter_samples(1, [sample(1.0), sample(2.0)])
+    buffer.record_meter_samples(1, [sample(3.0), sample(4.0)])
+
+    assert [row["MeterSampleValue"] for row in buffer._meter_samples] == [2.0, 3.0, 4.0]
+    assert buffer.dropped_samples == 1
+
+
+def test_flush_writes_the_batch(database, run):
+    async def scenario():
+        await add_charger()
+        buffer = WriteBehindBuffer()
+        buffer.record_heartbeat("C1", "S1", "CP1", T0)
+        buffer.record_connector_status("C1", "S1", "CP1", "1", "Available", T0)
+        buffer.record_meter_samples(7, [sample(100.0), sample(16.0, measurand=15)])
+
+        written = await buffer.flush()
+        return (
+            written, buffer.pending(),
+            await read(select(Charger.ChargerLastHeartbeat)),
+            await read(select(Connector.ConnectorStatus)),
+            await read(select(MeterSample.MeterSampleValue).order_by(MeterSample.MeterSampleValue))
+        )
+
+    written, pending, heartbeats, statuses, samples = run(scenario())
+    assert written == 4
+    assert pending == 0
+    assert heartbeats == [(T0,)]
+    assert statuses == [("Available",)]
+    assert samples == [(16.0,), (100.0,)]
+
+
+def test_failing_row_does_not_hold_back_the_batch(database, run):
+    async def scenario():
+        await add_charger()
+        buffer = WriteBehindBuffer(max_row_failures=2)
+        buffer.record_heartbeat("C1", "S1", "CP1", T0)
+        buffer.record_connector_status("C1", "S1", "CP1", "1", "Available", T0)
+        # MeterSampleValue is NOT NULL, so this one row can never be written
+        buffer.record_meter_samples(7, [sample(float(i), T0 + timedelta(seconds=i)) for i in range(5)])
+        buffer.record_meter_samples(7, [sample(None, T0 + timedelta(seconds=9))])
+
+        first = await buffer.flush()
+        retried = buffer.pending()
+        second = await buffer.flush()
+        return (
+            first, retried, second, buffer.pending(),
+            await read(select(Charger.ChargerLastHeartbeat)),
+            await read(select(Connector.ConnectorStatus)),
+            await read(select(MeterSample.MeterSampleValue))
+        )
+
+    first, retried, second, pending, heartbeats, statuses, samples = run(scenario())
+    assert first == 7
+    # The failing row alone is retried once, then dropped
+    assert retried == 1
+    assert second == 0
+    assert pending == 0
+    assert heartbeats == [(T0,)]
+    assert statuses == [("Available",)]
+    assert sorted(value for value, in samples) == [0.0, 1.0, 2.0, 3.0, 4.0]
+
+
+def test_transient_error_requeues_without_overwriting_newer_values(run):
+    later = T0 + timedelta(seconds=60)
+
+    def unavailable():
+        # Queued while the failing flush is writing
+        buffer.record_heartbeat("C1", "S1", "CP1", later)
+        raise OperationalError("BEGIN", {}, Exception("database is locked"))
+
+    buffer = WriteBehindBuffer(session_factory=unavailable)
+    buffer.record_heartbeat("C1", "S1", "CP1", T0)
+    buffer.record_heartbeat("C1", "S1", "CP2", T0)
+    buffer.record_meter_samples(7, [sample(1.0)])
+
+    with pytest.raises(OperationalError):
+        run(buffer.flush())
+
+    assert buffer.pending() == 3
+    assert buffer._heartbeats[("C1", "S1", "CP1")] == later
+    assert buffer._heartbeats[("C1", "S1", "CP2")] == T0
+    assert buffer._row_failures == {}